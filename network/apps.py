@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class NetworkConfig(AppConfig):
     name = 'network'
+
+    def ready(self):
+        from . import auth, cache, db, follows, instrumentation, search, signals  # noqa: F401
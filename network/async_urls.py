@@ -0,0 +1,6 @@
+from . import async_views
+from .urls import build_urlpatterns
+
+# The site with the async API views whatever NETWORK_ASYNC_API says, so that both versions can be
+# served and compared side by side
+urlpatterns = build_urlpatterns(async_views)
@@ -0,0 +1,222 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+
+from .cache import cache_page, get_cached_page, page_key
+from .conditional import (aconditional_feed, following_feeds, get_profile_user, global_feeds, profile_feeds,
+                          profile_posts_feeds)
+from .db import primary_reads, replica_reads
+from .encoding import json_response
+from . import operations
+from .events import encode_events, get_hub
+from . import follows
+from .models import Post
+from .pagination import InvalidCursor
+from .ratelimit import admit_write
+from .views import cursor_pagination, operation_response
+
+# Async versions of the JSON API views in views.py, for ASGI deployments (see NETWORK_ASYNC_API).
+# Reads use the async ORM; writes hand their transaction to a worker thread, as Django's transaction
+# API is sync only.
+
+
+async def get_user(request):
+    # request.user is resolved lazily from the session, which is sync only
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+async def cached_feed_response(request, page, user, source):
+    viewer = await get_user(request)
+    if viewer.is_authenticated or source == 'following':
+        return await paginated_feed_response(request, page, user, source)
+    feed = "all" if source == 'all' else f"profile:{user.pk}"
+    key = page_key(request, page)
+    response, version = await sync_to_async(get_cached_page)(feed, key)
+    if response is None and version is None:
+        response = await paginated_feed_response(request, page, user, source)
+    elif response is None:
+        with primary_reads():
+            response = await paginated_feed_response(request, page, user, source)
+        await sync_to_async(cache_page)(feed, version, key, response)
+    return response
+
+
+async def paginated_feed_response(request, page, user, source):
+    viewer = await get_user(request)
+    if "cursor" in request.GET:
+        try:
+            serialized_posts, total_pages, next_cursor, prev_cursor = await Post.aget_cursor_posts(
+                request.GET["cursor"], 10, user, source, with_count=request.GET.get("count") == "1",
+                viewer=viewer)
+        except InvalidCursor as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        response_data = {
+            'posts': serialized_posts,
+            'pagination': cursor_pagination(next_cursor, prev_cursor, total_pages),
+        }
+        return json_response(response_data)
+
+    serialized_posts, total_pages, has_next, has_previous = await Post.aget_paginated_posts(
+        page, 10, user, source, viewer=viewer)
+    response_data = {
+        'posts': serialized_posts,
+        'pagination': {
+            'current_page': page,
+            'total_pages': total_pages,
+            'has_next': has_next,
+            'has_previous': has_previous,
+        }
+    }
+    return json_response(response_data)
+
+
+@replica_reads
+@aconditional_feed(global_feeds)
+async def posts(request, page=1):
+    return await cached_feed_response(request, page, await get_user(request), 'all')
+
+
+@replica_reads
+async def following(request, page=1):
+    user = await get_user(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path(), 'login')
+    return await _following(request, page=page)
+
+
+@aconditional_feed(following_feeds)
+async def _following(request, page=1):
+    return await cached_feed_response(request, page, await get_user(request), 'following')
+
+
+@replica_reads
+@aconditional_feed(profile_feeds)
+async def profile(request, username):
+    include = set(filter(None, request.GET.get("include", "").split(",")))
+    if include - {"posts", "likes"}:
+        return JsonResponse({"error": "include accepts 'posts' and 'likes'."}, status=400)
+
+    profile_user = await sync_to_async(get_profile_user)(request, username)
+    requesting_user = await get_user(request)
+    is_following = False
+
+    if requesting_user.is_authenticated:
+        is_following = await sync_to_async(follows.is_following)(requesting_user.pk, profile_user.pk)
+
+    response_data = {
+        'user': dict(profile_user.serialize(), **profile_user.summary.serialize()),
+        'is_following': is_following,
+    }
+    for section, source in (("posts", "profile"), ("likes", "liked")):
+        if section in include:
+            serialized_posts, _, next_cursor, prev_cursor = await Post.aget_cursor_posts(
+                "", 10, profile_user, source, viewer=requesting_user)
+            response_data[section] = {
+                'posts': serialized_posts,
+                'pagination': cursor_pagination(next_cursor, prev_cursor),
+            }
+    return json_response(response_data)
+
+
+@replica_reads
+@aconditional_feed(profile_posts_feeds)
+async def profile_posts(request, username, page=1):
+    profile_user = await sync_to_async(get_profile_user)(request, username)
+    return await cached_feed_response(request, page, profile_user, 'profile')
+
+
+@admit_write('follow')
+async def follow(request, username):
+    user = await get_user(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path(), 'login')
+
+    if request.method == "POST":
+        return operation_response(*await sync_to_async(operations.follow)(user, username))
+
+    return JsonResponse({"message": "Invalid request method."})
+
+
+@admit_write('follow')
+async def unfollow(request, username):
+    if request.method == "POST":
+        user = await get_user(request)
+        return operation_response(*await sync_to_async(operations.unfollow)(user, username))
+
+    return JsonResponse({"message": "Invalid request method."})
+
+
+@admit_write('like')
+async def like(request, post_id):
+    if request.method != 'POST':
+        return JsonResponse({"error": "POST request required."}, status=400)
+
+    user = await get_user(request)
+    if not user.is_authenticated:
+        return JsonResponse({"error": "Authentication required."}, status=401)
+
+    return operation_response(*await sync_to_async(operations.like)(user, post_id))
+
+
+@admit_write('like')
+async def unlike(request, post_id):
+    if request.method != 'POST':
+        return JsonResponse({"error": "POST request required."}, status=400)
+
+    user = await get_user(request)
+    if not user.is_authenticated:
+        return JsonResponse({"error": "Authentication required."}, status=401)
+
+    return operation_response(*await sync_to_async(operations.unlike)(user, post_id))
+
+
+# At most this many posts on screen get like updates from one event stream
+EVENTS_MAX_POSTS = 100
+
+
+async def events(request):
+    # An open stream holds a connection for minutes, which only an event loop can afford
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "The event stream is only served over ASGI."}, status=501)
+
+    try:
+        post_ids = [int(post_id) for post_id in request.GET.get("posts", "").split(",") if post_id]
+    except ValueError:
+        return JsonResponse({"error": "'posts' must be a comma separated list of post ids."}, status=400)
+
+    # Like updates for the posts on screen, and new posts by the authors the viewer follows
+    channels = [f"likes:{post_id}" for post_id in post_ids[:EVENTS_MAX_POSTS]]
+    viewer = await get_user(request)
+    if viewer.is_authenticated:
+        channels += [f"posts:{user_id}" for user_id in await sync_to_async(follows.following_ids)(viewer.pk)]
+
+    response = StreamingHttpResponse(stream_events(channels, viewer.pk), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+async def stream_events(channels, viewer_id):
+    keepalive = getattr(settings, "NETWORK_EVENTS_KEEPALIVE", 15)
+    max_age = getattr(settings, "NETWORK_EVENTS_MAX_AGE", 300)
+    loop = asyncio.get_running_loop()
+    # Subscribed here rather than in the view, so that the events are read on the loop serving the stream
+    subscription = get_hub().subscribe(channels)
+    try:
+        yield "retry: 5000\n\n"
+        # Streams are closed after max_age and reopened by the browser, so that an abandoned stream
+        # does not hold its subscription forever
+        deadline = loop.time() + max_age
+        while loop.time() < deadline:
+            events = await subscription.get_many(min(keepalive, deadline - loop.time()))
+            if subscription.overflowed:
+                yield "event: reset\ndata: {}\n\n"
+                break
+            yield encode_events(events, viewer_id) or ": keepalive\n\n"
+    finally:
+        subscription.close()
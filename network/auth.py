@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+# Authentication without database reads on the hot path. With a shared cache, sessions are cache-backed
+# (SESSION_ENGINE), and this backend keeps the user objects it loads in the NETWORK_USER_CACHE_ALIAS cache
+# for NETWORK_USER_CACHE_TIMEOUT seconds, so that a logged-in read resolves request.user without a query.
+# Without that cache (None), users are read from the database. Django's AuthenticationMiddleware already
+# resolves the user lazily, when a view first touches request.user.
+#
+# A cached user is dropped whenever the user row is saved, e.g. on a password change, which also ends
+# their other sessions as usual. Their follower and following counters, updated in place, may be stale
+# for the length of the timeout: code that acts on them, such as TimelineEntry.fan_out, reads them from
+# the database rather than from request.user.
+
+USER_KEY = "network:auth-user:{user_id}"
+
+
+def _cache():
+    alias = getattr(settings, "NETWORK_USER_CACHE_ALIAS", None)
+    return caches[alias] if alias else None
+
+
+@checks.register(checks.Tags.caches)
+def check_user_cache(app_configs, **kwargs):
+    alias = getattr(settings, "NETWORK_USER_CACHE_ALIAS", None)
+    if alias and isinstance(caches[alias], LocMemCache):
+        return [checks.Error(
+            f"NETWORK_USER_CACHE_ALIAS {alias!r} is a per-process cache, which other processes cannot drop "
+            "changed users from.",
+            hint="Use a cache shared by every process, or None to read users from the database.",
+            id="network.E002",
+        )]
+    return []
+
+
+def _timeout():
+    return getattr(settings, "NETWORK_USER_CACHE_TIMEOUT", 60)
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        cache, key = _cache(), USER_KEY.format(user_id=user_id)
+        if cache is None:
+            return super().get_user(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None and _timeout():
+                cache.set(key, user, _timeout())
+        return user
+
+
+def forget_user(user_id):
+    cache = _cache()
+    if cache is not None:
+        cache.delete(USER_KEY.format(user_id=user_id))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_changed(sender, instance, **kwargs):
+    forget_user(instance.pk)
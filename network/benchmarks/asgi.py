@@ -0,0 +1,73 @@
+import asyncio
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import AsyncClient, Client, override_settings
+
+from .. import async_views, views
+from ..urls import build_urlpatterns
+from .stats import summarize
+
+
+def _urlconf(name, api):
+    urlconf = types.ModuleType(name)
+    urlconf.urlpatterns = build_urlpatterns(api)
+    return urlconf
+
+
+def run_wsgi(paths, requests, concurrency):
+    # Each worker thread stands for one WSGI worker thread, blocking on its database calls
+    def worker(count):
+        client = Client()
+        latencies = []
+        for i in range(count):
+            start = time.perf_counter()
+            client.get(paths[i % len(paths)])
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    counts = [requests // concurrency + (i < requests % concurrency) for i in range(concurrency)]
+    with override_settings(ROOT_URLCONF=_urlconf("bench_wsgi_urls", views)):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            latencies = [latency for result in executor.map(worker, counts) for latency in result]
+        elapsed = time.perf_counter() - start
+    return summarize(latencies, elapsed)
+
+
+def run_asgi(paths, requests, concurrency):
+    # Concurrent clients share one event loop, the way an ASGI server multiplexes them
+    async def main():
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one(path):
+            async with semaphore:
+                start = time.perf_counter()
+                await client.get(path)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(paths[i % len(paths)]) for i in range(requests)))
+        return latencies, time.perf_counter() - start
+
+    with override_settings(ROOT_URLCONF=_urlconf("bench_asgi_urls", async_views)):
+        latencies, elapsed = asyncio.run(main())
+    return summarize(latencies, elapsed)
+
+
+def compare(paths, requests=500, concurrency=16):
+    """
+    Drive the same read API paths through the WSGI (sync views) and ASGI (async views) handlers with
+    ``concurrency`` concurrent clients, and report throughput and latency percentiles for each.
+    """
+    with override_settings(ALLOWED_HOSTS=["testserver"]):
+        return {
+            "paths": list(paths),
+            "requests": requests,
+            "concurrency": concurrency,
+            "wsgi": run_wsgi(paths, requests, concurrency),
+            "asgi": run_asgi(paths, requests, concurrency),
+        }
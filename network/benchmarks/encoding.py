@@ -0,0 +1,58 @@
+import datetime
+import time
+
+from django.http import JsonResponse
+from django.test import override_settings
+from django.utils import timezone
+
+from ..encoding import SerializedPost, json_response, orjson, post_fragments
+
+
+def _page(posts):
+    start = timezone.now()
+    return [SerializedPost({
+        "id": i,
+        "body": f"Post number {i}, with a body of a typical length for a short social network post.",
+        "user": f"user{i % 500}",
+        "timestamp": (start - datetime.timedelta(seconds=i)).isoformat(),
+        "like_count": i % 97,
+        "liked_by_me": i % 3 == 0,
+    }) for i in range(posts)]
+
+
+def _best_of(repeat, encode):
+    # Best run, in milliseconds, and the size of what it produced
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(encode().content)
+        timings.append(time.perf_counter() - start)
+    return {"ms": round(min(timings) * 1000, 3), "bytes": size}
+
+
+def compare(posts=10000, repeat=5):
+    """
+    Time the encoding of one feed page of ``posts`` posts into a response: the way the views used to
+    (JsonResponse with the strftime timestamps), with each backend, and with spliced fragments cold
+    and warm.
+    """
+    page = _page(posts)
+    legacy = [dict(post, timestamp=datetime.datetime.fromisoformat(post["timestamp"]).strftime(
+        "%b %d %Y, %I:%M:%S %p")) for post in page]
+    plain = [dict(post) for post in page]
+    pagination = {"next_cursor": "abc", "prev_cursor": None, "has_next": True, "has_previous": False}
+
+    results = {"posts": posts, "legacy_jsonresponse": _best_of(repeat, lambda: JsonResponse(
+        {"posts": legacy, "pagination": pagination}, safe=False))}
+    for backend in ["stdlib"] + (["orjson"] if orjson is not None else []):
+        with override_settings(NETWORK_JSON_ENCODER=backend):
+            results[backend] = _best_of(repeat, lambda: json_response({"posts": plain, "pagination": pagination}))
+
+            def spliced():
+                return json_response({"posts": page, "pagination": pagination})
+
+            post_fragments.clear()
+            results[f"{backend}_fragments_cold"] = _best_of(1, spliced)
+            results[f"{backend}_fragments_warm"] = _best_of(repeat, spliced)
+    post_fragments.clear()
+    return results
@@ -0,0 +1,121 @@
+import datetime
+import itertools
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import User, Follow, Post, PostScore, ProfileSummary, TimelineEntry
+from ..search import rebuild_index
+
+USERNAME_PREFIX = "synth-"
+BATCH_SIZE = 1000
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def _follow_graph(rng, users, follows_per_user, alpha):
+    # Everybody follows about follows_per_user others, picked with probability decreasing as a power of
+    # their popularity rank: follower counts end up power-law distributed, as in real social graphs
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) ** alpha for rank in range(users)))
+    population = range(users)
+    graph = []
+    for follower in population:
+        count = min(users - 1, max(0, round(rng.expovariate(1 / follows_per_user)))) if follows_per_user else 0
+        followed = set()
+        # Draw with replacement and drop repeats; give up on the rare follower who keeps drawing the same few
+        for _ in range(10):
+            followed.update(rng.choices(population, cum_weights=cum_weights, k=count - len(followed)))
+            followed.discard(follower)
+            if len(followed) >= count:
+                break
+        graph.append(sorted(followed))
+    return graph
+
+
+def generate_network(users=1000, posts_per_user=10, likes_per_post=5, follows_per_user=20, alpha=1.1,
+                     days=30, seed=0):
+    """
+    Create a reproducible synthetic network for benchmarks: ``users`` users with power-law distributed
+    follower counts, ``posts_per_user`` posts each spread over the last ``days`` days, and on average
+    ``likes_per_post`` likes per post, going more to the posts of popular authors. Rows are written
+    with bulk_create, counters are set as they are written and timelines, the search index, the
+    ranking scores and the profile summaries are rebuilt at the end.
+
+    Generated users are named synth-<n> and have no usable password. Returns the number of rows of
+    each kind created.
+    """
+    rng = random.Random(seed)
+    graph = _follow_graph(rng, users, follows_per_user, alpha)
+    follower_counts = [0] * users
+    for followed in graph:
+        for index in followed:
+            follower_counts[index] += 1
+
+    now = timezone.now()
+    password = make_password(None)
+    with transaction.atomic():
+        created_users = []
+        for chunk in _chunks(range(users), BATCH_SIZE):
+            created_users += User.objects.bulk_create([User(
+                username=f"{USERNAME_PREFIX}{index}", email=f"{USERNAME_PREFIX}{index}@example.com",
+                password=password, following_count=len(graph[index]), follower_count=follower_counts[index],
+            ) for index in chunk])
+        user_ids = [user.pk for user in created_users]
+
+        for chunk in _chunks(((follower, followed) for follower in range(users) for followed in graph[follower]),
+                             BATCH_SIZE):
+            Follow.objects.bulk_create([Follow(follower_id=user_ids[follower], following_id=user_ids[followed])
+                                        for follower, followed in chunk])
+
+        # Likes of a post are proportional to its author's audience
+        mean_weight = sum(count + 1 for count in follower_counts) / users
+        specs = []
+        for index in range(users):
+            for _ in range(posts_per_user):
+                expected = likes_per_post * (follower_counts[index] + 1) / mean_weight
+                like_count = min(users, int(expected) + (rng.random() < expected % 1))
+                age = datetime.timedelta(seconds=rng.uniform(0, days * 86400))
+                specs.append((index, now - age, like_count))
+        specs.sort(key=lambda spec: spec[1])
+
+        post_count = like_total = 0
+        through = Post.likes.through
+        for chunk in _chunks(specs, BATCH_SIZE):
+            posts = Post.objects.bulk_create([Post(
+                user_id=user_ids[index], body=f"Synthetic post {post_count + i} by {USERNAME_PREFIX}{index}",
+                like_count=like_count,
+            ) for i, (index, _, like_count) in enumerate(chunk)])
+            # auto_now_add overrides timestamps on insert
+            for post, (_, timestamp, _) in zip(posts, chunk):
+                post.timestamp = timestamp
+            Post.objects.bulk_update(posts, ["timestamp"], batch_size=BATCH_SIZE)
+            likes = [through(post_id=post.pk, user_id=user_ids[liker])
+                     for post, (_, _, like_count) in zip(posts, chunk)
+                     for liker in rng.sample(range(users), like_count)]
+            through.objects.bulk_create(likes, batch_size=BATCH_SIZE)
+            post_count += len(posts)
+            like_total += len(likes)
+
+        TimelineEntry.rebuild()
+        rebuild_index()
+        PostScore.refresh()
+        ProfileSummary.rebuild()
+
+    return {
+        "users": users,
+        "follows": sum(len(followed) for followed in graph),
+        "posts": post_count,
+        "likes": like_total,
+        "timeline_entries": TimelineEntry.objects.count(),
+    }
+
+
+def delete_network():
+    # Posts, likes, follows and timeline entries go with their users
+    return User.objects.filter(username__startswith=USERNAME_PREFIX).delete()[0]
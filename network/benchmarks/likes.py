@@ -0,0 +1,70 @@
+import time
+
+from django.test import Client, override_settings
+
+from ..likes import buffer_like, flush_likes
+from ..models import Post, User
+
+USERNAME = "bench-liker"
+
+
+def _throughput(likes, elapsed):
+    return {"likes": likes, "seconds": round(elapsed, 3), "likes_per_second": round(likes / elapsed, 1)}
+
+
+def _timed_requests(client, posts, batching):
+    with override_settings(NETWORK_LIKE_BATCHING=batching, NETWORK_LIKE_BATCH_INTERVAL=0):
+        start = time.perf_counter()
+        for post in posts:
+            client.post(f"/api/like/{post.pk}")
+        # The batched run is only done once its likes are written
+        flush_likes()
+        return _throughput(len(posts), time.perf_counter() - start)
+
+
+def _timed_writes(user, posts, batching):
+    with override_settings(NETWORK_LIKE_BATCH_INTERVAL=0):
+        start = time.perf_counter()
+        for post in posts:
+            if batching:
+                buffer_like(post.pk, user.pk, True)
+            else:
+                post.add_like(user)
+        flush_likes()
+        return _throughput(len(posts), time.perf_counter() - start)
+
+
+def _speedup(results):
+    return round(results["batched"]["likes_per_second"] / results["unbatched"]["likes_per_second"], 1)
+
+
+def compare(likes=1000, batch_size=500):
+    """
+    Like ``likes`` posts with likes written one by one and then batched, and report the throughput of
+    each: through the like view one request at a time, and at the write path alone (add_like against
+    buffer_like), where the batching applies. Works on throwaway rows in the configured database,
+    which are deleted afterwards.
+    """
+    user = User.objects.create_user(USERNAME)
+    try:
+        Post.objects.bulk_create([Post(user=user, body=f"Benchmark post {i}") for i in range(4 * likes)])
+        posts = list(Post.objects.filter(user=user).order_by("id"))
+        client = Client()
+        client.force_login(user)
+        # Without rate limits, which would refuse most of the likes
+        with override_settings(ALLOWED_HOSTS=["testserver"], NETWORK_LIKE_BATCH_SIZE=batch_size,
+                               NETWORK_RATE_LIMITS={}):
+            requests = {
+                "unbatched": _timed_requests(client, posts[:likes], batching=False),
+                "batched": _timed_requests(client, posts[likes:2 * likes], batching=True),
+            }
+            writes = {
+                "unbatched": _timed_writes(user, posts[2 * likes:3 * likes], batching=False),
+                "batched": _timed_writes(user, posts[3 * likes:], batching=True),
+            }
+        return {
+            "requests": dict(requests, speedup=_speedup(requests)),
+            "writes": dict(writes, speedup=_speedup(writes)),
+        }
+    finally:
+        user.delete()
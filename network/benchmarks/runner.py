@@ -0,0 +1,121 @@
+import platform
+import subprocess
+import time
+
+import django
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from ..models import User, Follow, Post
+from .stats import summarize
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _endpoints(requests):
+    # Requests for each endpoint, built from the busiest rows so that they exercise the heavy cases
+    viewer = User.objects.order_by("-following_count", "id").first()
+    author = User.objects.order_by("-follower_count", "id").first()
+    post = Post.objects.order_by("-like_count", "id").first()
+    if viewer is None or post is None:
+        raise ValueError("No data to benchmark, generate a network first.")
+    # Posts the viewer has not liked, to like and then unlike again
+    unliked = list(Post.objects.exclude(likes=viewer).order_by("-timestamp").values_list("id", flat=True)[
+        :requests])
+
+    return viewer, {
+        "posts_anonymous": [("get", "/api/posts?cursor=", False)],
+        "posts": [("get", "/api/posts?cursor=", True)],
+        "posts_page": [("get", "/api/posts/1", True)],
+        "following": [("get", "/api/following?cursor=", True)],
+        "profile": [("get", f"/api/profile/{author.username}", True)],
+        "profile_posts": [("get", f"/api/profile/{author.username}/posts?cursor=", True)],
+        "profile_likes": [("get", f"/api/profile/{viewer.username}/likes?cursor=", True)],
+        "post": [("get", f"/api/post/{post.pk}", True)],
+        "post_likes": [("get", f"/api/posts/{post.pk}/likes", True)],
+        "ranked": [("get", "/api/ranked?cursor=", True)],
+        "search": [("get", "/api/search?q=synthetic+post&cursor=", True)],
+        "like": [("post", f"/api/like/{post_id}", True) for post_id in unliked],
+        "unlike": [("post", f"/api/unlike/{post_id}", True) for post_id in unliked],
+    }
+
+
+def _measure(clients, calls, requests, warmup):
+    latencies, queries, sizes, statuses = [], [], [], {}
+    for i in range(warmup + requests):
+        method, path, authenticated = calls[i % len(calls)]
+        client = clients[authenticated]
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = getattr(client, method)(path)
+            latency = time.perf_counter() - start
+        if i < warmup:
+            continue
+        latencies.append(latency)
+        queries.append(len(captured))
+        sizes.append(len(response.content))
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    return dict(
+        summarize(latencies, sum(latencies)),
+        statuses=statuses,
+        queries_mean=round(sum(queries) / len(queries), 2),
+        queries_max=max(queries),
+        bytes_mean=round(sum(sizes) / len(sizes)),
+    )
+
+
+def run(requests=100, warmup=5, endpoints=None):
+    """
+    Drive each API endpoint ``requests`` times through the test client, after ``warmup`` unmeasured
+    requests, against the data in the configured database (see the generate_network command). Returns
+    per-endpoint latency percentiles, query counts and response sizes, with the commit and data size
+    they were measured on, so that runs can be compared between commits.
+
+    Writes are undone: every post liked by the "like" endpoint is unliked by the "unlike" one.
+    """
+    viewer, calls = _endpoints(requests)
+    selected = endpoints or list(calls)
+    unknown = set(selected) - set(calls)
+    if unknown:
+        raise ValueError(f"Unknown endpoints: {', '.join(sorted(unknown))}.")
+    # Likes and unlikes must come in pairs and cannot be replayed by the warmup
+    if "like" in selected or "unlike" in selected:
+        selected = [name for name in selected if name not in ("like", "unlike")] + ["like", "unlike"]
+
+    authenticated = Client()
+    authenticated.force_login(viewer)
+    clients = {False: Client(), True: authenticated}
+
+    results = {}
+    # Without rate limits, which would refuse most of the writes
+    with override_settings(ALLOWED_HOSTS=["testserver"], NETWORK_RATE_LIMITS={}):
+        for name in selected:
+            writes = name in ("like", "unlike")
+            count = min(requests, len(calls[name])) if writes else requests
+            if count:
+                results[name] = _measure(clients, calls[name], count, 0 if writes else warmup)
+
+    return {
+        "meta": {
+            "commit": _commit(),
+            "created": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "requests": requests,
+            "warmup": warmup,
+            "users": User.objects.count(),
+            "follows": Follow.objects.count(),
+            "posts": Post.objects.count(),
+            "likes": Post.likes.through.objects.count(),
+        },
+        "endpoints": results,
+    }
@@ -0,0 +1,60 @@
+import time
+
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from ..models import Post, User
+from .stats import summarize
+
+USERNAME = "bench-reader"
+
+# Django's defaults, which the project used before network.auth: database sessions, uncached users
+DATABASE_AUTH = {
+    "SESSION_ENGINE": "django.contrib.sessions.backends.db",
+    "AUTHENTICATION_BACKENDS": ["django.contrib.auth.backends.ModelBackend"],
+}
+
+
+def _measure(client, path, requests):
+    client.get(path)
+    latencies, queries, auth_queries = [], [], []
+    for _ in range(requests):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            client.get(path)
+            latencies.append(time.perf_counter() - start)
+        queries.append(len(captured))
+        auth_queries.append(len([query for query in captured
+                                 if "django_session" in query["sql"] or 'FROM "network_user"' in query["sql"]]))
+    return dict(
+        summarize(latencies, sum(latencies)),
+        queries_mean=round(sum(queries) / requests, 2),
+        session_and_user_queries_mean=round(sum(auth_queries) / requests, 2),
+    )
+
+
+def compare(requests=100, path="/api/posts?cursor="):
+    """
+    Read ``path`` ``requests`` times anonymously and logged in, first with database sessions and users
+    and then with the configured session engine and authentication backend, and report the queries and
+    latency per request of each. Works on a throwaway user in the configured database, and on its
+    posts if it has no other.
+    """
+    user = User.objects.create_user(USERNAME)
+    try:
+        if not Post.objects.exists():
+            Post.objects.bulk_create([Post(user=user, body=f"Benchmark post {i}") for i in range(10)])
+        results = {}
+        for name, overrides in (("database", DATABASE_AUTH), ("cached", {})):
+            # Clients made under the settings, so that their handlers load the middleware with them
+            with override_settings(ALLOWED_HOSTS=["testserver"], **overrides):
+                anonymous, authenticated = Client(), Client()
+                authenticated.force_login(user)
+                results[name] = {
+                    "anonymous": _measure(anonymous, path, requests),
+                    "authenticated": _measure(authenticated, path, requests),
+                }
+        return results
+    finally:
+        user.delete()
@@ -0,0 +1,23 @@
+import math
+
+
+def percentile(samples, q):
+    # Nearest-rank percentile of an already sorted list
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, max(0, math.ceil(q / 100 * len(samples)) - 1))]
+
+
+def summarize(latencies, elapsed):
+    """
+    Summarize request latencies (seconds) measured over ``elapsed`` seconds of wall time.
+    """
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+        "p90_ms": round(percentile(latencies, 90) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3) if latencies else None,
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else None,
+    }
@@ -0,0 +1,128 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.http import HttpResponse
+
+# Rendered feed pages are stored under versioned keys: "network:feed:<feed>:<version>:<page>".
+# Changing a feed bumps its version, so stale pages are never read again and simply expire.
+# A version is the time of the feed's last change in nanoseconds, which also makes it usable as a
+# Last-Modified validator and keeps it from ever repeating, even if the version key gets evicted.
+VERSION_KEY = "network:feed-version:{feed}"
+PAGE_KEY = "network:feed:{feed}:{version}:{page}"
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def _cache():
+    # Pages and versions are only kept in a cache shared by every process, where a change reaches them all.
+    # Without one, feeds have no versions: nothing is cached and responses carry no validators.
+    alias = getattr(settings, "NETWORK_FEED_CACHE_ALIAS", None)
+    return caches[alias] if alias else None
+
+
+@checks.register(checks.Tags.caches)
+def check_feed_cache(app_configs, **kwargs):
+    alias = getattr(settings, "NETWORK_FEED_CACHE_ALIAS", None)
+    if alias and isinstance(caches[alias], LocMemCache):
+        return [checks.Error(
+            f"NETWORK_FEED_CACHE_ALIAS {alias!r} is a per-process cache, which other processes cannot drop "
+            "changed feeds from.",
+            hint="Use a cache shared by every process, or None not to cache feed pages.",
+            id="network.E003",
+        )]
+    return []
+
+
+def _timeout():
+    return getattr(settings, "NETWORK_FEED_CACHE_TIMEOUT", 300)
+
+
+def _count(stat, count=1):
+    with _stats_lock:
+        _stats[stat] += count
+
+
+def feed_cache_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def feed_versions(feeds):
+    # {feed: version}, or None without a feed cache
+    cache = _cache()
+    if cache is None:
+        return None
+    keys = {VERSION_KEY.format(feed=feed): feed for feed in feeds}
+    versions = {keys[key]: version for key, version in cache.get_many(list(keys)).items()}
+    missing = [feed for feed in feeds if feed not in versions]
+    if missing:
+        # An unknown version means nothing is cached for the feed yet; start it now. Versions must
+        # outlive the pages they guard, so they never expire.
+        now = time.time_ns()
+        for feed in missing:
+            cache.add(VERSION_KEY.format(feed=feed), now, timeout=None)
+        versions.update({feed: cache.get(VERSION_KEY.format(feed=feed), now) for feed in missing})
+    return versions
+
+
+def feed_version(feed):
+    versions = feed_versions([feed])
+    return versions[feed] if versions is not None else None
+
+
+def invalidate_feed(feed):
+    invalidate_feeds([feed])
+
+
+def invalidate_feeds(feeds):
+    # Bumped now for reads within the transaction, and again once it commits, so that a page rendered by
+    # a concurrent request from the data before the commit is never stored under the final version
+    def bump():
+        now = time.time_ns()
+        cache.set_many({VERSION_KEY.format(feed=feed): now for feed in feeds}, timeout=None)
+
+    cache = _cache()
+    if cache is None:
+        return
+    feeds = list(feeds)
+    bump()
+    transaction.on_commit(bump)
+    _count("invalidations", len(feeds))
+
+
+def page_key(request, page):
+    # Identifies one page of a feed: its page number, or its cursor and whether a count was requested
+    if "cursor" in request.GET:
+        return f"cursor:{request.GET['cursor']}:{request.GET.get('count') == '1'}"
+    return f"page:{page}"
+
+
+def get_cached_page(feed, page):
+    """
+    Return ``(response, version)``: the cached page of the feed's current version, or None, and that
+    version, under which a page rendered after the lookup is to be stored with cache_page(); None
+    without a page cache.
+    """
+    version = feed_version(feed)
+    if version is None:
+        return None, None
+    content = _cache().get(PAGE_KEY.format(feed=feed, version=version, page=page))
+    if content is None:
+        _count("misses")
+        return None, version
+    _count("hits")
+    return HttpResponse(content, content_type="application/json"), version
+
+
+def cache_page(feed, version, page, response):
+    # The version must be read before rendering: read after, it could be one bumped by a change the
+    # page does not include
+    if version is not None and response.status_code == 200:
+        _cache().set(PAGE_KEY.format(feed=feed, version=version, page=page), response.content, _timeout())
+    return response
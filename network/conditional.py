@@ -0,0 +1,110 @@
+import hashlib
+from calendar import timegm
+from datetime import datetime, timezone
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import condition
+
+from .cache import feed_versions, page_key
+from .follows import following_ids
+from .likes import pending_likes
+from .models import ProfileSummary, User
+
+# Conditional GET for the read APIs. A response's validators are derived from the versions of the
+# feeds it is built from (see cache.py), so an unchanged page is answered with 304 Not Modified
+# without loading or serializing any post. Without a feed cache shared by every process there are no
+# versions that every process sees change, and responses carry no validators.
+
+
+def global_feeds(request, page=1):
+    return ["all"]
+
+
+def following_feeds(request, page=1):
+    # The viewer's own version changes when they follow or unfollow someone
+    followed = following_ids(request.user.pk)
+    return [f"user:{request.user.pk}"] + [f"profile:{user_id}" for user_id in followed]
+
+
+def get_profile_user(request, username):
+    # Looked up once per request, by the validators and then by the view, together with the user's
+    # summary so that the profile needs no other query
+    if getattr(request, "_profile_user", None) is None:
+        request._profile_user = get_object_or_404(User.objects.select_related("summary"), username=username)
+        ProfileSummary.for_user(request._profile_user)
+    return request._profile_user
+
+
+def profile_posts_feeds(request, username, page=1):
+    return [f"profile:{get_profile_user(request, username).pk}"]
+
+
+def profile_likes_feeds(request, username):
+    # Liked posts may be anyone's, and every post change bumps the global feed
+    return [f"user:{get_profile_user(request, username).pk}", "all"]
+
+
+def profile_feeds(request, username):
+    user_id = get_profile_user(request, username).pk
+    feeds = [f"user:{user_id}", f"profile:{user_id}"]
+    if "likes" in request.GET.get("include", ""):
+        feeds.append("all")
+    return feeds
+
+
+def feed_validators(request, feeds_for, *args, **kwargs):
+    # The ETag and Last-Modified of a response built from the feeds returned by feeds_for, or None
+    if not hasattr(request, "_feed_validators"):
+        versions = feed_versions(feeds_for(request, *args, **kwargs))
+        if versions is None:
+            request._feed_validators = (None, None)
+            return request._feed_validators
+        # liked_by_me and is_following depend on who is asking, and so do their own unflushed likes
+        viewer = request.user.pk if request.user.is_authenticated else 0
+        state = repr((sorted(versions.items()), page_key(request, kwargs.get("page", 1)),
+                      request.GET.get("include"), viewer, sorted(pending_likes(viewer).items())))
+        etag = hashlib.sha1(state.encode()).hexdigest()
+        last_modified = datetime.fromtimestamp(max(versions.values()) / 1e9, tz=timezone.utc)
+        request._feed_validators = (etag, last_modified)
+    return request._feed_validators
+
+
+def conditional_feed(feeds_for):
+    """
+    Decorate a read view with ETag/Last-Modified support. ``feeds_for`` receives the view arguments
+    and returns the feeds the response depends on.
+    """
+    return condition(
+        etag_func=lambda request, *args, **kwargs: feed_validators(request, feeds_for, *args, **kwargs)[0],
+        last_modified_func=lambda request, *args, **kwargs: feed_validators(request, feeds_for, *args,
+                                                                            **kwargs)[1],
+    )
+
+
+def aconditional_feed(feeds_for):
+    """
+    Async version of conditional_feed; Django's condition decorator only wraps sync views.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return await view(request, *args, **kwargs)
+            etag, last_modified = await sync_to_async(feed_validators)(request, feeds_for, *args, **kwargs)
+            if etag is None:
+                return await view(request, *args, **kwargs)
+            etag = quote_etag(etag)
+            last_modified = timegm(last_modified.utctimetuple())
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if not response.has_header("Last-Modified"):
+                response.headers["Last-Modified"] = http_date(last_modified)
+            response.headers.setdefault("ETag", etag)
+            return response
+        return inner
+    return decorator
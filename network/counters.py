@@ -0,0 +1,38 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(queryset, group_field):
+    # The number of rows of queryset whose group_field is the outer row's pk, for an annotate() or update()
+    counts = queryset.filter(**{group_field: OuterRef("pk")}).order_by().values(group_field)
+    counts = counts.annotate(total=Count("*")).values("total")
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def repair_counters(dry_run=False):
+    """
+    Recompute Post.like_count, User.follower_count and User.following_count from the source tables.
+
+    Each counter is checked and repaired with one set-based statement rather than per row.
+    Returns the number of drifted rows per counter.
+    """
+    Post = apps.get_model("network", "Post")
+    User = apps.get_model("network", "User")
+    Follow = apps.get_model("network", "Follow")
+    Like = Post.likes.through
+
+    counters = [
+        (Post, "like_count", count_subquery(Like.objects.all(), "post_id")),
+        (User, "follower_count", count_subquery(Follow.objects.all(), "following_id")),
+        (User, "following_count", count_subquery(Follow.objects.all(), "follower_id")),
+    ]
+    drift = {}
+    with transaction.atomic():
+        for model, field, actual in counters:
+            drifted = model.objects.annotate(actual=actual).filter(~Q(**{field: F("actual")}))
+            drift[f"{model.__name__}.{field}"] = drifted.count()
+            if not dry_run and drift[f"{model.__name__}.{field}"]:
+                model.objects.filter(pk__in=drifted.values("pk")).update(**{field: actual})
+    return drift
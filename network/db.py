@@ -0,0 +1,113 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.decorators import sync_and_async_middleware
+
+# Read replica routing. Views decorated with replica_reads read from the NETWORK_READ_REPLICA alias;
+# everything else, and every write, uses the primary ("default"). A client that has just written is
+# pinned to the primary for NETWORK_REPLICA_PIN_SECONDS by a cookie set by replica_middleware, so that
+# it reads its own writes however far the replica lags behind.
+
+PIN_COOKIE = "network_primary"
+
+_replica_reads = ContextVar("network_replica_reads", default=False)
+
+
+def read_replica():
+    return getattr(settings, "NETWORK_READ_REPLICA", None)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # Sessions are read right after they are written, by the login that created them
+        if _replica_reads.get() and model._meta.app_label != "sessions":
+            return read_replica()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return True
+
+
+def _use_replica(request):
+    return bool(read_replica()) and PIN_COOKIE not in request.COOKIES
+
+
+def replica_reads(view):
+    """
+    Decorate a read-only view so that its queries go to the read replica, unless the client is pinned
+    to the primary.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            token = _replica_reads.set(_use_replica(request))
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _replica_reads.reset(token)
+    else:
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            token = _replica_reads.set(_use_replica(request))
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                _replica_reads.reset(token)
+    return inner
+
+
+@contextmanager
+def primary_reads():
+    """
+    Send the queries of the block to the primary, e.g. for results that are cached for every reader, which
+    must not be older than the cache entry they are stored under.
+    """
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def _pin(request, response):
+    if read_replica() and request.method not in ("GET", "HEAD", "OPTIONS"):
+        response.set_cookie(PIN_COOKIE, "1", max_age=getattr(settings, "NETWORK_REPLICA_PIN_SECONDS", 5),
+                            httponly=True, samesite="Lax")
+    return response
+
+
+@sync_and_async_middleware
+def replica_middleware(get_response):
+    """
+    Pin a client that sends a write to the primary database for its next reads.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            return _pin(request, await get_response(request))
+    else:
+        def middleware(request):
+            return _pin(request, get_response(request))
+    return middleware
+
+
+@receiver(connection_created)
+def sqlite_pragmas(sender, connection, **kwargs):
+    # WAL lets readers run alongside the writer, and with it synchronous=NORMAL only syncs at
+    # checkpoints while staying safe against corruption. busy_timeout makes writers wait for each
+    # other instead of failing with "database is locked".
+    if connection.vendor != "sqlite":
+        return
+    pragmas = getattr(settings, "NETWORK_SQLITE_PRAGMAS", {})
+    if pragmas:
+        with connection.cursor() as cursor:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
@@ -0,0 +1,136 @@
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+from .instrumentation import timed
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+# Encoding of the API responses. The backend is chosen by NETWORK_JSON_ENCODER: "orjson" when the
+# package is installed, else the standard library, unless one of them is named explicitly.
+#
+# With the standard library, values with an encode_json() method are already encoded JSON fragments
+# (see SerializedPost): their bytes are spliced into the output instead of being encoded again.
+# Fragments are looked for in the top few levels of the response, the only places where the API puts
+# them, so that the rest of the payload is left to the backend in one call. orjson encodes a whole
+# page several times faster than fragments can be spliced in Python (see bench_encoding), so it
+# encodes them as the plain dicts they also are.
+
+FRAGMENT_DEPTH = 3
+
+_stdlib_encoder = DjangoJSONEncoder(separators=(",", ":"), ensure_ascii=False)
+
+
+def _dumps_stdlib(value):
+    return _stdlib_encoder.encode(value).encode()
+
+
+def _dumps_orjson(value):
+    try:
+        return orjson.dumps(value, default=DjangoJSONEncoder().default)
+    except TypeError as error:
+        # orjson only encodes 64-bit integers; larger ones, e.g. a page number echoed from the URL, are rare
+        if str(error) != "Integer exceeds 64-bit range":
+            raise
+        return _dumps_stdlib(value)
+
+
+def get_backend():
+    name = getattr(settings, "NETWORK_JSON_ENCODER", "auto")
+    if name == "orjson" or (name == "auto" and orjson is not None):
+        if orjson is None:
+            raise ImportError("NETWORK_JSON_ENCODER is 'orjson' but orjson is not installed.")
+        return _dumps_orjson
+    if name not in ("auto", "stdlib"):
+        raise ValueError(f"Unknown NETWORK_JSON_ENCODER {name!r}.")
+    return _dumps_stdlib
+
+
+def _has_fragments(value, depth):
+    if hasattr(value, "encode_json"):
+        return True
+    if depth >= FRAGMENT_DEPTH:
+        return False
+    if isinstance(value, dict):
+        return any(_has_fragments(item, depth + 1) for item in value.values())
+    if isinstance(value, list):
+        # Lists hold items of one kind: checking the first one is enough
+        return bool(value) and _has_fragments(value[0], depth + 1)
+    return False
+
+
+def _splice(value, dumps, depth):
+    if hasattr(value, "encode_json"):
+        return value.encode_json()
+    if not _has_fragments(value, depth):
+        return dumps(value)
+    if isinstance(value, dict):
+        return b"{" + b",".join(dumps(str(key)) + b":" + _splice(item, dumps, depth + 1)
+                                for key, item in value.items()) + b"}"
+    return b"[" + b",".join(_splice(item, dumps, depth + 1) for item in value) + b"]"
+
+
+def dumps(value):
+    backend = get_backend()
+    with timed("serialize"):
+        if backend is _dumps_orjson:
+            return backend(value)
+        return _splice(value, backend, 0)
+
+
+def json_response(data, status=200):
+    """
+    Like JsonResponse(data, safe=False), encoded with the configured backend and spliced fragments.
+    """
+    return HttpResponse(dumps(data), content_type="application/json", status=status)
+
+
+class FragmentCache:
+    """
+    A bounded, thread-safe map of already encoded fragments. Entries are keyed on everything they are
+    encoded from, so they never go stale; the least recently added ones are dropped first.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._fragments = {}
+
+    def get(self, key, encode):
+        fragment = self._fragments.get(key)
+        if fragment is None:
+            fragment = encode()
+            with self._lock:
+                if len(self._fragments) >= self.maxsize:
+                    # Dicts keep insertion order: drop the oldest tenth in one go
+                    for old_key in list(self._fragments)[:max(1, self.maxsize // 10)]:
+                        del self._fragments[old_key]
+                self._fragments[key] = fragment
+        return fragment
+
+    def clear(self):
+        with self._lock:
+            self._fragments.clear()
+
+
+post_fragments = FragmentCache(getattr(settings, "NETWORK_JSON_FRAGMENT_CACHE_SIZE", 10000))
+
+
+class SerializedPost(dict):
+    """
+    A serialized post that encodes itself from a cached encoding of its fixed part (id, body, author
+    and timestamp) and its per-request like count and liked_by_me.
+    """
+
+    def encode_json(self):
+        key = (self["id"], self["user"], self["timestamp"], self["body"])
+        prefix = post_fragments.get(key, lambda: get_backend()(
+            {"id": self["id"], "body": self["body"], "user": self["user"], "timestamp": self["timestamp"]}
+        )[:-1])
+        return b'%s,"like_count":%d,"liked_by_me":%s}' % (
+            prefix, self["like_count"], b"true" if self["liked_by_me"] else b"false")
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+# Push channel for the event stream (see async_views.events). Events are small dicts published on
+# channels: "posts:<author id>" carries the id of each new post by that author, and
+# "likes:<post id>" each like or unlike of that post. Subscribers are the open event streams.
+#
+# The hub is chosen by NETWORK_EVENT_HUB. LocalEventHub only reaches streams served by the same
+# process; a deployment with several processes plugs in a hub backed by a broker (Redis pub/sub,
+# Postgres LISTEN/NOTIFY, ...) implementing the same publish and subscribe methods.
+
+
+class Subscription:
+    """
+    A stream's queue of events, filled from any thread and drained on the stream's event loop.
+    When the stream falls more than ``maxsize`` events behind, further events are dropped and
+    ``overflowed`` is set, so that it can tell its client to reload instead.
+    """
+
+    def __init__(self, hub, channels, maxsize):
+        self.hub = hub
+        self.channels = channels
+        self.overflowed = False
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize)
+
+    def put(self, event):
+        self._loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get_many(self, timeout):
+        # Waits up to timeout seconds for an event, then returns it with every other queued one
+        try:
+            events = [await asyncio.wait_for(self._queue.get(), timeout)]
+        except asyncio.TimeoutError:
+            return []
+        while not self._queue.empty():
+            events.append(self._queue.get_nowait())
+        return events
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class LocalEventHub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def subscribe(self, channels, maxsize=1000):
+        # Must be called from the event loop that will read the subscription
+        subscription = Subscription(self, set(channels), maxsize)
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscriptions.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscriptions[channel]
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub():
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = import_string(getattr(settings, "NETWORK_EVENT_HUB", "network.events.LocalEventHub"))()
+        return _hub
+
+
+def publish(channel, event):
+    # Subscribers only hear about committed changes
+    transaction.on_commit(lambda: get_hub().publish(channel, event))
+
+
+def encode_events(events, viewer_id=None):
+    """
+    Encode events for an event stream, as text/event-stream messages. Like deltas are merged per post,
+    and the viewer's own likes left out: their client has already counted them.
+    """
+    messages = []
+    deltas = {}
+    for event in events:
+        if event["type"] == "post":
+            messages.append(f'event: post\ndata: {{"id": {event["id"]}}}\n\n')
+        elif event["type"] == "likes" and event["actor"] != viewer_id:
+            deltas[event["id"]] = deltas.get(event["id"], 0) + event["delta"]
+    for post_id, delta in deltas.items():
+        if delta:
+            messages.append(f'event: likes\ndata: {{"id": {post_id}, "delta": {delta}}}\n\n')
+    return "".join(messages)
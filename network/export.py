@@ -0,0 +1,81 @@
+import datetime
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Post
+
+EXPORT_FIELDS = ("id", "user__username", "body", "timestamp", "like_count")
+
+
+def parse_bound(value):
+    # An ISO 8601 datetime, in UTC unless it has an offset, or None if the value is not one, including
+    # well-formed but impossible dates
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        return None
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, datetime.timezone.utc)
+    return parsed
+
+
+def export_queryset(user=None, since=None, until=None, liked_by=None):
+    queryset = Post.objects.all()
+    if user:
+        queryset = queryset.filter(user__username=user)
+    if since:
+        queryset = queryset.filter(timestamp__gte=since)
+    if until:
+        queryset = queryset.filter(timestamp__lt=until)
+    if liked_by:
+        queryset = queryset.filter(likes__username=liked_by)
+    return queryset
+
+
+def iter_posts(queryset, batch_size=2000):
+    """
+    Yield every post of ``queryset`` as a dict, in id order.
+
+    Rows are read in keyset batches (id > last id seen) streamed through QuerySet.iterator(), so
+    memory stays flat and each batch is an index range scan however far the export has got.
+    """
+    last_id = 0
+    while True:
+        batch = queryset.filter(id__gt=last_id).order_by("id").values(*EXPORT_FIELDS)[:batch_size]
+        rows = 0
+        for row in batch.iterator(chunk_size=batch_size):
+            rows += 1
+            last_id = row["id"]
+            yield {
+                "id": row["id"],
+                "user": row["user__username"],
+                "body": row["body"],
+                "timestamp": row["timestamp"],
+                "like_count": row["like_count"],
+            }
+        if rows < batch_size:
+            return
+
+
+def iter_ndjson(queryset, batch_size=2000):
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    for post in iter_posts(queryset, batch_size):
+        yield (encoder.encode(post) + "\n").encode()
+
+
+def iter_gzip(chunks, flush_every=64 * 1024):
+    # Incremental gzip framing: compressed output is emitted as it accumulates, never buffered whole
+    compressor = zlib.compressobj(wbits=31)
+    pending = 0
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= flush_every:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if data:
+            yield data
+    yield compressor.flush()
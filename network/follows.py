@@ -0,0 +1,144 @@
+from array import array
+from bisect import bisect_left
+
+from django.apps import apps
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import router, transaction
+from django.dispatch import receiver
+
+from .signals import follows_changed
+
+# Follow graph adjacency cache. The ids of the users a user follows are kept in the cache as the bytes
+# of a sorted array of 64-bit integers, 8 bytes per followed user, so that "does A follow B" is a binary
+# search and "which of these authors does A follow" a handful of them, with no query once the array is
+# cached. An array is dropped whenever its owner follows or unfollows someone, and refilled from the
+# primary database on the next read, so a lagging replica is never cached.
+#
+# Dropping an array only reaches the cache of NETWORK_FOLLOW_CACHE_ALIAS, which must therefore be shared
+# by every process: with a per-process cache, the other processes would answer from the old follows.
+# Without an alias the arrays are read from the database on every call.
+
+FOLLOWING_KEY = "network:following:{user_id}"
+
+# Longest list of ids put in a query: above it, feeds filter on a subquery and the cache is filled in chunks
+MAX_ID_LIST = 500
+
+
+def _cache():
+    alias = getattr(settings, "NETWORK_FOLLOW_CACHE_ALIAS", None)
+    return caches[alias] if alias else None
+
+
+@checks.register(checks.Tags.caches)
+def check_follow_cache(app_configs, **kwargs):
+    alias = getattr(settings, "NETWORK_FOLLOW_CACHE_ALIAS", None)
+    if alias and isinstance(caches[alias], LocMemCache):
+        return [checks.Error(
+            f"NETWORK_FOLLOW_CACHE_ALIAS {alias!r} is a per-process cache, which other processes cannot drop "
+            "stale follows from.",
+            hint="Use a cache shared by every process, or None to read follows from the database.",
+            id="network.E001",
+        )]
+    return []
+
+
+def _timeout():
+    return getattr(settings, "NETWORK_FOLLOW_CACHE_TIMEOUT", 3600)
+
+
+def _to_array(data):
+    ids = array("q")
+    ids.frombytes(data)
+    return ids
+
+
+def following_many(user_ids):
+    """
+    Return {user id: sorted array of the ids they follow} for ``user_ids``, reading the ones missing
+    from the cache in a single query.
+    """
+    cache = _cache()
+    keys = {FOLLOWING_KEY.format(user_id=user_id): user_id for user_id in user_ids}
+    cached = cache.get_many(list(keys)) if cache is not None else {}
+    graph = {keys[key]: _to_array(data) for key, data in cached.items()}
+    missing = [user_id for user_id in keys.values() if user_id not in graph]
+    if missing:
+        Follow = apps.get_model("network", "Follow")
+        graph.update({user_id: array("q") for user_id in missing})
+        follows = Follow.objects.using(router.db_for_write(Follow)).order_by("follower_id", "following_id")
+        for start in range(0, len(missing), MAX_ID_LIST):
+            rows = follows.filter(follower_id__in=missing[start:start + MAX_ID_LIST])
+            for follower_id, following_id in rows.values_list("follower_id", "following_id").iterator():
+                graph[follower_id].append(following_id)
+        if cache is not None:
+            cache.set_many({FOLLOWING_KEY.format(user_id=user_id): graph[user_id].tobytes() for user_id in missing},
+                           _timeout())
+    return graph
+
+
+def following_ids(user_id):
+    return following_many([user_id])[user_id]
+
+
+def _contains(ids, user_id):
+    index = bisect_left(ids, user_id)
+    return index < len(ids) and ids[index] == user_id
+
+
+def is_following(follower_id, user_id):
+    return _contains(following_ids(follower_id), user_id)
+
+
+def followed_among(user_id, author_ids):
+    # Which of author_ids the user follows
+    ids = following_ids(user_id)
+    return {author_id for author_id in author_ids if _contains(ids, author_id)}
+
+
+def common_following(user_id, other_id):
+    # The users followed by both, in id order
+    graph = following_many([user_id, other_id])
+    return sorted(set(graph[user_id]).intersection(graph[other_id]))
+
+
+def mutual_follows(user_id, among=None):
+    """
+    The users the user follows who follow them back, out of ``among`` (all the users they follow by
+    default), in id order.
+    """
+    ids = following_ids(user_id)
+    candidates = ids if among is None else sorted(followed_among(user_id, among))
+    graph = following_many(candidates)
+    return [candidate for candidate in candidates if _contains(graph[candidate], user_id)]
+
+
+def following_filter(user):
+    # A value for user_id__in selecting the authors the user follows
+    ids = following_ids(user.pk)
+    if len(ids) > MAX_ID_LIST:
+        return apps.get_model("network", "Follow").objects.filter(follower=user).values("following_id")
+    return list(ids)
+
+
+def invalidate_following(user_id):
+    # Dropped now for reads within the transaction, and again once it commits in case a concurrent
+    # request cached the old array in between
+    cache, key = _cache(), FOLLOWING_KEY.format(user_id=user_id)
+    if cache is not None:
+        cache.delete(key)
+        transaction.on_commit(lambda: cache.delete(key))
+
+
+def forget_following(user_ids):
+    # Drop the cached arrays of many users at once, e.g. after follows were written with bulk_create
+    cache = _cache()
+    if cache is not None:
+        cache.delete_many([FOLLOWING_KEY.format(user_id=user_id) for user_id in user_ids])
+
+
+@receiver(follows_changed)
+def follower_changed(sender, follower_id, following_id, **kwargs):
+    invalidate_following(follower_id)
@@ -0,0 +1,249 @@
+import csv
+import datetime
+import gzip
+import itertools
+import json
+import os
+
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .cache import invalidate_feed, invalidate_feeds
+from .counters import repair_counters
+from .follows import forget_following
+from .models import User, Follow, Post, PostScore, ProfileSummary, TimelineEntry
+from .search import rebuild_index
+
+# Bulk import of an existing community from NDJSON or CSV files, optionally gzipped, one file per kind
+# of record, with these fields (the post fields are those written by export_posts):
+#
+#     users    username, email, password (a Django password hash), date_joined
+#     follows  follower, following (usernames)
+#     posts    id, user (username), body, timestamp
+#     likes    user (username), post (post id)
+#
+# Files are streamed BATCH_SIZE records at a time, and each batch is resolved with a few queries and
+# written with bulk_create in its own transaction: memory stays flat and nothing is done per row.
+# Passwords are never hashed here: a record's hash is kept as is, anything else gives the user an
+# unusable password. Invalid records, e.g. self-follows, unknown users or posts, or existing usernames
+# and post ids, are skipped. Posts keep their ids so that likes can refer to them.
+#
+# Every batch is idempotent, so an interrupted import can simply be run again; with a checkpoint file,
+# the number of records of each file already imported is saved after every batch and those records are
+# skipped when resuming. Counters, timelines, the search index, ranking scores and profile summaries
+# are rebuilt once at the end.
+
+KINDS = ("users", "follows", "posts", "likes")
+BATCH_SIZE = 1000
+
+
+class InvalidSource(ValueError):
+    pass
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", newline="", encoding="utf-8")
+    return open(path, newline="", encoding="utf-8")
+
+
+def read_records(path):
+    # The records of a .csv, .ndjson or .jsonl file, optionally .gz, as dicts, one line at a time
+    extension = path.removesuffix(".gz").rpartition(".")[2]
+    if extension not in ("csv", "ndjson", "jsonl"):
+        raise InvalidSource(f"{path}: expected a .csv, .ndjson or .jsonl file.")
+    with _open(path) as file:
+        if extension == "csv":
+            yield from csv.DictReader(file)
+            return
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as error:
+                raise InvalidSource(f"{path}, line {number}: {error.msg}.") from None
+            if not isinstance(record, dict):
+                raise InvalidSource(f"{path}, line {number}: expected an object.")
+            yield record
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def _text(value):
+    return str(value).strip() if value is not None else ""
+
+
+def _integer(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _datetime(value):
+    # A missing date is now, an invalid one None
+    if not value:
+        return timezone.now()
+    try:
+        parsed = parse_datetime(str(value))
+    except ValueError:
+        return None
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, datetime.timezone.utc)
+    return parsed
+
+
+def _password(value, unusable):
+    try:
+        identify_hasher(value)
+    except (TypeError, ValueError):
+        return unusable
+    return value
+
+
+def _user_ids(usernames):
+    return dict(User.objects.filter(username__in=set(usernames)).values_list("username", "pk"))
+
+
+def import_users(records):
+    existing = set(User.objects.filter(username__in={_text(record.get("username")) for record in records})
+                   .values_list("username", flat=True))
+    unusable = make_password(None)
+    users = {}
+    for record in records:
+        username, date_joined = _text(record.get("username")), _datetime(record.get("date_joined"))
+        if username and username not in existing and username not in users and date_joined:
+            users[username] = User(username=username, email=_text(record.get("email")), date_joined=date_joined,
+                                   password=_password(record.get("password"), unusable))
+    User.objects.bulk_create(users.values())
+    return len(users)
+
+
+def import_follows(records):
+    pairs = [(_text(record.get("follower")), _text(record.get("following"))) for record in records]
+    ids = _user_ids(itertools.chain.from_iterable(pairs))
+    pairs = {(ids.get(follower), ids.get(following)) for follower, following in pairs}
+    # What Follow.clean checks row by row, for the whole batch
+    pairs = [(follower, following) for follower, following in pairs
+             if follower is not None and following is not None and follower != following]
+    Follow.objects.bulk_create([Follow(follower_id=follower, following_id=following)
+                                for follower, following in pairs], ignore_conflicts=True)
+    forget_following({follower for follower, _ in pairs})
+    invalidate_feeds({f"user:{user_id}" for pair in pairs for user_id in pair})
+    return len(pairs)
+
+
+def import_posts(records):
+    ids = _user_ids(_text(record.get("user")) for record in records)
+    existing = set(Post.objects.filter(pk__in={_integer(record.get("id")) for record in records} - {None})
+                   .values_list("pk", flat=True))
+    max_length = Post._meta.get_field("body").max_length
+    posts = {}
+    for record in records:
+        post_id, user_id = _integer(record.get("id")), ids.get(_text(record.get("user")))
+        body, timestamp = _text(record.get("body")), _datetime(record.get("timestamp"))
+        if (post_id is not None and post_id > 0 and post_id not in existing and post_id not in posts
+                and user_id is not None and 0 < len(body) <= max_length and timestamp):
+            posts[post_id] = Post(id=post_id, user_id=user_id, body=body, timestamp=timestamp)
+    # Inserted directly: bulk_create would replace the timestamps with auto_now_add's
+    connection = connections[router.db_for_write(Post)]
+    timestamp_field = Post._meta.get_field("timestamp")
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {Post._meta.db_table} (id, user_id, body, timestamp, like_count) VALUES (%s, %s, %s, %s, 0)",
+            [(post.pk, post.user_id, post.body, timestamp_field.get_db_prep_value(post.timestamp, connection))
+             for post in posts.values()],
+        )
+    invalidate_feeds({f"profile:{post.user_id}" for post in posts.values()})
+    return len(posts)
+
+
+def import_likes(records):
+    pairs = [(_text(record.get("user")), _integer(record.get("post"))) for record in records]
+    ids = _user_ids(username for username, _ in pairs)
+    post_ids = set(Post.objects.filter(pk__in={post_id for _, post_id in pairs} - {None})
+                   .values_list("pk", flat=True))
+    pairs = {(ids.get(username), post_id) for username, post_id in pairs}
+    pairs = [(user_id, post_id) for user_id, post_id in pairs if user_id is not None and post_id in post_ids]
+    through = Post.likes.through
+    through.objects.bulk_create([through(user_id=user_id, post_id=post_id) for user_id, post_id in pairs],
+                                ignore_conflicts=True)
+    invalidate_feeds({f"user:{user_id}" for user_id, _ in pairs})
+    return len(pairs)
+
+
+IMPORTERS = {"users": import_users, "follows": import_follows, "posts": import_posts, "likes": import_likes}
+
+
+def _load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def _save_checkpoint(path, checkpoint):
+    # Replaced in one step, so that an interruption leaves the previous checkpoint
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(checkpoint, file)
+    os.replace(f"{path}.tmp", path)
+
+
+def reset_post_sequence():
+    # Posts were inserted with their ids: databases with sequences must start after them
+    connection = connections[router.db_for_write(Post)]
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [Post]):
+            cursor.execute(sql)
+
+
+def rebuild_derived_data():
+    repair_counters()
+    TimelineEntry.rebuild()
+    rebuild_index()
+    PostScore.refresh()
+    ProfileSummary.rebuild()
+    invalidate_feed("all")
+
+
+def import_network(sources, checkpoint=None, batch_size=BATCH_SIZE, rebuild=True, progress=None):
+    """
+    Import the records of ``sources``, a {kind: path} dict with kinds out of KINDS, in that order,
+    resuming from the ``checkpoint`` file if given, and call ``progress(kind, records)`` after every
+    batch. Returns {kind: {"read": records, "imported": rows}}, counting only the records of this run;
+    rows include follows and likes that already existed.
+    """
+    unknown = set(sources) - set(KINDS)
+    if unknown:
+        raise InvalidSource(f"Unknown kind of records {sorted(unknown)[0]!r}.")
+    state = _load_checkpoint(checkpoint)
+    stats = {}
+    for kind in KINDS:
+        if kind not in sources:
+            continue
+        path = os.path.abspath(sources[kind])
+        # A checkpoint only holds for the file it was saved for
+        done = state[kind]["records"] if state.get(kind, {}).get("path") == path else 0
+        counts = stats[kind] = {"read": 0, "imported": 0}
+        for records in _chunks(itertools.islice(read_records(path), done, None), batch_size):
+            with transaction.atomic():
+                counts["imported"] += IMPORTERS[kind](records)
+            counts["read"] += len(records)
+            if checkpoint:
+                state[kind] = {"path": path, "records": done + counts["read"]}
+                _save_checkpoint(checkpoint, state)
+            if progress:
+                progress(kind, done + counts["read"])
+        if kind == "posts":
+            reset_post_sequence()
+    if rebuild:
+        rebuild_derived_data()
+    return stats
@@ -0,0 +1,239 @@
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.decorators import sync_and_async_middleware
+
+from .cache import feed_cache_stats
+from .likes import pending_like_count
+from .ratelimit import rate_limit_stats, write_gate
+
+# Per-request performance instrumentation (see performance_middleware): wall time, database queries
+# and time, serialization time and response size of every request. They are sent back in a
+# Server-Timing header, logged as one JSON line on the "network.performance" logger and aggregated
+# per URL name, for /api/_metrics to expose in the Prometheus text format.
+
+logger = logging.getLogger("network.performance")
+
+# Upper bounds, in seconds, of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_timings = ContextVar("network_timings", default=None)
+
+
+@contextmanager
+def timed(name):
+    """
+    Add the time spent in the block to the current request's ``name`` timing. Free outside of
+    instrumented requests.
+    """
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def _count_query(execute, sql, params, many, context):
+    # A database execute wrapper installed once on every connection, of every thread: counts the query and
+    # its time towards the request whose timings are in the context. Async views run the ORM in worker
+    # threads with connections of their own, and sync_to_async carries the context over to them.
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings["queries"] = timings.get("queries", 0) + 1
+        timings["db"] = timings.get("db", 0.0) + time.perf_counter() - start
+
+
+def install_query_counter(connection):
+    # First in line, so that the execute_wrapper() context managers, which pop the last wrapper, leave it
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _count_query)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    install_query_counter(connection)
+
+
+class Metrics:
+    """
+    In-process aggregates of the instrumented requests, per URL name.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+    def record(self, url_name, status, duration, queries, db_time, serialize_time, size):
+        bucket = bisect_left(DURATION_BUCKETS, duration)
+        with self._lock:
+            endpoint = self._endpoints.get(url_name)
+            if endpoint is None:
+                endpoint = self._endpoints[url_name] = {
+                    "buckets": [0] * (len(DURATION_BUCKETS) + 1), "duration": 0.0, "queries": 0,
+                    "db": 0.0, "serialize": 0.0, "bytes": 0, "statuses": {},
+                }
+            endpoint["buckets"][bucket] += 1
+            endpoint["duration"] += duration
+            endpoint["queries"] += queries
+            endpoint["db"] += db_time
+            endpoint["serialize"] += serialize_time
+            endpoint["bytes"] += size or 0
+            endpoint["statuses"][status] = endpoint["statuses"].get(status, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return {url_name: dict(endpoint, buckets=list(endpoint["buckets"]), statuses=dict(endpoint["statuses"]))
+                    for url_name, endpoint in self._endpoints.items()}
+
+    def render(self):
+        # Prometheus text exposition format, version 0.0.4
+        endpoints = sorted(self.snapshot().items())
+        lines = [
+            "# HELP network_request_duration_seconds Wall time of the requests.",
+            "# TYPE network_request_duration_seconds histogram",
+        ]
+        for url_name, endpoint in endpoints:
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS + ("+Inf",), endpoint["buckets"]):
+                cumulative += count
+                lines.append(f'network_request_duration_seconds_bucket{{url_name="{url_name}",le="{bound}"}} '
+                             f'{cumulative}')
+            lines.append(f'network_request_duration_seconds_sum{{url_name="{url_name}"}} {endpoint["duration"]}')
+            lines.append(f'network_request_duration_seconds_count{{url_name="{url_name}"}} {cumulative}')
+
+        for name, key, help_text in (
+            ("network_responses_total", None, "Responses, by status code."),
+            ("network_request_db_queries_total", "queries", "Database queries made by the requests."),
+            ("network_request_db_seconds_total", "db", "Time the requests spent in database queries."),
+            ("network_request_serialize_seconds_total", "serialize", "Time the requests spent serializing."),
+            ("network_response_bytes_total", "bytes", "Size of the non-streaming response bodies."),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for url_name, endpoint in endpoints:
+                if key is None:
+                    lines += [f'{name}{{url_name="{url_name}",code="{status}"}} {count}'
+                              for status, count in sorted(endpoint["statuses"].items())]
+                else:
+                    lines.append(f'{name}{{url_name="{url_name}"}} {endpoint[key]}')
+
+        lines += ["# HELP network_feed_cache_total Feed cache lookups and invalidations.",
+                  "# TYPE network_feed_cache_total counter"]
+        lines += [f'network_feed_cache_total{{event="{event}"}} {count}'
+                  for event, count in sorted(feed_cache_stats().items())]
+        lines += ["# HELP network_pending_likes Likes buffered and not yet written.",
+                  "# TYPE network_pending_likes gauge",
+                  f"network_pending_likes {pending_like_count()}"]
+
+        limits = rate_limit_stats()
+        lines += ["# HELP network_rate_limit_total Write operations admitted and refused by the rate limits.",
+                  "# TYPE network_rate_limit_total counter"]
+        lines += [f'network_rate_limit_total{{scope="{scope}",result="{result}"}} {count}'
+                  for (scope, result), count in sorted(limits.items()) if scope not in ("gate", "cache")]
+        lines += ["# HELP network_write_gate_total Writes admitted and shed by the write concurrency gate.",
+                  "# TYPE network_write_gate_total counter"]
+        lines += [f'network_write_gate_total{{result="{result}"}} {count}'
+                  for (scope, result), count in sorted(limits.items()) if scope == "gate"]
+        lines += ["# HELP network_write_gate_in_flight Writes in progress in this process.",
+                  "# TYPE network_write_gate_in_flight gauge",
+                  f"network_write_gate_in_flight {write_gate.in_flight}",
+                  "# HELP network_rate_limit_cache_fallbacks_total Rate limit cache failures, buckets kept in memory.",
+                  "# TYPE network_rate_limit_cache_fallbacks_total counter",
+                  f"network_rate_limit_cache_fallbacks_total {limits.get(('cache', 'fallback'), 0)}"]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class _RequestMeasurement:
+    def __init__(self, request):
+        self.request = request
+        self.timings = {}
+
+    def __enter__(self):
+        self._token = _timings.set(self.timings)
+        # Connections of this thread opened before the receiver above was connected
+        for connection in connections.all(initialized_only=True):
+            install_query_counter(connection)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.duration = time.perf_counter() - self.start
+        _timings.reset(self._token)
+
+    @property
+    def queries(self):
+        return self.timings.get("queries", 0)
+
+    def finish(self, response):
+        match = getattr(self.request, "resolver_match", None)
+        url_name = (match.url_name if match else None) or "unmatched"
+        db_time = self.timings.get("db", 0.0)
+        serialize_time = self.timings.get("serialize", 0.0)
+        size = None if response.streaming else len(response.content)
+        metrics.record(url_name, response.status_code, self.duration, self.queries, db_time,
+                       serialize_time, size)
+
+        if getattr(settings, "NETWORK_SERVER_TIMING", True):
+            response.headers["Server-Timing"] = (
+                f'db;dur={db_time * 1000:.2f};desc="{self.queries} queries", '
+                f"serialize;dur={serialize_time * 1000:.2f}, total;dur={self.duration * 1000:.2f}"
+            )
+
+        slow = self.duration * 1000 >= getattr(settings, "NETWORK_SLOW_REQUEST_MS", 500)
+        level = logging.WARNING if slow else logging.INFO
+        if logger.isEnabledFor(level):
+            logger.log(level, json.dumps({
+                "method": self.request.method,
+                "path": self.request.path,
+                "url_name": url_name,
+                "status": response.status_code,
+                "duration_ms": round(self.duration * 1000, 3),
+                "db_queries": self.queries,
+                "db_ms": round(db_time * 1000, 3),
+                "serialize_ms": round(serialize_time * 1000, 3),
+                "bytes": size,
+            }))
+        return response
+
+
+@sync_and_async_middleware
+def performance_middleware(get_response):
+    """
+    Measure every request; see the module comment. Async requests stay async.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            with _RequestMeasurement(request) as measurement:
+                response = await get_response(request)
+            return measurement.finish(response)
+    else:
+        def middleware(request):
+            with _RequestMeasurement(request) as measurement:
+                response = get_response(request)
+            return measurement.finish(response)
+    return middleware
@@ -0,0 +1,165 @@
+import atexit
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .counters import count_subquery
+from .signals import likes_changed
+
+# Batched like ingestion (see NETWORK_LIKE_BATCHING). A like or unlike only records the acting user's
+# latest intent in a per-process buffer, so repeated toggles of a post by the same user coalesce into
+# one pending state. The buffer is written in one transaction once it holds NETWORK_LIKE_BATCH_SIZE
+# entries, or NETWORK_LIKE_BATCH_INTERVAL seconds after its first entry: one INSERT for the new likes,
+# one DELETE for the removed ones and one UPDATE recounting the likes of the posts touched, instead of
+# a transaction per click.
+# Until then the acting user's reads are overlaid with their pending state (see overlay_pending_likes).
+# Other users see the change after the flush. The buffer is only seen by its own process, so the acting
+# user only reads their own writes when every request is served by the same process.
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_pending = {}  # user id -> {post id: liked}
+_size = 0
+_timer = None
+
+
+def like_batching_enabled():
+    return getattr(settings, "NETWORK_LIKE_BATCHING", False)
+
+
+def _batch_size():
+    return getattr(settings, "NETWORK_LIKE_BATCH_SIZE", 500)
+
+
+def _batch_interval():
+    return getattr(settings, "NETWORK_LIKE_BATCH_INTERVAL", 1.0)
+
+
+def buffer_like(post_id, user_id, liked):
+    global _size, _timer
+    with _lock:
+        likes = _pending.setdefault(user_id, {})
+        if post_id not in likes:
+            _size += 1
+        likes[post_id] = liked
+        full = _size >= _batch_size()
+        if not full and _timer is None and _batch_interval():
+            _timer = threading.Timer(_batch_interval(), _flush_in_background)
+            _timer.daemon = True
+            _timer.start()
+    if full:
+        flush_likes()
+
+
+def pending_likes(user_id):
+    with _lock:
+        return dict(_pending.get(user_id, ()))
+
+
+def pending_like_count():
+    with _lock:
+        return _size
+
+
+def likes_post(post, user):
+    # The user's current intent: their pending state if any, else what is stored
+    pending = pending_likes(user.pk)
+    if post.pk in pending:
+        return pending[post.pk]
+    return post.likes.through.objects.filter(post_id=post.pk, user_id=user.pk).exists()
+
+
+def overlay_pending_likes(posts, viewer_id, liked):
+    """
+    Apply ``viewer_id``'s pending likes to ``posts`` and to ``liked``, the set of their ids the viewer
+    has stored likes for. Adjusts the posts' like_count in place and returns the updated set.
+    """
+    pending = pending_likes(viewer_id)
+    if not pending:
+        return liked
+    liked = set(liked)
+    for post in posts:
+        if post.pk in pending and pending[post.pk] != (post.pk in liked):
+            post.like_count += 1 if pending[post.pk] else -1
+            liked ^= {post.pk}
+    return liked
+
+
+def flush_likes():
+    """
+    Write the buffered likes and unlikes. Returns the number of likes actually added or removed.
+    """
+    global _pending, _size, _timer
+    with _flush_lock:
+        with _lock:
+            pending, _pending, _size = _pending, {}, 0
+            if _timer is not None:
+                _timer.cancel()
+                _timer = None
+        if not pending:
+            return 0
+        try:
+            return _write(pending)
+        except Exception:
+            # Keep the intents for the next flush, unless they have been superseded meanwhile
+            with _lock:
+                for user_id, likes in pending.items():
+                    for post_id, liked in likes.items():
+                        if post_id not in _pending.setdefault(user_id, {}):
+                            _pending[user_id][post_id] = liked
+                            _size += 1
+            raise
+
+
+def _write(pending):
+    from .models import Post, User
+
+    through = Post.likes.through
+    post_ids = {post_id for likes in pending.values() for post_id in likes}
+    with transaction.atomic():
+        # Posts or users deleted since the click are dropped
+        authors = dict(Post.objects.filter(pk__in=post_ids).values_list("id", "user_id"))
+        user_ids = set(User.objects.filter(pk__in=pending).values_list("id", flat=True))
+        existing = {(post_id, user_id): pk for pk, post_id, user_id in through.objects.filter(
+            post_id__in=authors, user_id__in=user_ids
+        ).values_list("id", "post_id", "user_id")}
+
+        added, removed = [], []
+        for user_id, likes in pending.items():
+            for post_id, liked in likes.items():
+                if user_id not in user_ids or post_id not in authors:
+                    continue
+                if liked and (post_id, user_id) not in existing:
+                    added.append((post_id, user_id))
+                elif not liked and (post_id, user_id) in existing:
+                    removed.append((post_id, user_id))
+
+        through.objects.bulk_create([through(post_id=post_id, user_id=user_id) for post_id, user_id in added],
+                                    ignore_conflicts=True)
+        if removed:
+            through.objects.filter(pk__in=[existing[key] for key in removed]).delete()
+
+        # Counted rather than moved by the batch's own deltas, which a concurrent like of the same post
+        # through another process or the unbatched path would make drift
+        touched = {post_id for post_id, _ in added + removed}
+        if touched:
+            Post.objects.filter(pk__in=touched).update(like_count=count_subquery(through.objects.all(), "post_id"))
+
+    changed = added + removed
+    if changed:
+        likes_changed.send(sender=Post, post_ids=[post_id for post_id, _ in changed],
+                           author_ids=[authors[post_id] for post_id, _ in changed],
+                           user_ids=[user_id for _, user_id in changed],
+                           deltas=[1] * len(added) + [-1] * len(removed))
+    return len(changed)
+
+
+def _flush_in_background():
+    try:
+        flush_likes()
+    finally:
+        connection.close()
+
+
+atexit.register(flush_likes)
@@ -0,0 +1,28 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from network.benchmarks.runner import run
+
+
+class Command(BaseCommand):
+    help = ("Measure latency percentiles, query counts and response sizes of the API endpoints, as JSON. "
+            "Run it on a generated network (see generate_network).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("endpoints", nargs="*", help="Endpoints to measure, all by default.")
+        parser.add_argument("--requests", type=int, default=100)
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument("--output", help="Write the results to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        try:
+            results = run(options["requests"], options["warmup"], options["endpoints"] or None)
+        except ValueError as e:
+            raise CommandError(e)
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
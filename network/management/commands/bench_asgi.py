@@ -0,0 +1,20 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from network.benchmarks.asgi import compare
+
+DEFAULT_PATHS = ["/api/posts?cursor=", "/api/posts/1"]
+
+
+class Command(BaseCommand):
+    help = "Compare requests/sec and latency percentiles of the WSGI and ASGI API views, as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="*", help=f"API paths to request, default {DEFAULT_PATHS}.")
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=16)
+
+    def handle(self, *args, **options):
+        results = compare(options["paths"] or DEFAULT_PATHS, options["requests"], options["concurrency"])
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,16 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from network.benchmarks.encoding import compare
+
+
+class Command(BaseCommand):
+    help = "Time the JSON encoding of a large feed page with each encoder, as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--posts", type=int, default=10000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(compare(options["posts"], options["repeat"]), indent=2))
@@ -0,0 +1,16 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from network.benchmarks.likes import compare
+
+
+class Command(BaseCommand):
+    help = "Compare like throughput with and without like batching, as JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--likes", type=int, default=1000)
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(compare(options["likes"], options["batch_size"]), indent=2))
@@ -0,0 +1,17 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from network.benchmarks.sessions import compare
+
+
+class Command(BaseCommand):
+    help = ("Compare the queries and latency of feed reads with database sessions and users and with the "
+            "configured cached ones, as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=100)
+        parser.add_argument("--path", default="/api/posts?cursor=")
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(compare(options["requests"], options["path"]), indent=2))
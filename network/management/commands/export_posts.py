@@ -0,0 +1,41 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from network.export import export_queryset, iter_gzip, iter_ndjson, parse_bound
+
+
+class Command(BaseCommand):
+    help = "Stream posts as NDJSON, optionally gzipped, with flat memory use."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Only posts written by this username.")
+        parser.add_argument("--liked-by", help="Only posts liked by this username.")
+        parser.add_argument("--since", help="Only posts at or after this ISO 8601 datetime.")
+        parser.add_argument("--until", help="Only posts before this ISO 8601 datetime.")
+        parser.add_argument("--gzip", action="store_true", help="Gzip the output.")
+        parser.add_argument("--output", help="File to write to, defaults to standard output.")
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        dates = {}
+        for option in ("since", "until"):
+            if options[option]:
+                dates[option] = parse_bound(options[option])
+                if dates[option] is None:
+                    raise CommandError(f"--{option} must be an ISO 8601 datetime.")
+        queryset = export_queryset(options["user"], liked_by=options["liked_by"], **dates)
+        chunks = iter_ndjson(queryset, options["batch_size"])
+        if options["gzip"]:
+            chunks = iter_gzip(chunks)
+
+        if options["output"]:
+            with open(options["output"], "wb") as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        elif options["gzip"]:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending="")
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from network.benchmarks.graph import delete_network, generate_network
+
+
+class Command(BaseCommand):
+    help = "Generate a reproducible synthetic social network for benchmarks (users named synth-<n>)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--posts-per-user", type=int, default=10)
+        parser.add_argument("--likes-per-post", type=float, default=5)
+        parser.add_argument("--follows-per-user", type=float, default=20)
+        parser.add_argument("--alpha", type=float, default=1.1,
+                            help="Exponent of the power law of follower counts by popularity rank.")
+        parser.add_argument("--days", type=int, default=30, help="Posts are spread over this many days.")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--clear", action="store_true", help="Delete a previously generated network first.")
+
+    def handle(self, *args, **options):
+        if options["clear"]:
+            self.stdout.write(f"{delete_network()} rows of the previous network deleted")
+        counts = generate_network(
+            options["users"], options["posts_per_user"], options["likes_per_post"], options["follows_per_user"],
+            options["alpha"], options["days"], options["seed"],
+        )
+        self.stdout.write(", ".join(f"{count} {name.replace('_', ' ')}" for name, count in counts.items()))
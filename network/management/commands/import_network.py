@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from network.importer import BATCH_SIZE, KINDS, InvalidSource, import_network
+
+
+class Command(BaseCommand):
+    help = ("Import users, follows, posts and likes from NDJSON or CSV files (optionally gzipped) with "
+            "batched bulk inserts, then rebuild counters, timelines, search index, scores and profiles.")
+
+    def add_arguments(self, parser):
+        for kind in KINDS:
+            parser.add_argument(f"--{kind}", metavar="FILE", help=f"File of the {kind} to import.")
+        parser.add_argument("--checkpoint", metavar="FILE",
+                            help="Save progress to this file after every batch, and resume from it.")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--no-rebuild", action="store_true",
+                            help="Skip the rebuild of counters and derived tables, e.g. between partial imports.")
+
+    def handle(self, *args, **options):
+        sources = {kind: options[kind] for kind in KINDS if options[kind]}
+        if not sources:
+            raise CommandError(f"Give at least one of {', '.join(f'--{kind}' for kind in KINDS)}.")
+
+        def progress(kind, records):
+            if options["verbosity"] > 1:
+                self.stdout.write(f"{kind}: {records} records done")
+
+        start = time.perf_counter()
+        try:
+            stats = import_network(sources, options["checkpoint"], options["batch_size"],
+                                   rebuild=not options["no_rebuild"], progress=progress)
+        except (InvalidSource, OSError) as error:
+            raise CommandError(error)
+        for kind, counts in stats.items():
+            self.stdout.write(f"{kind}: {counts['read']} records read, {counts['imported']} imported")
+        self.stdout.write(f"Done in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from network.models import ProfileSummary
+
+
+class Command(BaseCommand):
+    help = "Rebuild the profile summaries (post count, latest post, last activity) from the posts."
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{ProfileSummary.rebuild()} profile summaries written")
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from network.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of posts, e.g. after posts were written in bulk."
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{rebuild_index()} posts indexed")
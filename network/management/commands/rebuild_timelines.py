@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from network.models import TimelineEntry
+
+
+class Command(BaseCommand):
+    help = "Rebuild the materialized home timelines from the follow graph, or only trim them to length."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--trim-only", action="store_true", help="Only drop entries past the timeline length.")
+
+    def handle(self, *args, **options):
+        if options["trim_only"]:
+            self.stdout.write(f"{TimelineEntry.trim()} entries trimmed")
+        else:
+            TimelineEntry.rebuild()
+            self.stdout.write(f"{TimelineEntry.objects.count()} timeline entries written")
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from network.models import PostScore
+
+
+class Command(BaseCommand):
+    help = "Score the posts that are new or changed since the last refresh, for the ranked feed."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", help="Rescore every post, e.g. after the ranking settings changed.")
+        parser.add_argument("--interval", type=float, default=0,
+                            help="Keep running, refreshing every this many seconds.")
+
+    def handle(self, *args, **options):
+        full = options["full"]
+        while True:
+            start = time.perf_counter()
+            refreshed = PostScore.refresh(full=full)
+            self.stdout.write(f"{refreshed} posts scored in {time.perf_counter() - start:.2f}s")
+            if not options["interval"]:
+                break
+            full = False
+            time.sleep(options["interval"])
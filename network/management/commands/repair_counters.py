@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from network.counters import repair_counters
+
+
+class Command(BaseCommand):
+    help = "Recompute denormalized like/follower/following counters and repair any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only report drifted rows.")
+
+    def handle(self, *args, **options):
+        drift = repair_counters(dry_run=options["dry_run"])
+        for counter, rows in drift.items():
+            action = "drifted" if options["dry_run"] else "repaired"
+            self.stdout.write(f"{counter}: {rows} {action}")
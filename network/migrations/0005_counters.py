@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:58
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count_subquery(queryset, group_field):
+    counts = queryset.filter(**{group_field: OuterRef("pk")}).order_by().values(group_field)
+    counts = counts.annotate(total=Count("*")).values("total")
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def populate_counters(apps, schema_editor):
+    # Self-contained rather than calling network.counters, so that later changes to the app cannot alter
+    # this migration
+    Post = apps.get_model("network", "Post")
+    User = apps.get_model("network", "User")
+    Follow = apps.get_model("network", "Follow")
+    using = schema_editor.connection.alias
+    Post.objects.using(using).update(like_count=_count_subquery(Post.likes.through.objects.all(), "post_id"))
+    User.objects.using(using).update(
+        follower_count=_count_subquery(Follow.objects.all(), "following_id"),
+        following_count=_count_subquery(Follow.objects.all(), "follower_id"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('network', '0004_alter_follow_id_alter_post_likes_alter_user_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='follower_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_timelines(apps, schema_editor):
+    Follow = apps.get_model("network", "Follow")
+    Post = apps.get_model("network", "Post")
+    TimelineEntry = apps.get_model("network", "TimelineEntry")
+    length = getattr(settings, "NETWORK_TIMELINE_LENGTH", 800)
+    fanout_limit = getattr(settings, "NETWORK_TIMELINE_FANOUT_LIMIT", 10000)
+    owner_ids = Follow.objects.order_by().values_list("follower_id", flat=True).distinct()
+    for owner_id in owner_ids.iterator():
+        followed = Follow.objects.filter(
+            follower_id=owner_id, following__follower_count__lte=fanout_limit
+        ).values("following_id")
+        posts = Post.objects.filter(user_id__in=followed).order_by("-timestamp", "-id")
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(owner_id=owner_id, post_id=post_id, timestamp=timestamp)
+             for post_id, timestamp in posts.values_list("id", "timestamp")[:length]],
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('network', '0005_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField()),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='network.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', '-timestamp', '-post'], name='network_timeline_feed_idx')],
+                'unique_together': {('owner', 'post')},
+            },
+        ),
+        migrations.RunPython(populate_timelines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # An FTS5 table indexing post bodies under the post ids (see network.search); other databases
+    # have no search index
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE network_post_search USING fts5(body, tokenize='unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute("INSERT INTO network_post_search (rowid, body) SELECT id, body FROM network_post")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("DROP TABLE network_post_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('network', '0007_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
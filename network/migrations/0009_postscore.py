@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('network', '0008_post_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostScore',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='network.post')),
+                ('score', models.FloatField()),
+                ('followed_score', models.FloatField()),
+                ('like_count', models.PositiveIntegerField()),
+                ('author_follower_count', models.PositiveIntegerField()),
+                ('author', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-score', '-post'], name='network_postscore_feed_idx'), models.Index(fields=['author', '-followed_score', '-post'], name='network_postscore_author_idx')],
+            },
+        ),
+    ]
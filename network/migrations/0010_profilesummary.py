@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('network', '0009_postscore'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('post_count', models.PositiveIntegerField(default=0)),
+                ('last_active', models.DateTimeField(null=True)),
+                ('latest_post', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='network.post')),
+            ],
+        ),
+    ]
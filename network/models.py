@@ -1,36 +1,44 @@
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.core.paginator import Paginator, EmptyPage
-from django.db import models
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value, Window, prefetch_related_objects
+from django.db.models.functions import Coalesce, Greatest, RowNumber
+from django.utils import timezone
 
+from .encoding import SerializedPost
+from .follows import following_filter
+from .instrumentation import timed
+from .likes import overlay_pending_likes
+from .pagination import akeyset_merge, keyset_merge, keyset_page
+from .ranking import compute_scores
+from .signals import follows_changed, likes_changed
 
-class User(AbstractUser):
-    @property
-    def follower_count(self):
-        return self.followers.count()
 
-    @property
-    def following_count(self):
-        return self.following.count()
+class User(AbstractUser):
+    # Denormalized counters, kept in step by Follow.add/Follow.remove and repaired by `repair_counters`
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"({self.id}) {self.username}"
 
     def serialize(self):
+        # Constant size: posts and liked posts are paginated sub-resources of the profile API
         return {
             "id": self.id,
             "username": self.username,
             "email": self.email,
             "following": self.following_count,
             "followers": self.follower_count,
-            "likes": [post.user.username for post in self.likes.all()],
-            "posts": [post.serialize() for post in self.posts.all()]
         }
 
 
 class Follow(models.Model):
-    follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name="following")
-    following = models.ForeignKey(User, on_delete=models.CASCADE, related_name="followers")
+    # Both lookups are served by the composite indexes below rather than single-column ones
+    follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name="following", db_index=False)
+    following = models.ForeignKey(User, on_delete=models.CASCADE, related_name="followers", db_index=False)
 
     def __str__(self):
         return f"{self.id} > {self.follower} is following {self.following}"
@@ -43,49 +51,494 @@ class Follow(models.Model):
         self.clean()
         super().save(*args, **kwargs)
 
+    @classmethod
+    def add(cls, follower, following):
+        # Returns False if the relationship already existed
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    cls(follower=follower, following=following).save()
+            except IntegrityError:
+                return False
+            User.objects.filter(pk=follower.pk).update(following_count=F("following_count") + 1)
+            User.objects.filter(pk=following.pk).update(follower_count=F("follower_count") + 1)
+        follows_changed.send(sender=cls, follower_id=follower.pk, following_id=following.pk)
+        return True
+
+    @classmethod
+    def remove(cls, follower, following):
+        # Returns False if there was no relationship to remove
+        with transaction.atomic():
+            deleted, _ = cls.objects.filter(follower=follower, following=following).delete()
+            if not deleted:
+                return False
+            User.objects.filter(pk=follower.pk).update(following_count=F("following_count") - 1)
+            User.objects.filter(pk=following.pk).update(follower_count=F("follower_count") - 1)
+        follows_changed.send(sender=cls, follower_id=follower.pk, following_id=following.pk)
+        return True
+
     class Meta:
         unique_together = ["follower", "following"]
+        indexes = [
+            # Followers of an author, e.g. for timeline fan-out
+            models.Index(fields=["following", "follower"], name="network_follow_followers_idx"),
+        ]
 
 
 class Post(models.Model):
     id = models.AutoField(primary_key=True)
     body = models.CharField(max_length=140)
-    user = models.ForeignKey("User", on_delete=models.CASCADE, related_name="posts")
+    user = models.ForeignKey("User", on_delete=models.CASCADE, related_name="posts", db_index=False)
     timestamp = models.DateTimeField(auto_now_add=True)
     likes = models.ManyToManyField("User", related_name="likes", blank=True)
+    # Denormalized number of likes, kept in step by add_like/remove_like
+    like_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return f"{self.user} wrote: {self.body}"
 
-    def serialize(self):
-        return {
+    class Meta:
+        indexes = [
+            # Global feed and profile feed, both read newest first with an id tie-breaker
+            models.Index(fields=["-timestamp", "-id"], name="network_post_feed_idx"),
+            models.Index(fields=["user", "-timestamp", "-id"], name="network_post_user_feed_idx"),
+        ]
+
+    def serialize(self, liked_by_me=False):
+        # ISO 8601, formatted for display by the client
+        return SerializedPost({
             "id": self.id,
             "body": self.body,
             "user": self.user.username,
-            "timestamp": self.timestamp.strftime("%b %d %Y, %I:%M:%S %p"),
-            "likes": [user.username for user in self.likes.all()]
-        }
+            "timestamp": self.timestamp.isoformat(),
+            "like_count": self.like_count,
+            "liked_by_me": liked_by_me,
+        })
+
+    def add_like(self, user):
+        # Returns False if the user already liked the post
+        through = Post.likes.through
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    through.objects.create(post_id=self.pk, user_id=user.pk)
+            except IntegrityError:
+                return False
+            Post.objects.filter(pk=self.pk).update(like_count=F("like_count") + 1)
+        likes_changed.send(sender=Post, post_ids=[self.pk], author_ids=[self.user_id], user_ids=[user.pk],
+                           deltas=[1])
+        return True
+
+    def remove_like(self, user):
+        # Returns False if the user had not liked the post
+        with transaction.atomic():
+            deleted, _ = Post.likes.through.objects.filter(post_id=self.pk, user_id=user.pk).delete()
+            if not deleted:
+                return False
+            Post.objects.filter(pk=self.pk).update(like_count=F("like_count") - 1)
+        likes_changed.send(sender=Post, post_ids=[self.pk], author_ids=[self.user_id], user_ids=[user.pk],
+                           deltas=[-1])
+        return True
+
+    @classmethod
+    def serialize_many(cls, posts, viewer=None):
+        # Authors are loaded for the whole batch up front, and the viewer's likes among these posts in a
+        # single query, so the cost does not depend on the number of posts or of likes
+        posts = list(posts)
+        prefetch_related_objects(posts, "user")
+        liked = set()
+        if viewer is not None and viewer.is_authenticated and posts:
+            liked = set(cls.likes.through.objects.filter(
+                user_id=viewer.pk, post_id__in=[post.pk for post in posts]
+            ).values_list("post_id", flat=True))
+            liked = overlay_pending_likes(posts, viewer.pk, liked)
+        with timed("serialize"):
+            return [post.serialize(liked_by_me=post.pk in liked) for post in posts]
 
     @classmethod
-    def get_paginated_posts(cls, page_number, posts_per_page, user=None, source='all'):
+    async def aserialize_many(cls, posts, viewer=None):
+        # Async version of serialize_many, for posts whose author was selected with the page
+        liked = set()
+        if viewer is not None and viewer.is_authenticated and posts:
+            liked = {post_id async for post_id in cls.likes.through.objects.filter(
+                user_id=viewer.pk, post_id__in=[post.pk for post in posts]
+            ).values_list("post_id", flat=True)}
+            liked = overlay_pending_likes(posts, viewer.pk, liked)
+        with timed("serialize"):
+            return [post.serialize(liked_by_me=post.pk in liked) for post in posts]
+
+    @classmethod
+    def get_feed_queryset(cls, user=None, source='all'):
         if user and source == 'following':
-            following_users = user.following.values_list('following')
-            queryset = cls.objects.filter(user__in=following_users).order_by("-timestamp")
+            queryset = cls.objects.filter(user_id__in=following_filter(user))
         elif user and source == 'profile':
-            queryset = cls.objects.filter(user=user).order_by("-timestamp")
+            queryset = cls.objects.filter(user=user)
+        elif user and source == 'liked':
+            queryset = cls.objects.filter(likes=user)
         else:
-            queryset = cls.objects.all().order_by("-timestamp")
+            queryset = cls.objects.all()
+        return queryset.select_related("user")
+
+    @classmethod
+    def get_paginated_posts(cls, page_number, posts_per_page, user=None, source='all', viewer=None):
+        queryset = cls.get_feed_queryset(user, source).order_by("-timestamp", "-id")
         paginator = Paginator(queryset, posts_per_page)
         total_pages = paginator.num_pages
         try:
             posts = paginator.page(page_number)
         except EmptyPage:
             posts = paginator.page(total_pages)
-        serialized_posts = [post.serialize() for post in posts]
+        serialized_posts = cls.serialize_many(posts, viewer)
         return serialized_posts, total_pages, posts.has_next(), posts.has_previous()
 
+    @classmethod
+    def get_cursor_posts(cls, cursor, posts_per_page, user=None, source='all', with_count=False, viewer=None):
+        # Keyset pagination on (timestamp, id): the cost of a page does not depend on how deep it is
+        if user and source == 'following':
+            sources = TimelineEntry.get_feed_sources(user)
+        elif source == 'ranked':
+            sources = PostScore.get_feed_sources(user)
+        else:
+            sources = [(cls.get_feed_queryset(user, source), ("timestamp", "id"))]
+        rows, next_cursor, prev_cursor = keyset_merge(sources, cursor, posts_per_page)
+        if source == 'ranked':
+            # Loaded after the page is picked, so that only its rows are joined with their posts
+            posts = cls.objects.select_related("user").in_bulk([row.post_id for row in rows])
+            posts = [posts[row.post_id] for row in rows]
+        else:
+            posts = [row.post if isinstance(row, TimelineEntry) else row for row in rows]
+        total_pages = None
+        if with_count:
+            # Approximate for the following feed, where a post may be counted in both sources
+            total = sum(queryset.count() for queryset, _ in sources)
+            total_pages = max(1, -(-total // posts_per_page))
+        serialized_posts = cls.serialize_many(posts, viewer)
+        return serialized_posts, total_pages, next_cursor, prev_cursor
+
+    @classmethod
+    async def aget_paginated_posts(cls, page_number, posts_per_page, user=None, source='all', viewer=None):
+        # Async version of get_paginated_posts; out of range pages fall back to the last page like
+        # Paginator does
+        queryset = cls.get_feed_queryset(user, source).order_by("-timestamp", "-id")
+        total_pages = max(1, -(-await queryset.acount() // posts_per_page))
+        if not 1 <= page_number <= total_pages:
+            page_number = total_pages
+        offset = (page_number - 1) * posts_per_page
+        posts = [post async for post in queryset[offset:offset + posts_per_page]]
+        serialized_posts = await cls.aserialize_many(posts, viewer)
+        return serialized_posts, total_pages, page_number < total_pages, page_number > 1
+
+    @classmethod
+    async def aget_cursor_posts(cls, cursor, posts_per_page, user=None, source='all', with_count=False,
+                                viewer=None):
+        # Async version of get_cursor_posts
+        if user and source == 'following':
+            sources = await TimelineEntry.aget_feed_sources(user)
+        else:
+            sources = [(cls.get_feed_queryset(user, source), ("timestamp", "id"))]
+        rows, next_cursor, prev_cursor = await akeyset_merge(sources, cursor, posts_per_page)
+        posts = [row.post if isinstance(row, TimelineEntry) else row for row in rows]
+        total_pages = None
+        if with_count:
+            total = sum([await queryset.acount() for queryset, _ in sources])
+            total_pages = max(1, -(-total // posts_per_page))
+        serialized_posts = await cls.aserialize_many(posts, viewer)
+        return serialized_posts, total_pages, next_cursor, prev_cursor
+
+    def get_likers(self, cursor, likers_per_page):
+        # Most recent likes first, keyed on the through table's id
+        queryset = Post.likes.through.objects.filter(post_id=self.pk).select_related("user")
+        likes, next_cursor, prev_cursor = keyset_page(queryset, cursor, likers_per_page, keys=("id",))
+        return [like.user.username for like in likes], next_cursor, prev_cursor
+
     @classmethod
     def get_liked_posts(cls, user):
         # Retrieve posts liked by the given user
         liked_posts = cls.objects.filter(likes=user).order_by("-timestamp")
         return liked_posts
+
+
+class TimelineEntry(models.Model):
+    """
+    Materialized home timeline: one row per (follower, post) written when the post is created
+    (fan-out-on-write), so reading the following feed is a single range scan on (owner, timestamp).
+
+    Authors with more than NETWORK_TIMELINE_FANOUT_LIMIT followers are not fanned out; their posts are
+    merged in at read time instead. Each timeline keeps roughly the NETWORK_TIMELINE_LENGTH newest posts.
+    """
+    owner = models.ForeignKey("User", on_delete=models.CASCADE, related_name="timeline", db_index=False)
+    post = models.ForeignKey("Post", on_delete=models.CASCADE, related_name="timeline_entries")
+    # Copied from the post so that the timeline index covers the feed ordering
+    timestamp = models.DateTimeField()
+
+    # Timelines are trimmed once every TRIM_INTERVAL posts, so they may briefly run over their length
+    TRIM_INTERVAL = 50
+
+    def __str__(self):
+        return f"{self.post_id} in the timeline of {self.owner_id}"
+
+    class Meta:
+        unique_together = ["owner", "post"]
+        indexes = [
+            models.Index(fields=["owner", "-timestamp", "-post"], name="network_timeline_feed_idx"),
+        ]
+
+    @staticmethod
+    def timeline_length():
+        return getattr(settings, "NETWORK_TIMELINE_LENGTH", 800)
+
+    @staticmethod
+    def fanout_limit():
+        return getattr(settings, "NETWORK_TIMELINE_FANOUT_LIMIT", 10000)
+
+    @classmethod
+    def get_feed_sources(cls, user):
+        # Keyset sources for the following feed: the materialized timeline, plus the posts of followed
+        # authors that are too popular to be fanned out
+        return cls._feed_sources(user, list(cls._popular_authors(user)))
+
+    @classmethod
+    async def aget_feed_sources(cls, user):
+        return cls._feed_sources(user, [author_id async for author_id in cls._popular_authors(user)])
+
+    @classmethod
+    def _popular_authors(cls, user):
+        return Follow.objects.filter(
+            follower=user, following__follower_count__gt=cls.fanout_limit()
+        ).values_list("following_id", flat=True)
+
+    @classmethod
+    def _feed_sources(cls, user, popular_authors):
+        sources = [(cls.objects.filter(owner=user).select_related("post__user"), ("timestamp", "post_id"))]
+        if popular_authors:
+            sources.append((Post.objects.filter(user_id__in=popular_authors).select_related("user"),
+                            ("timestamp", "id")))
+        return sources
+
+    @classmethod
+    def fan_out(cls, post):
+        # Append a new post to the timeline of each of its author's followers, unless the author has too many.
+        # Their follower count is read with the followers: post.user may be a cached, stale request.user.
+        follower_ids = list(Follow.objects.using(router.db_for_write(cls)).filter(
+            following_id=post.user_id, following__follower_count__lte=cls.fanout_limit(),
+        ).values_list("follower_id", flat=True))
+        cls.objects.bulk_create(
+            [cls(owner_id=follower_id, post=post, timestamp=post.timestamp) for follower_id in follower_ids],
+            batch_size=500, ignore_conflicts=True,
+        )
+        if post.pk % cls.TRIM_INTERVAL == 0:
+            cls.trim(follower_ids)
+        return len(follower_ids)
+
+    @classmethod
+    def backfill(cls, owner, author):
+        # Copy the newest posts of a newly followed author into the follower's timeline
+        if author.follower_count > cls.fanout_limit():
+            return
+        posts = Post.objects.filter(user=author).order_by("-timestamp", "-id").values_list("id", "timestamp")
+        cls.objects.bulk_create(
+            [cls(owner=owner, post_id=post_id, timestamp=timestamp)
+             for post_id, timestamp in posts[:cls.timeline_length()]],
+            batch_size=500, ignore_conflicts=True,
+        )
+        cls.trim([owner.pk])
+
+    @classmethod
+    def remove_author(cls, owner, author):
+        cls.objects.filter(owner=owner, post__user=author).delete()
+
+    @classmethod
+    def trim(cls, owner_ids=None):
+        # Drop everything past the newest timeline_length() entries of each timeline, in one statement
+        entries = cls.objects.all() if owner_ids is None else cls.objects.filter(owner_id__in=owner_ids)
+        overflow = entries.annotate(rank=Window(
+            RowNumber(), partition_by=F("owner_id"), order_by=[F("timestamp").desc(), F("post_id").desc()]
+        )).filter(rank__gt=cls.timeline_length())
+        deleted, _ = cls.objects.filter(pk__in=overflow.values("pk")).delete()
+        return deleted
+
+    # Timelines rebuilt per statement by rebuild()
+    REBUILD_BATCH_SIZE = 1000
+
+    @classmethod
+    def rebuild(cls):
+        # Recreate every timeline from the follow graph, e.g. after a bulk import: each batch of owners
+        # is one INSERT ... SELECT ranking the posts of the authors they follow, with no row going
+        # through Python
+        using = router.db_for_write(cls)
+        insert = f"""
+            INSERT INTO {cls._meta.db_table} (owner_id, post_id, timestamp)
+            SELECT owner_id, post_id, timestamp FROM (
+                SELECT follow.follower_id AS owner_id, post.id AS post_id, post.timestamp AS timestamp,
+                       ROW_NUMBER() OVER (PARTITION BY follow.follower_id
+                                          ORDER BY post.timestamp DESC, post.id DESC) AS row_rank
+                FROM {Follow._meta.db_table} follow
+                JOIN {User._meta.db_table} author ON author.id = follow.following_id
+                JOIN {Post._meta.db_table} post ON post.user_id = follow.following_id
+                WHERE follow.follower_id >= %s AND follow.follower_id <= %s AND author.follower_count <= %s
+            ) ranked
+            WHERE row_rank <= %s
+        """
+        owner_ids = Follow.objects.using(using).order_by("follower_id").values_list("follower_id", flat=True).distinct()
+        last_id = 0
+        with transaction.atomic(using=using), connections[using].cursor() as cursor:
+            cls.objects.using(using).all().delete()
+            while batch := list(owner_ids.filter(follower_id__gt=last_id)[:cls.REBUILD_BATCH_SIZE]):
+                cursor.execute(insert, [batch[0], batch[-1], cls.fanout_limit(), cls.timeline_length()])
+                last_id = batch[-1]
+
+
+class PostScore(models.Model):
+    """
+    Precomputed ranking score of a post, for the ranked feed (see network.ranking). Rows are written in
+    batches by refresh(), run periodically by the refresh_scores command, for the posts that are new or
+    whose like count or author's follower count changed since their last refresh.
+    """
+    post = models.OneToOneField("Post", on_delete=models.CASCADE, primary_key=True, related_name="score")
+    # Copied from the post so that the followed authors' posts are a range of the index
+    author = models.ForeignKey("User", on_delete=models.CASCADE, related_name="+", db_index=False)
+    score = models.FloatField()
+    # The score for readers who follow the author
+    followed_score = models.FloatField()
+    # The inputs the scores were computed from, to find the stale ones
+    like_count = models.PositiveIntegerField()
+    author_follower_count = models.PositiveIntegerField()
+
+    REFRESH_BATCH_SIZE = 5000
+
+    def __str__(self):
+        return f"{self.post_id} scored {self.score}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-score", "-post"], name="network_postscore_feed_idx"),
+            models.Index(fields=["author", "-followed_score", "-post"], name="network_postscore_author_idx"),
+        ]
+
+    @classmethod
+    def get_feed_sources(cls, user=None):
+        # Keyset sources for the ranked feed: everything by score, or for a reader the posts of the
+        # authors they follow by followed_score merged with everyone else's by score
+        scores = cls.objects.all()
+        if user is None:
+            return [(scores, ("score", "post_id"))]
+        followed = following_filter(user)
+        return [
+            (scores.filter(author_id__in=followed), ("followed_score", "post_id")),
+            (scores.exclude(author_id__in=followed), ("score", "post_id")),
+        ]
+
+    @classmethod
+    def refresh(cls, full=False):
+        # Rescore the stale posts, or all of them, REFRESH_BATCH_SIZE at a time: each batch is one read,
+        # one array computation and one upsert. Returns the number of posts scored.
+        posts = Post.objects.all()
+        if not full:
+            posts = posts.filter(
+                Q(score__isnull=True) | ~Q(score__like_count=F("like_count"))
+                | ~Q(score__author_follower_count=F("user__follower_count"))
+            )
+        fields = ("id", "user_id", "like_count", "user__follower_count", "timestamp")
+        last_id = refreshed = 0
+        while rows := list(posts.filter(id__gt=last_id).order_by("id").values_list(*fields)[
+                :cls.REFRESH_BATCH_SIZE]):
+            post_ids, author_ids, like_counts, follower_counts, timestamps = zip(*rows)
+            scores, followed_scores = compute_scores(like_counts, follower_counts,
+                                                     [timestamp.timestamp() for timestamp in timestamps])
+            cls.objects.bulk_create(
+                [cls(post_id=post_id, author_id=author_id, score=score, followed_score=followed_score,
+                     like_count=like_count, author_follower_count=follower_count)
+                 for post_id, author_id, like_count, follower_count, score, followed_score
+                 in zip(post_ids, author_ids, like_counts, follower_counts, scores, followed_scores)],
+                update_conflicts=True, unique_fields=["post"],
+                update_fields=["score", "followed_score", "like_count", "author_follower_count"],
+            )
+            refreshed += len(rows)
+            last_id = post_ids[-1]
+        return refreshed
+
+
+class ProfileSummary(models.Model):
+    """
+    Read-optimized summary of a user's activity, loaded with the user by the profile API. Kept in step by
+    the receivers in signals.py and rebuilt by `rebuild_profiles`; a missing row is rebuilt on first use.
+    Follower and following counts are the User counters.
+    """
+    user = models.OneToOneField("User", on_delete=models.CASCADE, primary_key=True, related_name="summary")
+    post_count = models.PositiveIntegerField(default=0)
+    latest_post = models.ForeignKey("Post", on_delete=models.SET_NULL, null=True, related_name="+")
+    # Time of the user's latest post, like, follow or edit
+    last_active = models.DateTimeField(null=True)
+
+    REBUILD_BATCH_SIZE = 1000
+
+    def __str__(self):
+        return f"Summary of {self.user_id}"
+
+    def serialize(self):
+        return {
+            "post_count": self.post_count,
+            "latest_post": self.latest_post_id,
+            "last_active": self.last_active.isoformat() if self.last_active else None,
+        }
+
+    @classmethod
+    def record_post(cls, post):
+        if not cls.objects.filter(user_id=post.user_id).update(
+            post_count=F("post_count") + 1, latest_post=post, last_active=post.timestamp,
+        ):
+            cls.rebuild([post.user_id])
+
+    @classmethod
+    def forget_post(cls, post):
+        # The post is already deleted, and latest_post set to null if it was this one
+        latest = Post.objects.filter(user_id=post.user_id).order_by("-timestamp", "-id").values("id")[:1]
+        cls.objects.filter(user_id=post.user_id).update(
+            post_count=Greatest(F("post_count") - 1, 0), latest_post=Subquery(latest),
+        )
+
+    @classmethod
+    def touch(cls, user_ids, when=None):
+        cls.objects.filter(user_id__in=user_ids).update(last_active=when or timezone.now())
+
+    @classmethod
+    def for_user(cls, user):
+        # The user's summary, rebuilt if missing, e.g. for users created with bulk_create
+        try:
+            return user.summary
+        except cls.DoesNotExist:
+            cls.rebuild([user.pk])
+            user.summary = cls.objects.using(router.db_for_write(cls)).get(pk=user.pk)
+            return user.summary
+
+    @classmethod
+    def rebuild(cls, user_ids=None):
+        # Recompute the summaries of the given users, or of everyone, from their posts on the primary,
+        # keeping activity times more recent than their latest post. Returns the number of summaries written.
+        using = router.db_for_write(cls)
+        users = User.objects.using(using).all()
+        if user_ids is not None:
+            users = users.filter(pk__in=user_ids)
+        latest = Post.objects.filter(user=OuterRef("pk")).order_by("-timestamp", "-id")
+        post_counts = Post.objects.filter(user=OuterRef("pk")).order_by().values("user").annotate(
+            total=Count("*")).values("total")
+        users = users.annotate(
+            post_count=Coalesce(Subquery(post_counts, output_field=models.IntegerField()), Value(0)),
+            latest_post_id=Subquery(latest.values("id")[:1]),
+            latest_timestamp=Subquery(latest.values("timestamp")[:1]),
+        ).order_by("id").values_list("id", "post_count", "latest_post_id", "latest_timestamp")
+        last_id = written = 0
+        with transaction.atomic(using=using):
+            while rows := list(users.filter(id__gt=last_id)[:cls.REBUILD_BATCH_SIZE]):
+                last_active = dict(cls.objects.using(using).filter(user_id__in=[row[0] for row in rows]).values_list(
+                    "user_id", "last_active"))
+                cls.objects.using(using).bulk_create(
+                    [cls(user_id=user_id, post_count=post_count, latest_post_id=latest_post_id,
+                         last_active=max(filter(None, (latest_timestamp, last_active.get(user_id))), default=None))
+                     for user_id, post_count, latest_post_id, latest_timestamp in rows],
+                    update_conflicts=True, unique_fields=["user"],
+                    update_fields=["post_count", "latest_post", "last_active"],
+                )
+                written += len(rows)
+                last_id = rows[-1][0]
+        return written
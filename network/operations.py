@@ -0,0 +1,143 @@
+from django.core.exceptions import ValidationError
+from django.db import connections, router
+
+from .follows import is_following
+from .likes import buffer_like, like_batching_enabled, likes_post
+from .models import User, Post, Follow, TimelineEntry
+from .pagination import MAX_INTEGER, MIN_INTEGER
+
+# The mutations behind the write API, for an authenticated user. Each returns the response payload and
+# status, so that they can be served one per request by the views or several per request by the batch
+# endpoint.
+
+
+def valid_post_id(post_id):
+    # An int the primary key column can hold: larger ones overflow in the database driver
+    if isinstance(post_id, bool) or not isinstance(post_id, int):
+        return False
+    low, high = connections[router.db_for_read(Post)].ops.integer_field_range(Post._meta.pk.get_internal_type())
+    # SQLite reports no bounds, its integers are 64-bit
+    return (MIN_INTEGER if low is None else low) <= post_id <= (MAX_INTEGER if high is None else high)
+
+
+def _get_post(post_id):
+    if not valid_post_id(post_id):
+        return None
+    try:
+        return Post.objects.get(pk=post_id)
+    except Post.DoesNotExist:
+        return None
+
+
+def _validate_body(body):
+    if not body:
+        return {"error": "Message missing a 'body' parameter."}
+    max_body_length = Post._meta.get_field("body").max_length
+    if len(body) > max_body_length:
+        return {"error": f"Post body exceeds the maximum length of {max_body_length} characters."}
+    return None
+
+
+def like(user, post_id):
+    post = _get_post(post_id)
+    if post is None:
+        return {"error": "No Post matches the given query."}, 404
+
+    if like_batching_enabled():
+        buffer_like(post.pk, user.pk, True)
+    else:
+        post.add_like(user)
+    return {"message": "Post liked successfully."}, 200
+
+
+def unlike(user, post_id):
+    post = _get_post(post_id)
+    if post is None:
+        return {"error": "No Post matches the given query."}, 404
+
+    if like_batching_enabled():
+        if not likes_post(post, user):
+            return {"error": "You have not liked this post."}, 400
+        buffer_like(post.pk, user.pk, False)
+    elif not post.remove_like(user):
+        return {"error": "You have not liked this post."}, 400
+    return {"message": "Post unliked successfully."}, 200
+
+
+def follow(user, username):
+    user_to_follow = User.objects.filter(username=username).first()
+    if user_to_follow is None:
+        return {"error": "No User matches the given query."}, 404
+
+    if user == user_to_follow:
+        return {"message": "You cannot follow yourself."}, 200
+    if is_following(user.pk, user_to_follow.pk):
+        return {"message": "Successfully followed."}, 200
+
+    if Follow.add(user, user_to_follow):
+        TimelineEntry.backfill(user, user_to_follow)
+    return {"message": "Successfully followed."}, 200
+
+
+def unfollow(user, username):
+    user_to_unfollow = User.objects.filter(username=username).first()
+    if user_to_unfollow is None:
+        return {"error": "No User matches the given query."}, 404
+
+    if Follow.remove(user, user_to_unfollow):
+        TimelineEntry.remove_author(user, user_to_unfollow)
+    return {"message": "Successfully unfollowed."}, 200
+
+
+def create_post(user, body):
+    error = _validate_body(body)
+    if error:
+        return error, 400
+
+    new_post = Post(user=user, body=body)
+    try:
+        new_post.full_clean()  # Run model validation before saving
+    except ValidationError as e:
+        return {"error": e.message_dict}, 400
+
+    new_post.save()
+    TimelineEntry.fan_out(new_post)
+    return {"message": "Post created successfully.", "id": new_post.pk}, 200
+
+
+def edit_post(user, post_id, body):
+    post = _get_post(post_id)
+    if post is None:
+        return {"error": "No Post matches the given query."}, 404
+
+    error = _validate_body(body)
+    if error:
+        return error, 400
+
+    if body == post.body:
+        return {"message": "No changes were made to the post."}, 400
+
+    if post.user_id != user.pk:
+        return {"error": "You are not authorized to edit this post."}, 403
+
+    post.body = body
+    post.save()
+    return {"message": "Post updated successfully."}, 200
+
+
+# Operations accepted by the batch endpoint, at most BATCH_MAX_OPERATIONS per batch, with the parameters
+# each one takes and the check of each parameter's JSON value
+BATCH_MAX_OPERATIONS = 100
+BATCH_PARAMETERS = {
+    "post_id": valid_post_id,
+    "username": lambda value: isinstance(value, str),
+    "body": lambda value: isinstance(value, str),
+}
+BATCH_OPERATIONS = {
+    "like": (like, ("post_id",)),
+    "unlike": (unlike, ("post_id",)),
+    "follow": (follow, ("username",)),
+    "unfollow": (unfollow, ("username",)),
+    "post": (create_post, ("body",)),
+    "edit": (edit_post, ("post_id", "body")),
+}
@@ -0,0 +1,151 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.db.models import Q
+
+
+# Bounds of the integers a cursor may hold, those of a 64-bit database integer
+MIN_INTEGER, MAX_INTEGER = -2 ** 63, 2 ** 63 - 1
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _cursor_value(value):
+    # Keep full microsecond precision, DjangoJSONEncoder truncates datetimes to milliseconds
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {type(value).__name__} in a cursor.")
+
+
+def encode_cursor(direction, values):
+    # Cursors are opaque to clients: a url-safe base64 blob of the direction and the key values
+    raw = json.dumps([direction, list(values)], default=_cursor_value, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_raw_cursor(cursor, key_count):
+    # The direction and key values of a cursor, as decoded from JSON
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        direction, values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        raise InvalidCursor("Malformed cursor.")
+    if direction not in ("next", "prev") or not isinstance(values, list) or len(values) != key_count:
+        raise InvalidCursor("Malformed cursor.")
+    # Database drivers overflow on integers past 64 bits rather than just matching nothing
+    if any(isinstance(value, int) and not MIN_INTEGER <= value <= MAX_INTEGER for value in values):
+        raise InvalidCursor("Malformed cursor.")
+    return direction, values
+
+
+def decode_cursor(cursor, queryset, keys):
+    direction, values = decode_raw_cursor(cursor, len(keys))
+    opts = queryset.model._meta
+    try:
+        values = [opts.get_field(key).to_python(value) for key, value in zip(keys, values)]
+    except Exception:
+        raise InvalidCursor("Malformed cursor.")
+    return direction, values
+
+
+def _seek_filter(keys, values, lookup):
+    # Row-value comparison "(k1, k2, ...) < (v1, v2, ...)" spelled out portably as
+    # k1 < v1 OR (k1 = v1 AND k2 < v2) OR ..., plus a redundant "k1 <= v1" so that the database can
+    # seek straight into the index instead of scanning it from the top
+    condition = Q()
+    for i, key in enumerate(keys):
+        condition |= Q(**dict(zip(keys[:i], values[:i])), **{f"{key}__{lookup}": values[i]})
+    if len(keys) > 1:
+        condition &= Q(**{f"{keys[0]}__{lookup}e": values[0]})
+    return condition
+
+
+def _page_querysets(sources, cursor, per_page):
+    # The sliced queryset to read from each source, so that sync and async callers share the logic
+    first_queryset, first_keys = sources[0]
+    if cursor:
+        direction, values = decode_cursor(cursor, first_queryset, first_keys)
+    else:
+        direction, values = "next", None
+
+    querysets = []
+    for queryset, keys in sources:
+        if direction == "next":
+            if values is not None:
+                queryset = queryset.filter(_seek_filter(keys, values, "lt"))
+            querysets.append(queryset.order_by(*[f"-{key}" for key in keys])[:per_page + 1])
+        else:
+            queryset = queryset.filter(_seek_filter(keys, values, "gt"))
+            querysets.append(queryset.order_by(*keys)[:per_page + 1])
+    return direction, values, querysets
+
+
+def _merge_page(sources, direction, values, results, per_page):
+    keyed_rows = []
+    for (_, keys), rows in zip(sources, results):
+        keyed_rows.extend((tuple(getattr(row, key) for key in keys), row) for row in rows)
+    keyed_rows.sort(key=lambda keyed_row: keyed_row[0], reverse=direction == "next")
+    unique_rows = []
+    for key, row in keyed_rows:
+        if not unique_rows or unique_rows[-1][0] != key:
+            unique_rows.append((key, row))
+
+    has_more = len(unique_rows) > per_page
+    unique_rows = unique_rows[:per_page]
+    if direction == "next":
+        has_next, has_previous = has_more, values is not None
+    else:
+        unique_rows.reverse()
+        has_next, has_previous = True, has_more
+
+    next_cursor = prev_cursor = None
+    if unique_rows and has_next:
+        next_cursor = encode_cursor("next", unique_rows[-1][0])
+    if unique_rows and has_previous:
+        prev_cursor = encode_cursor("prev", unique_rows[0][0])
+    return [row for _, row in unique_rows], next_cursor, prev_cursor
+
+
+def keyset_merge(sources, cursor, per_page):
+    """
+    Return one page of the union of ``sources`` in descending key order, seeking past ``cursor``.
+
+    ``sources`` is a list of ``(queryset, keys)`` pairs whose keys hold the same kind of values, for
+    example a timeline table and a posts table both keyed on (timestamp, post id). The last key must be
+    unique so that the order is total; rows with equal keys in several sources are returned once.
+
+    The cost of a page only depends on ``per_page``: no COUNT(*) and no OFFSET are issued.
+    Returns ``(rows, next_cursor, prev_cursor)`` where a cursor is None when there is no such page.
+    """
+    direction, values, querysets = _page_querysets(sources, cursor, per_page)
+    results = [list(queryset) for queryset in querysets]
+    return _merge_page(sources, direction, values, results, per_page)
+
+
+async def akeyset_merge(sources, cursor, per_page):
+    """
+    Async version of keyset_merge.
+    """
+    direction, values, querysets = _page_querysets(sources, cursor, per_page)
+    results = [[row async for row in queryset] for queryset in querysets]
+    return _merge_page(sources, direction, values, results, per_page)
+
+
+def keyset_page(queryset, cursor, per_page, keys=("timestamp", "id")):
+    """
+    Return one page of ``queryset`` in descending ``keys`` order, seeking past ``cursor``.
+    See keyset_merge.
+    """
+    return keyset_merge([(queryset, keys)], cursor, per_page)
+
+
+def rows_page(rows, keys, direction, values, per_page):
+    """
+    Turn up to ``per_page + 1`` rows, read past the cursor values in ``direction`` by the caller, into a
+    page like keyset_page's. For sources that are not querysets, such as raw SQL.
+    """
+    return _merge_page([(None, keys)], direction, values, [rows], per_page)
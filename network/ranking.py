@@ -0,0 +1,41 @@
+import math
+
+from django.conf import settings
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Scores of the ranked feed (see PostScore). A post's score is
+#
+#     log(1 + likes) + author_weight * log(1 + author's followers) + timestamp / decay
+#
+# which orders posts exactly like likes decayed by a factor e every `decay` seconds, times a weight for
+# the author's audience, would at any instant, but without `now` in it: a score only changes when its
+# inputs do, so the score table is refreshed incrementally. Readers who follow the author add
+# NETWORK_RANKED_FOLLOW_BONUS on top (see PostScore.followed_score).
+
+
+def ranking_settings():
+    return (
+        getattr(settings, "NETWORK_RANKED_DECAY_HOURS", 12) * 3600,
+        getattr(settings, "NETWORK_RANKED_AUTHOR_WEIGHT", 0.5),
+        getattr(settings, "NETWORK_RANKED_FOLLOW_BONUS", 2.0),
+    )
+
+
+def compute_scores(like_counts, follower_counts, timestamps):
+    """
+    Return the (score, followed score) lists of posts given as parallel lists of like counts, author
+    follower counts and POSIX timestamps. Computed on whole arrays with numpy when it is installed.
+    """
+    decay, author_weight, follow_bonus = ranking_settings()
+    if numpy is not None:
+        scores = (numpy.log1p(numpy.asarray(like_counts, dtype=numpy.float64))
+                  + author_weight * numpy.log1p(numpy.asarray(follower_counts, dtype=numpy.float64))
+                  + numpy.asarray(timestamps, dtype=numpy.float64) / decay)
+        return scores.tolist(), (scores + follow_bonus).tolist()
+    scores = [math.log1p(likes) + author_weight * math.log1p(followers) + timestamp / decay
+              for likes, followers, timestamp in zip(like_counts, follower_counts, timestamps)]
+    return scores, [score + follow_bonus for score in scores]
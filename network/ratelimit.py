@@ -0,0 +1,226 @@
+import math
+import threading
+import time
+import weakref
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+
+# Admission control for the write API. Each client, a user or else an IP address, has a token bucket
+# per scope of NETWORK_RATE_LIMITS: a bucket holds up to N tokens and refills at N per period, and a
+# write takes one token per operation, or is refused with 429 and the Retry-After of its next token.
+# Buckets live in the NETWORK_RATE_LIMIT_CACHE_ALIAS cache, shared by the processes using it, and in
+# process memory if the cache fails. A bucket is locked in the process during its cache round trip, but
+# not across processes: concurrent writes by one client may occasionally both get the last token.
+#
+# On top of that, at most NETWORK_WRITE_CONCURRENCY writes run at once in a process: the next one is
+# shed with 429 at once rather than queued behind the database's write lock.
+
+RATE_KEY = "network:ratelimit:{scope}:{client}"
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# The scope charged for each batch operation (see operations.BATCH_OPERATIONS)
+OPERATION_SCOPES = {"post": "post", "edit": "edit", "like": "like", "unlike": "like", "follow": "follow",
+                    "unfollow": "follow"}
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+
+def _count(*key):
+    with _stats_lock:
+        _stats[key] = _stats.get(key, 0) + 1
+
+
+def rate_limit_stats():
+    # {(scope, "allowed" | "limited"): count, ("gate", "admitted" | "shed"): count, ("cache", "fallback"): count}
+    with _stats_lock:
+        return dict(_stats)
+
+
+def parse_rate(rate):
+    # "30/m" -> (capacity 30, refilled at 0.5 token per second)
+    count, _, period = rate.partition("/")
+    if period not in PERIODS or not count.isdigit() or int(count) < 1:
+        raise ValueError(f"Invalid rate {rate!r}: expected a count per s, m, h or d, such as '30/m'.")
+    return int(count), int(count) / PERIODS[period]
+
+
+class TokenBuckets:
+    """
+    Token buckets stored in a Django cache, or in this object if the cache fails.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # One lock per bucket in use, so that buckets don't wait for each other's cache round trips
+        self._locks = weakref.WeakValueDictionary()
+        self._memory = {}
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _cache(self):
+        alias = getattr(settings, "NETWORK_RATE_LIMIT_CACHE_ALIAS", "default")
+        return caches[alias] if alias else None
+
+    def _load(self, key):
+        try:
+            cache = self._cache()
+            if cache is not None:
+                return cache.get(key), cache
+        except Exception:
+            _count("cache", "fallback")
+        return self._memory.get(key), None
+
+    def take(self, key, capacity, rate, cost=1):
+        """
+        Take ``cost`` tokens from the bucket ``key``. Returns None if they were taken, else the number of
+        seconds until they would be available. A negative cost gives tokens back, up to the capacity.
+        """
+        with self._key_lock(key):
+            state, cache = self._load(key)
+            now = time.time()
+            tokens, updated = state or (capacity, now)
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                tokens = min(capacity, tokens - cost)
+                retry_after = None
+            else:
+                # A cost over the capacity can never be paid: wait for a full bucket and fail again
+                retry_after = (min(cost, capacity) - tokens) / rate
+            state, timeout = (tokens, now), math.ceil(capacity / rate)
+            try:
+                if cache is not None:
+                    cache.set(key, state, timeout)
+                    return retry_after
+            except Exception:
+                _count("cache", "fallback")
+            self._memory[key] = state
+            return retry_after
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+
+buckets = TokenBuckets()
+
+
+def client_key(request):
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def check_rates(request, costs):
+    """
+    Charge the client of ``request`` ``costs``, a {scope: operations} dict, to its buckets. Returns None
+    if every scope admitted them, else the longest Retry-After in seconds, and then nothing is charged.
+    """
+    limits = getattr(settings, "NETWORK_RATE_LIMITS", {})
+    client = client_key(request)
+    retry_after = None
+    taken = []
+    for scope, cost in costs.items():
+        if scope not in limits or not cost:
+            continue
+        key, (capacity, rate) = RATE_KEY.format(scope=scope, client=client), parse_rate(limits[scope])
+        wait = buckets.take(key, capacity, rate, cost)
+        _count(scope, "allowed" if wait is None else "limited")
+        if wait is None:
+            taken.append((key, capacity, rate, cost))
+        else:
+            retry_after = max(wait, retry_after or 0)
+    if retry_after is not None:
+        # The scopes that admitted their share get it back
+        for key, capacity, rate, cost in taken:
+            buckets.take(key, capacity, rate, -cost)
+    return retry_after
+
+
+class WriteGate:
+    """
+    Counts the writes in progress in this process, admitting at most NETWORK_WRITE_CONCURRENCY.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def enter(self):
+        limit = getattr(settings, "NETWORK_WRITE_CONCURRENCY", None)
+        with self._lock:
+            if limit is not None and self.in_flight >= limit:
+                _count("gate", "shed")
+                return False
+            self.in_flight += 1
+        _count("gate", "admitted")
+        return True
+
+    def exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+
+write_gate = WriteGate()
+
+
+def too_many_requests(retry_after):
+    response = JsonResponse({"error": "Too many requests, try again later."}, status=429)
+    response["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def _admit(request, scope):
+    # The response refusing the request, or None once it holds a place in the write gate
+    if scope is not None:
+        retry_after = check_rates(request, {scope: 1})
+        if retry_after is not None:
+            return too_many_requests(retry_after)
+    if not write_gate.enter():
+        return too_many_requests(getattr(settings, "NETWORK_WRITE_GATE_RETRY_AFTER", 1))
+    return None
+
+
+def admit_write(scope=None):
+    """
+    Decorate a write view: its unsafe requests take a token of ``scope`` (none if None, for views that
+    charge their own costs with check_rates) and a place in the write gate, or get a 429 response.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def inner(request, *args, **kwargs):
+                if request.method in SAFE_METHODS:
+                    return await view(request, *args, **kwargs)
+                # Resolving the user may read the session
+                refused = await sync_to_async(_admit)(request, scope)
+                if refused is not None:
+                    return refused
+                try:
+                    return await view(request, *args, **kwargs)
+                finally:
+                    write_gate.exit()
+        else:
+            @wraps(view)
+            def inner(request, *args, **kwargs):
+                if request.method in SAFE_METHODS:
+                    return view(request, *args, **kwargs)
+                refused = _admit(request, scope)
+                if refused is not None:
+                    return refused
+                try:
+                    return view(request, *args, **kwargs)
+                finally:
+                    write_gate.exit()
+        return inner
+    return decorator
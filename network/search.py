@@ -0,0 +1,147 @@
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Post
+from .pagination import InvalidCursor, decode_raw_cursor, keyset_page, rows_page
+
+# Full-text search over posts. On SQLite the index is the network_post_search FTS5 table (see migration
+# 0008), holding a copy of each post's body under the post's id as rowid. It is kept in step by the
+# signal receivers below, in the transaction that writes the post, and can be rebuilt in bulk by the
+# rebuild_search_index command, e.g. after rows were written with bulk_create.
+#
+# Results are ranked by BM25 relevance, newest first between equal scores, and paginated by cursor on
+# (score, id). Only the NETWORK_SEARCH_WINDOW newest matches are ranked: the window is found by walking
+# the index's posting list from its end, so the cost of a query is bounded even for terms that occur in
+# millions of posts.
+#
+# Other databases have no index: their search is a body__icontains scan, newest first, meant for
+# development only.
+
+SEARCH_TABLE = "network_post_search"
+MAX_TERMS = 10
+
+SearchHit = namedtuple("SearchHit", ["score", "id"])
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def search_window():
+    return getattr(settings, "NETWORK_SEARCH_WINDOW", 10000)
+
+
+def is_indexed(connection):
+    return connection.vendor == "sqlite"
+
+
+def parse_query(query):
+    # Only words are searched for, all of them: each is quoted, so that the FTS5 query syntax is never
+    # interpreted from user input
+    terms = re.findall(r"\w+", query)[:MAX_TERMS]
+    if not terms:
+        raise InvalidQuery("The query must contain at least one word.")
+    return terms
+
+
+def index_posts(posts, using="default"):
+    connection = connections[using]
+    if not is_indexed(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [(post.pk,) for post in posts])
+        cursor.executemany(f"INSERT INTO {SEARCH_TABLE} (rowid, body) VALUES (%s, %s)",
+                           [(post.pk, post.body) for post in posts])
+
+
+def unindex_posts(post_ids, using="default"):
+    connection = connections[using]
+    if not is_indexed(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [(post_id,) for post_id in post_ids])
+
+
+def rebuild_index(using="default"):
+    """
+    Reindex every post in a few statements and merge the index into one segment. Returns the number of
+    posts indexed.
+    """
+    connection = connections[using]
+    if not is_indexed(connection):
+        return 0
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} (rowid, body) SELECT id, body FROM {Post._meta.db_table}")
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+        cursor.execute(f"SELECT count(*) FROM {SEARCH_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def _search_hits(connection, terms, direction, values, limit):
+    match = " ".join(f'"{term}"' for term in terms)
+    score = f"-bm25({SEARCH_TABLE})"
+    sql = [
+        f"SELECT {score}, rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s",
+        f"AND rowid >= coalesce((SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s",
+        "ORDER BY rowid DESC LIMIT 1 OFFSET %s), 0)",
+    ]
+    params = [match, match, search_window() - 1]
+    comparison, order = ("<", "DESC") if direction == "next" else (">", "ASC")
+    if values is not None:
+        sql.append(f"AND ({score} {comparison} %s OR ({score} = %s AND rowid {comparison} %s))")
+        params += [values[0], values[0], values[1]]
+    sql.append(f"ORDER BY {score} {order}, rowid {order} LIMIT %s")
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(" ".join(sql), params)
+        return [SearchHit(*row) for row in cursor.fetchall()]
+
+
+def _decode(cursor):
+    if not cursor:
+        return "next", None
+    direction, values = decode_raw_cursor(cursor, 2)
+    if not all(isinstance(value, (int, float)) for value in values):
+        raise InvalidCursor("Malformed cursor.")
+    return direction, values
+
+
+def search_posts(query, cursor, per_page, viewer=None):
+    """
+    Return one page of the posts matching every word of ``query``, serialized like feed pages, as
+    ``(serialized_posts, next_cursor, prev_cursor)``. Raises InvalidQuery or InvalidCursor.
+    """
+    terms = parse_query(query)
+    using = router.db_for_read(Post)
+    connection = connections[using]
+    if not is_indexed(connection):
+        queryset = Post.objects.using(using).select_related("user")
+        for term in terms:
+            queryset = queryset.filter(body__icontains=term)
+        posts, next_cursor, prev_cursor = keyset_page(queryset, cursor, per_page)
+        return Post.serialize_many(posts, viewer), next_cursor, prev_cursor
+
+    direction, values = _decode(cursor)
+    hits = _search_hits(connection, terms, direction, values, per_page + 1)
+    hits, next_cursor, prev_cursor = rows_page(hits, ("score", "id"), direction, values, per_page)
+    posts = Post.objects.using(using).select_related("user").in_bulk([hit.id for hit in hits])
+    # A post deleted since it was indexed is skipped
+    posts = [posts[hit.id] for hit in hits if hit.id in posts]
+    return Post.serialize_many(posts, viewer), next_cursor, prev_cursor
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, using, update_fields=None, **kwargs):
+    if created or update_fields is None or "body" in update_fields:
+        index_posts([instance], using)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, using, **kwargs):
+    unindex_posts([instance.pk], using)
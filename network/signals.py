@@ -0,0 +1,83 @@
+from django.apps import apps
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from .cache import invalidate_feed
+from .events import publish
+
+# Sent whenever likes are added or removed outside of the M2M manager, with one entry per like in the
+# parallel lists post_ids, author_ids, user_ids and deltas (1 for a like, -1 for an unlike)
+likes_changed = Signal()
+
+# Sent with the follower and followed user ids whenever a follow relationship is created or removed
+follows_changed = Signal()
+
+
+def invalidate_post_feeds(author_id):
+    invalidate_feed("all")
+    invalidate_feed(f"profile:{author_id}")
+
+
+@receiver(post_save, sender="network.Post")
+@receiver(post_delete, sender="network.Post")
+def post_changed(sender, instance, **kwargs):
+    invalidate_post_feeds(instance.user_id)
+
+
+@receiver(post_save, sender="network.Post")
+def post_created(sender, instance, created, **kwargs):
+    if created:
+        publish(f"posts:{instance.user_id}", {"type": "post", "id": instance.pk})
+
+
+@receiver(post_save, sender="network.Post")
+def post_saved_summary(sender, instance, created, **kwargs):
+    ProfileSummary = apps.get_model("network", "ProfileSummary")
+    if created:
+        ProfileSummary.record_post(instance)
+    else:
+        ProfileSummary.touch([instance.user_id])
+
+
+@receiver(post_delete, sender="network.Post")
+def post_deleted_summary(sender, instance, **kwargs):
+    apps.get_model("network", "ProfileSummary").forget_post(instance)
+
+
+@receiver(likes_changed)
+def post_likes_changed(sender, post_ids, author_ids, user_ids, deltas, **kwargs):
+    for author_id in set(author_ids):
+        invalidate_post_feeds(author_id)
+    # A user's profile lists the posts they liked
+    for user_id in set(user_ids):
+        invalidate_feed(f"user:{user_id}")
+    for post_id, user_id, delta in zip(post_ids, user_ids, deltas):
+        publish(f"likes:{post_id}", {"type": "likes", "id": post_id, "delta": delta, "actor": user_id})
+    apps.get_model("network", "ProfileSummary").touch(set(user_ids))
+
+
+@receiver(follows_changed)
+def user_follows_changed(sender, follower_id, following_id, **kwargs):
+    # Both profiles show follow counts, and the follower's following feed now has other authors
+    invalidate_feed(f"user:{follower_id}")
+    invalidate_feed(f"user:{following_id}")
+    apps.get_model("network", "ProfileSummary").touch([follower_id])
+
+
+@receiver(m2m_changed, sender="network.Post_likes")
+def post_likes_m2m_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        # instance is the user; without pk_set (clear) every affected author is unknown
+        invalidate_feed(f"user:{instance.pk}")
+        if pk_set is None:
+            invalidate_feed("all")
+            return
+        author_ids = model.objects.filter(pk__in=pk_set).values_list("user_id", flat=True)
+    else:
+        author_ids = [instance.user_id]
+        for user_id in pk_set or ():
+            invalidate_feed(f"user:{user_id}")
+    for author_id in set(author_ids):
+        invalidate_post_feeds(author_id)
@@ -182,10 +182,121 @@ document.addEventListener("DOMContentLoaded", () => {
   });
 });
 
-function render_page(fetch_call, page = 1) {
+// Mutations made in quick succession are sent together to /api/batch: one request, one session and
+// CSRF check and one transaction for all of them. Each caller gets its own operation's result.
+const BATCH_DELAY_MS = 50;
+const BATCH_MAX_OPERATIONS = 100;
+const pendingOperations = [];
+let batchTimer = null;
+
+function send_operation(operation) {
+  return new Promise((resolve, reject) => {
+    pendingOperations.push({ operation, resolve, reject });
+    if (pendingOperations.length >= BATCH_MAX_OPERATIONS) flush_operations();
+    else if (!batchTimer) batchTimer = setTimeout(flush_operations, BATCH_DELAY_MS);
+  });
+}
+
+function flush_operations() {
+  clearTimeout(batchTimer);
+  batchTimer = null;
+  const batch = pendingOperations.splice(0, pendingOperations.length);
+  if (!batch.length) return;
+  fetch("/api/batch", {
+    method: "POST",
+    body: JSON.stringify({ operations: batch.map((entry) => entry.operation) }),
+    headers: {
+      "Content-Type": "application/json",
+      "X-CSRFToken": getCookie("csrftoken"),
+    },
+  })
+    .then((response) => {
+      if (response.ok) return response.json();
+      else throw new Error("Unable to send the batch. " + response.statusText);
+    })
+    .then((data) => data.results.forEach((result, i) => batch[i].resolve(result)))
+    .catch((error) => batch.forEach((entry) => entry.reject(error)));
+}
+
+// Server-sent events (/api/events) instead of polling: the ids of new posts by followed users, and like
+// count changes of the posts on screen. The stream is reopened whenever the posts on screen change, if
+// the server serves streams at all (live_events, set by the page).
+let eventSource = null;
+let liveFeed = null;
+const likeUpdaters = new Map();
+
+function open_events(postIds) {
+  if (eventSource) eventSource.close();
+  eventSource = null;
+  if (typeof live_events === "undefined" || !live_events) return;
+  const source = new EventSource(`/api/events?posts=${postIds.join(",")}`);
+  eventSource = source;
+  // A stream that never opened got an error response, e.g. a 501: stop rather than let the browser retry
+  // it forever. A stream closed after opening, e.g. after a reset, is reopened by the browser.
+  let opened = false;
+  source.addEventListener("open", () => (opened = true));
+  source.addEventListener("error", () => {
+    if (opened) return;
+    source.close();
+    if (eventSource === source) eventSource = null;
+  });
+  source.addEventListener("post", (event) => {
+    const { id } = JSON.parse(event.data);
+    if (!liveFeed) return;
+    fetch(`/api/post/${id}`)
+      .then((response) => response.json())
+      .then((post) => {
+        if (liveFeed && !likeUpdaters.has(post.id)) liveFeed.prepend(render_post(post));
+      })
+      .catch((error) => console.error("Error:", error));
+  });
+  source.addEventListener("likes", (event) => {
+    const { id, delta } = JSON.parse(event.data);
+    const update = likeUpdaters.get(id);
+    if (update) update(delta);
+  });
+  // The stream fell behind and was closed; the browser reopens it, but the events in between are lost
+  source.addEventListener("reset", () => console.warn("Live updates were interrupted."));
+}
+
+// The API sends ISO 8601 timestamps; shown in the reader's time zone as "Oct 18 2026, 05:32:21 PM"
+const timestampFormat = new Intl.DateTimeFormat("en-US", {
+  month: "short",
+  day: "2-digit",
+  year: "numeric",
+  hour: "2-digit",
+  minute: "2-digit",
+  second: "2-digit",
+  hour12: true,
+});
+
+function format_timestamp(timestamp) {
+  const parts = Object.fromEntries(
+    timestampFormat.formatToParts(new Date(timestamp)).map((part) => [part.type, part.value])
+  );
+  return `${parts.month} ${parts.day} ${parts.year}, ${parts.hour}:${parts.minute}:${parts.second} ${parts.dayPeriod}`;
+}
+
+// Read API responses kept with their ETag, so that unchanged pages come back as an empty 304
+const validatedResponses = new Map();
+
+function fetch_validated(url) {
+  const cached = validatedResponses.get(url);
+  const headers = cached ? { "If-None-Match": cached.etag } : {};
+  return fetch(url, { headers }).then((response) => {
+    if (response.status === 304 && cached) return cached.data;
+    const etag = response.headers.get("ETag");
+    return response.json().then((data) => {
+      if (etag) validatedResponses.set(url, { etag, data });
+      return data;
+    });
+  });
+}
+
+function render_page(fetch_call, cursor = "") {
   const pageDiv = document.createElement("div");
 
-  function render_pagination(pagination, goToPage) {
+  function render_pagination(pagination, goToCursor) {
     const paginationDiv = document.createElement("div");
     paginationDiv.className = "pagination justify-content-center";
 
@@ -195,29 +306,18 @@ function render_page(fetch_call, page = 1) {
     // Previous page button
     if (pagination.has_previous) {
       const previousItem = createPaginationItem(
-        goToPage,
-        pagination.current_page - 1,
+        goToCursor,
+        pagination.prev_cursor,
         "Previous"
       );
       paginationList.appendChild(previousItem);
     }
 
-    // Page numbers
-    for (let i = 1; i <= pagination.total_pages; i++) {
-      const pageItem = createPaginationItem(
-        goToPage,
-        i,
-        i.toString(),
-        i === pagination.current_page
-      );
-      paginationList.appendChild(pageItem);
-    }
-
     // Next page button
     if (pagination.has_next) {
       const nextItem = createPaginationItem(
-        goToPage,
-        pagination.current_page + 1,
+        goToCursor,
+        pagination.next_cursor,
         "Next"
       );
       paginationList.appendChild(nextItem);
@@ -227,52 +327,48 @@ function render_page(fetch_call, page = 1) {
     return paginationDiv;
   }
 
-  function createPaginationItem(goToPage, pageNumber, label, isActive = false) {
+  function createPaginationItem(goToCursor, pageCursor, label) {
     const listItem = document.createElement("li");
     listItem.classList.add("page-item");
 
-    if (isActive) {
-      listItem.classList.add("active");
-    }
-
     const button = document.createElement("button");
     button.classList.add("page-link");
     button.textContent = label;
 
     button.addEventListener("click", (event) => {
       event.preventDefault();
-      goToPage(pageNumber);
+      goToCursor(pageCursor);
     });
 
     listItem.appendChild(button);
     return listItem;
   }
 
-  fetch(`${fetch_call}/${page}`)
-    .then((response) => response.json())
+  // Pages are addressed by opaque cursors, so reading deep pages costs the same as the first one
+  fetch_validated(`${fetch_call}?cursor=${encodeURIComponent(cursor)}`)
     .then((data) => {
       const posts = data.posts;
       const pagination = data.pagination;
 
+      // New posts are pushed to the top of the first page of the home and following feeds
+      likeUpdaters.clear();
+      liveFeed = cursor === "" && ["/api/posts", "/api/following"].includes(fetch_call) ? pageDiv : null;
+
       // Iterate over the posts
       posts.forEach((post) => {
         // Process each post
         pageDiv.appendChild(render_post(post));
       });
 
-      // Access pagination information
-      let currentPage = pagination.current_page;
-
-      function goToPage(num) {
-        if (num !== currentPage && num >= 1 && num <= pagination.total_pages) {
-          currentPage = num;
+      function goToCursor(pageCursor) {
+        if (pageCursor) {
           pageDiv.innerHTML = "";
-          page = currentPage;
-          pageDiv.appendChild(render_page(fetch_call, page));
+          pageDiv.appendChild(render_page(fetch_call, pageCursor));
         }
       }
 
-      pageDiv.appendChild(render_pagination(pagination, goToPage));
+      pageDiv.appendChild(render_pagination(pagination, goToCursor));
+      open_events(posts.map((post) => post.id));
     })
     .catch((error) => {
       console.error("Error:", error);
@@ -318,8 +414,8 @@ function render_post(post) {
   heartIcon.className = "col";
   heartIcon.id = "heart-icon";
 
-  var is_liked = post.likes.some((username) => username === current_user);
-  var likes_count = post.likes.length;
+  var is_liked = post.liked_by_me;
+  var likes_count = post.like_count;
   postBody.innerHTML = `${post.body}`;
 
   // Set the inner HTML of the element to the heart icon markup
@@ -327,59 +423,25 @@ function render_post(post) {
   if (is_liked) heartIcon.innerHTML = `<i class="bi bi-heart-fill"></i>`;
   heartIcon.style.color = "red";
 
-  const csrftoken = getCookie("csrftoken");
-
   heartIcon.addEventListener("click", () => {
-    if (!is_liked) {
-      fetch(`/api/like/${post.id}`, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-          "X-CSRFToken": csrftoken, // Include the CSRF token in the request headers
-        },
-      })
-        .then((response) => {
-          if (response.ok) return response.json();
-          else
-            throw new Error("Unable to like the post. " + response.statusText);
-        })
-        .then((data) => {
-          heartIcon.innerHTML = `<i class="bi bi-heart-fill"></i>`;
-          is_liked = true;
-          likes_count += 1;
-          postLikesText.innerHTML = `${likes_count}`;
-          console.log(data.message);
-        })
-        .catch((error) => {
-          // Handle any errors
-          console.error("Error:", error);
-        });
-    } else {
-      fetch(`/api/unlike/${post.id}`, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-          "X-CSRFToken": csrftoken, // Include the CSRF token in the request headers
-        },
+    // Shown right away; quick successive clicks end up in the same batch and are applied in order
+    const liking = !is_liked;
+    const show = (liked) => {
+      is_liked = liked;
+      likes_count += liked ? 1 : -1;
+      heartIcon.innerHTML = liked ? `<i class="bi bi-heart-fill"></i>` : `<i class="bi bi-heart"></i>`;
+      postLikesText.innerHTML = `${likes_count}`;
+    };
+    show(liking);
+    send_operation({ op: liking ? "like" : "unlike", post_id: post.id })
+      .then((data) => {
+        if (data.error) throw new Error(data.error);
+        console.log(data.message);
       })
-        .then((response) => {
-          if (response.ok) return response.json();
-          else
-            throw new Error("Unable to like the post. " + response.statusText);
-        })
-        .then((data) => {
-          // Handle the response data
-          heartIcon.innerHTML = `<i class="bi bi-heart"></i>`;
-          is_liked = false;
-          likes_count -= 1;
-          postLikesText.innerHTML = `${likes_count}`;
-          console.log(data.message);
-        })
-        .catch((error) => {
-          // Handle any errors
-          console.error("Error:", error);
-        });
-    }
+      .catch((error) => {
+        show(!liking);
+        console.error("Error:", error);
+      });
   });
   if (current_user === post.user) {
     postEditButton.addEventListener("click", () => {
@@ -413,16 +475,7 @@ function render_post(post) {
         postEdit.innerHTML = "";
         postEdit.appendChild(postEditButton);
 
-        fetch(`/api/posts/${post.id}/edit`, {
-          method: "POST",
-          body: JSON.stringify({
-            body: postBodyEdit.value,
-          }),
-          headers: {
-            "X-CSRFToken": csrftoken, // Include the CSRF token in the request headers
-          },
-        })
-          .then((response) => response.json())
+        send_operation({ op: "edit", post_id: post.id, body: postBodyEdit.value })
           .then((data) => {
             if (data.error) {
               // If the response has an error message, handle the error (e.g., show an error message)
@@ -443,8 +496,12 @@ function render_post(post) {
     });
   }
 
-  postTimestamp.innerHTML = `${post.timestamp}`;
+  postTimestamp.innerHTML = format_timestamp(post.timestamp);
   postLikesText.innerHTML = `${likes_count}`;
+  likeUpdaters.set(post.id, (delta) => {
+    likes_count += delta;
+    postLikesText.innerHTML = `${likes_count}`;
+  });
 
   postDiv.className =
     "bg-primary-subtle rounded mb-3 py-3 px-4 text-primary-emphasis border border-3 border-primary-subtle shadow";
@@ -492,25 +549,12 @@ function render_new_post() {
   newPostForm.appendChild(newPostButton);
   newPost.appendChild(newPostForm);
 
-  // Get the CSRF token from the cookie
-  const csrftoken = getCookie("csrftoken");
-
   // Add event listener to the form submit event
   newPostForm.addEventListener("submit", function (event) {
     event.preventDefault(); // Prevent the default form submission behavior
 
-    // Send form data to the server using fetch API
-    fetch("/api/post", {
-      method: "POST",
-      body: JSON.stringify({
-        body: newPostTextArea.value,
-      }),
-      headers: {
-        "Content-Type": "application/json",
-        "X-CSRFToken": csrftoken,
-      },
-    })
-      .then((response) => response.json())
+    // Send the new post with the next batch of operations
+    send_operation({ op: "post", body: newPostTextArea.value })
       .then((data) => {
         if (data.error) {
           // If the response has an error message, handle the error (e.g., show an error message)
@@ -551,6 +595,8 @@ function view_feed(feed, username = null) {
   if (feed === "all") {
     if (current_user) feed_view.appendChild(render_new_post());
     feed_view.appendChild(render_page(`/api/posts`));
+  } else if (feed === "profile") {
+    feed_view.appendChild(render_page(`/api${url}/posts`));
   } else feed_view.appendChild(render_page(`/api${url}`));
 }
 
@@ -564,13 +610,11 @@ function view_profile(username) {
   const profileTitle = document.getElementById("profile-title");
   profileFollowButton.className = "btn btn-primary";
   profileFollowButton.style.display = "none";
-  const csrftoken = getCookie("csrftoken");
 
-  fetch(`/api/profile/${username}`)
-    .then((response) => response.json())
+  fetch_validated(`/api/profile/${username}`)
     .then((data) => {
       profileTitle.innerHTML = `${username}'s profile`;
-      profileFollowage.innerHTML = `Following: ${data.user.following} Followers: ${data.user.followers}`;
+      profileFollowage.innerHTML = `Posts: ${data.user.post_count} Following: ${data.user.following} Followers: ${data.user.followers}`;
       if (!data.is_following) {
         profileFollowButton.innerText = "Follow";
       } else {
@@ -581,14 +625,7 @@ function view_profile(username) {
         profileFollowButton.style.display = "block";
         profileFollowButton.addEventListener("click", () => {
           if (!data.is_following) {
-            fetch(`/api/follow/${username}`, {
-              method: "POST",
-              headers: {
-                "Content-Type": "application/json",
-                "X-CSRFToken": csrftoken, // Include the CSRF token in the request headers
-              },
-            })
-              .then((response) => response.json())
+            send_operation({ op: "follow", username })
               .then((data) => {
                 // Handle the response data
                 view_profile(username);
@@ -599,14 +636,7 @@ function view_profile(username) {
                 console.error("Error:", error);
               });
           } else {
-            fetch(`/api/unfollow/${username}`, {
-              method: "POST",
-              headers: {
-                "Content-Type": "application/json",
-                "X-CSRFToken": csrftoken, // Include the CSRF token in the request headers
-              },
-            })
-              .then((response) => response.json())
+            send_operation({ op: "unfollow", username })
               .then((data) => {
                 // Handle the response data
                 view_profile(username);
@@ -1,9 +1,56 @@
 # myapp/tests.py
-from django.db import IntegrityError
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import threading
+import unittest
+import warnings
+from unittest import mock
+from io import StringIO
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.contrib.auth.hashers import make_password
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import AsyncClient, Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.core.exceptions import ValidationError
 from django.utils import timezone
-from .models import User, Follow, Post
+from django.utils.http import http_date
+from .auth import check_user_cache
+from .benchmarks.graph import delete_network, generate_network
+from .benchmarks.runner import run as run_benchmark
+from .benchmarks.sessions import compare as compare_sessions
+from .cache import cache_page, check_feed_cache, feed_cache_stats, feed_version, get_cached_page, invalidate_feed
+from .counters import repair_counters
+from .db import PIN_COOKIE
+from .encoding import FragmentCache, dumps as encoding_dumps, orjson, post_fragments
+from .export import parse_bound
+from .events import LocalEventHub, encode_events
+from .follows import (check_follow_cache, common_following, followed_among, following_ids, following_many,
+                      is_following, mutual_follows)
+from .instrumentation import metrics
+from .likes import buffer_like, flush_likes, pending_like_count
+from .models import User, Follow, Post, PostScore, ProfileSummary, TimelineEntry
+from .pagination import encode_cursor
+from .ranking import compute_scores
+from .importer import import_network
+from .ratelimit import TokenBuckets, buckets, parse_rate, rate_limit_stats, write_gate
+from .search import SEARCH_TABLE, rebuild_index
+
+# The caches only used with a cache shared by every process (SHARED_CACHE), for the tests counting queries
+SHARED_CACHE_SETTINGS = {
+    "SESSION_ENGINE": "django.contrib.sessions.backends.cached_db",
+    "NETWORK_USER_CACHE_ALIAS": "default",
+    "NETWORK_FOLLOW_CACHE_ALIAS": "default",
+    "NETWORK_FEED_CACHE_ALIAS": "default",
+}
 
 
 class UserModelTest(TestCase):
@@ -12,7 +59,10 @@ class UserModelTest(TestCase):
         self.user2 = User.objects.create_user(username="testuser2", password="testpass2")
         self.post1 = Post.objects.create(body="Test post 1", user=self.user1)
         self.post2 = Post.objects.create(body="Test post 2", user=self.user2)
-        self.follow = Follow.objects.create(follower=self.user1, following=self.user2)
+        Follow.add(self.user1, self.user2)
+        self.follow = Follow.objects.get(follower=self.user1, following=self.user2)
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
 
     def test_follower_count_property(self):
         self.assertEqual(self.user2.follower_count, 1)
@@ -33,8 +83,8 @@ class UserModelTest(TestCase):
         self.assertEqual(serialized_data["email"], self.user1.email)
         self.assertEqual(serialized_data["following"], self.user1.following_count)
         self.assertEqual(serialized_data["followers"], self.user1.follower_count)
-        self.assertEqual(serialized_data["likes"], [])
-        self.assertEqual(serialized_data["posts"], [self.post1.serialize()])
+        self.assertNotIn("likes", serialized_data)
+        self.assertNotIn("posts", serialized_data)
 
     def test_follow_model_unique_together(self):
         with self.assertRaises(IntegrityError):
@@ -102,11 +152,14 @@ class PostModelTest(TestCase):
         self.assertEqual(serialized_data["id"], self.post1.id)
         self.assertEqual(serialized_data["body"], self.post1.body)
         self.assertEqual(serialized_data["user"], self.user1.username)
-        self.assertEqual(serialized_data["likes"], [])
+        self.assertEqual(serialized_data["like_count"], 0)
+        self.assertFalse(serialized_data["liked_by_me"])
 
     def test_get_paginated_posts_all_source(self):
         serialized_posts, _, _, _ = Post.get_paginated_posts(page_number=1, posts_per_page=10)
         self.assertEqual(len(serialized_posts), 4)
+        # Timestamps are serialized to the microsecond: compare with the forced one
+        self.post1.refresh_from_db()
         self.assertEqual(serialized_posts[0], self.post1.serialize())
 
     def test_get_paginated_posts_following_source(self):
@@ -147,18 +200,1684 @@ class PostModelTest(TestCase):
 
     def test_post_model_with_likes(self):
         # Test the full model workflow with likes
-        self.post1.likes.add(self.user2)
-        self.post2.likes.add(self.user3)
-        self.post3.likes.add(self.user1)
-        self.post3.likes.add(self.user2)
+        self.post1.add_like(self.user2)
+        self.post2.add_like(self.user3)
+        self.post3.add_like(self.user1)
+        self.post3.add_like(self.user2)
+        self.post3.refresh_from_db()
 
         # Test that the post is correctly serialized with likes
-        serialized_data = self.post3.serialize()
+        serialized_data = Post.serialize_many([self.post3], viewer=self.user1)[0]
         expected_data = {
             "id": self.post3.id,
             "body": "Post 3",
             "user": "user1",
-            "timestamp": self.post3.timestamp.strftime("%b %d %Y, %I:%M:%S %p"),
-            "likes": ["user1", "user2"]
+            "timestamp": self.post3.timestamp.isoformat(),
+            "like_count": 2,
+            "liked_by_me": True,
         }
         self.assertEqual(serialized_data, expected_data)
+        self.assertFalse(Post.serialize_many([self.post3], viewer=self.user3)[0]["liked_by_me"])
+
+
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create(username="user1")
+        self.user2 = User.objects.create(username="user2")
+        time_now = timezone.now()
+        self.posts = []
+        for i in range(5):
+            post = Post.objects.create(body=f"Post {i}", user=self.user1 if i % 2 else self.user2)
+            self.posts.append(post)
+        # Two posts share a timestamp so that the id tie-breaker is exercised
+        for i, post in enumerate(self.posts):
+            Post.objects.filter(pk=post.id).update(timestamp=time_now - timezone.timedelta(seconds=i // 2))
+
+    def test_walk_forward_and_back(self):
+        seen = []
+        cursor = ""
+        pages = []
+        while True:
+            posts, _, next_cursor, prev_cursor = Post.get_cursor_posts(cursor, 2)
+            pages.append((posts, prev_cursor))
+            seen.extend(post["id"] for post in posts)
+            if next_cursor is None:
+                break
+            cursor = next_cursor
+        expected = list(Post.objects.order_by("-timestamp", "-id").values_list("id", flat=True))
+        self.assertEqual(seen, expected)
+        self.assertIsNone(pages[0][1])
+
+        # Going back from the last page yields the previous page again
+        previous_posts, _, next_cursor, _ = Post.get_cursor_posts(pages[-1][1], 2)
+        self.assertEqual(previous_posts, pages[-2][0])
+        self.assertIsNotNone(next_cursor)
+
+    def test_total_pages_is_optional(self):
+        _, total_pages, _, _ = Post.get_cursor_posts("", 2)
+        self.assertIsNone(total_pages)
+        _, total_pages, _, _ = Post.get_cursor_posts("", 2, with_count=True)
+        self.assertEqual(total_pages, 3)
+
+    def test_profile_source(self):
+        posts, _, next_cursor, _ = Post.get_cursor_posts("", 10, user=self.user1, source="profile")
+        self.assertEqual({post["user"] for post in posts}, {"user1"})
+        self.assertIsNone(next_cursor)
+
+    def test_api_returns_cursors(self):
+        response = self.client.get("/api/posts", {"cursor": ""})
+        pagination = response.json()["pagination"]
+        self.assertIsNone(pagination["prev_cursor"])
+        self.assertIsNone(pagination["next_cursor"])
+        self.assertFalse(pagination["has_next"])
+
+        response = self.client.get("/api/profile/user1/posts", {"cursor": ""})
+        self.assertEqual(len(response.json()["posts"]), 2)
+
+    def test_api_rejects_malformed_cursor(self):
+        response = self.client.get("/api/posts", {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_api_rejects_cursor_ids_out_of_range(self):
+        for post_id in (2 ** 63, -2 ** 63 - 1, 10 ** 30):
+            cursor = encode_cursor("next", ["2024-01-01T00:00:00+00:00", post_id])
+            response = self.client.get("/api/posts", {"cursor": cursor})
+            self.assertEqual(response.status_code, 400)
+
+
+class SerializationQueryCountTest(TestCase):
+    def setUp(self):
+        self.authors = [User.objects.create(username=f"author{i}") for i in range(4)]
+        self.likers = [User.objects.create(username=f"liker{i}") for i in range(6)]
+        for i in range(12):
+            post = Post.objects.create(body=f"Post {i}", user=self.authors[i % 4])
+            post.likes.add(*self.likers[:i % 7])
+
+    def test_feed_page_query_count_is_constant(self):
+        # One query for the page of posts with their authors, one for the viewer's likes on the page
+        for per_page in (2, 10):
+            with self.assertNumQueries(2):
+                posts, _, _, _ = Post.get_cursor_posts("", per_page, viewer=self.likers[0])
+            self.assertEqual(len(posts), per_page)
+
+    def test_feed_api_query_count_is_constant(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/posts", {"cursor": ""})
+        self.assertEqual(len(response.json()["posts"]), 10)
+        # Page-number pagination pays for one extra COUNT(*)
+        with self.assertNumQueries(2):
+            self.client.get("/api/posts/2")
+
+    def test_user_serialize_query_count_is_constant(self):
+        for post in Post.objects.filter(user=self.authors[1]):
+            post.likes.add(self.authors[0])
+        # The profile header only reads columns of the user row
+        with self.assertNumQueries(0):
+            serialized = self.authors[0].serialize()
+        self.assertEqual(set(serialized), {"id", "username", "email", "following", "followers"})
+
+
+class CounterTest(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="pass1")
+        self.user2 = User.objects.create_user(username="user2", password="pass2")
+        self.post = Post.objects.create(body="Post", user=self.user2)
+
+    def test_like_views_maintain_like_count(self):
+        self.client.login(username="user1", password="pass1")
+        self.client.post(f"/api/like/{self.post.id}")
+        self.client.post(f"/api/like/{self.post.id}")
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+
+        self.client.post(f"/api/unlike/{self.post.id}")
+        response = self.client.post(f"/api/unlike/{self.post.id}")
+        self.assertEqual(response.status_code, 400)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+
+    def test_follow_views_maintain_follow_counts(self):
+        self.client.login(username="user1", password="pass1")
+        self.client.post("/api/follow/user2")
+        self.client.post("/api/follow/user2")
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual((self.user1.following_count, self.user2.follower_count), (1, 1))
+
+        self.client.post("/api/unfollow/user2")
+        self.client.post("/api/unfollow/user2")
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual((self.user1.following_count, self.user2.follower_count), (0, 0))
+
+    def test_repair_counters_command(self):
+        # Rows written behind the counters' back drift until repaired
+        self.post.likes.add(self.user1)
+        Follow.objects.create(follower=self.user1, following=self.user2)
+        out = StringIO()
+        call_command("repair_counters", "--dry-run", stdout=out)
+        self.assertIn("Post.like_count: 1 drifted", out.getvalue())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+
+        call_command("repair_counters", stdout=StringIO())
+        self.post.refresh_from_db()
+        self.user1.refresh_from_db()
+        self.user2.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        self.assertEqual((self.user1.following_count, self.user2.follower_count), (1, 1))
+
+
+class LikePayloadTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username="author", password="pass")
+        self.post = Post.objects.create(body="Viral post", user=self.author)
+        self.likers = [User.objects.create(username=f"liker{i}") for i in range(5)]
+        for liker in self.likers:
+            self.post.add_like(liker)
+
+    def test_feed_payload_has_count_not_likers(self):
+        self.client.login(username="author", password="pass")
+        post = self.client.get("/api/posts", {"cursor": ""}).json()["posts"][0]
+        self.assertEqual(post["like_count"], 5)
+        self.assertFalse(post["liked_by_me"])
+        self.assertNotIn("likes", post)
+
+        self.post.add_like(self.author)
+        post = self.client.get("/api/posts/1").json()["posts"][0]
+        self.assertTrue(post["liked_by_me"])
+
+    def test_likers_endpoint_is_paginated(self):
+        likers, next_cursor, prev_cursor = self.post.get_likers("", 3)
+        self.assertEqual(likers, ["liker4", "liker3", "liker2"])
+        self.assertIsNone(prev_cursor)
+        likers, next_cursor, prev_cursor = self.post.get_likers(next_cursor, 3)
+        self.assertEqual(likers, ["liker1", "liker0"])
+        self.assertIsNone(next_cursor)
+
+        response = self.client.get(f"/api/posts/{self.post.id}/likes")
+        self.assertEqual(response.json()["likes"], [f"liker{i}" for i in range(4, -1, -1)])
+        self.assertEqual(response.json()["like_count"], 5)
+        self.assertEqual(self.client.get(f"/api/posts/{10 ** 30}/likes").status_code, 404)
+
+
+class TimelineTest(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user(username="reader", password="pass")
+        self.author = User.objects.create_user(username="author", password="pass")
+        self.other = User.objects.create_user(username="other", password="pass")
+        self.old_post = Post.objects.create(body="Before the follow", user=self.author)
+
+    def following_feed(self, cursor="", per_page=10):
+        posts, _, next_cursor, _ = Post.get_cursor_posts(cursor, per_page, self.reader, "following",
+                                                         viewer=self.reader)
+        return [post["body"] for post in posts], next_cursor
+
+    def test_follow_backfills_and_post_fans_out(self):
+        self.client.login(username="reader", password="pass")
+        self.client.post("/api/follow/author")
+        self.assertEqual(self.following_feed()[0], ["Before the follow"])
+
+        self.client.login(username="author", password="pass")
+        self.client.post("/api/post", {"body": "After the follow"}, content_type="application/json")
+        self.client.login(username="other", password="pass")
+        self.client.post("/api/post", {"body": "Not followed"}, content_type="application/json")
+        self.assertEqual(self.following_feed()[0], ["After the follow", "Before the follow"])
+
+        self.client.login(username="reader", password="pass")
+        response = self.client.get("/api/following", {"cursor": ""})
+        self.assertEqual(len(response.json()["posts"]), 2)
+
+        self.client.post("/api/unfollow/author")
+        self.assertEqual(self.following_feed()[0], [])
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.reader).exists())
+
+    def test_following_read_query_count(self):
+        Follow.add(self.reader, self.author)
+        TimelineEntry.backfill(self.reader, self.author)
+        # timeline range scan, popular followed authors, viewer's likes
+        with self.assertNumQueries(3):
+            self.following_feed()
+
+    @override_settings(NETWORK_TIMELINE_FANOUT_LIMIT=0)
+    def test_popular_authors_are_merged_at_read_time(self):
+        Follow.add(self.reader, self.author)
+        self.author.refresh_from_db()
+        TimelineEntry.backfill(self.reader, self.author)
+        new_post = Post.objects.create(body="Popular post", user=self.author)
+        self.assertEqual(TimelineEntry.fan_out(new_post), 0)
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.following_feed()[0], ["Popular post", "Before the follow"])
+
+    @override_settings(NETWORK_TIMELINE_FANOUT_LIMIT=0)
+    def test_fan_out_reads_the_current_follower_count(self):
+        # The author as cached before they were followed
+        author = User.objects.get(pk=self.author.pk)
+        Follow.add(self.reader, self.author)
+        self.assertEqual(TimelineEntry.fan_out(Post.objects.create(body="Popular post", user=author)), 0)
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    @override_settings(NETWORK_TIMELINE_LENGTH=2)
+    def test_timelines_are_capped(self):
+        Follow.add(self.reader, self.author)
+        for i in range(4):
+            Post.objects.create(body=f"Post {i}", user=self.author)
+        TimelineEntry.backfill(self.reader, self.author)
+        self.assertEqual(TimelineEntry.objects.filter(owner=self.reader).count(), 2)
+        for i in range(4, 8):
+            TimelineEntry.fan_out(Post.objects.create(body=f"Post {i}", user=self.author))
+        TimelineEntry.trim()
+        self.assertEqual(self.following_feed()[0], ["Post 7", "Post 6"])
+
+    def test_rebuild_timelines_command(self):
+        Follow.add(self.reader, self.author)
+        Follow.add(self.reader, self.other)
+        Post.objects.create(body="Other post", user=self.other)
+        call_command("rebuild_timelines", stdout=StringIO())
+        feed, _ = self.following_feed()
+        self.assertEqual(feed, ["Other post", "Before the follow"])
+
+    @override_settings(NETWORK_TIMELINE_LENGTH=2, NETWORK_TIMELINE_FANOUT_LIMIT=1)
+    def test_rebuild_caps_timelines_and_skips_popular_authors(self):
+        Follow.add(self.reader, self.author)
+        Follow.add(self.other, self.author)
+        Follow.add(self.reader, self.other)
+        posts = [Post.objects.create(body=f"Post {i}", user=self.other) for i in range(3)]
+        TimelineEntry.rebuild()
+        # The author has two followers, over the fan-out limit
+        self.assertEqual(list(TimelineEntry.objects.filter(owner=self.reader).order_by("-timestamp", "-post_id")
+                              .values_list("post_id", flat=True)), [posts[2].id, posts[1].id])
+        self.assertFalse(TimelineEntry.objects.exclude(owner=self.reader).exists())
+
+
+@unittest.skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN is SQLite specific")
+class FeedQueryPlanTest(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create(username="reader")
+        self.authors = [User.objects.create(username=f"author{i}") for i in range(3)]
+        for author in self.authors:
+            Follow.add(self.reader, author)
+        for i in range(30):
+            post = Post.objects.create(body=f"Post {i}", user=self.authors[i % 3])
+            TimelineEntry.fan_out(post)
+            if i % 2:
+                post.add_like(self.reader)
+
+    def query_plans(self, feed):
+        # Run a feed read, then EXPLAIN every SELECT it issued
+        with CaptureQueriesContext(connection) as queries:
+            feed()
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                if query["sql"].startswith("SELECT"):
+                    cursor.execute("EXPLAIN QUERY PLAN " + query["sql"])
+                    plans.append((query["sql"], [row[-1] for row in cursor.fetchall()]))
+        return plans
+
+    def assertNoScanAndSort(self, feed, allow_sort=False):
+        for sql, plan in self.query_plans(feed):
+            full_scan = any(step.startswith("SCAN") and "INDEX" not in step for step in plan)
+            sort = any("TEMP B-TREE" in step for step in plan)
+            self.assertFalse(full_scan and sort, f"{sql}\n{plan}")
+            if not allow_sort:
+                self.assertFalse(sort, f"{sql}\n{plan}")
+
+    def deep_cursor(self, user=None, source="all"):
+        _, _, cursor, _ = Post.get_cursor_posts("", 10, user, source)
+        return cursor
+
+    def test_all_feed(self):
+        cursor = self.deep_cursor()
+        self.assertNoScanAndSort(lambda: Post.get_cursor_posts("", 10, viewer=self.reader))
+        self.assertNoScanAndSort(lambda: Post.get_cursor_posts(cursor, 10, viewer=self.reader))
+
+    def test_profile_feed(self):
+        cursor = self.deep_cursor(self.authors[0], "profile")
+        self.assertNoScanAndSort(lambda: Post.get_cursor_posts(cursor, 5, self.authors[0], "profile"))
+
+    def test_following_feed(self):
+        cursor = self.deep_cursor(self.reader, "following")
+        self.assertNoScanAndSort(lambda: Post.get_cursor_posts(cursor, 10, self.reader, "following"))
+
+    def test_page_number_feeds(self):
+        # Fan-out-on-read over several authors has to merge their ranges, but never scans the table
+        self.assertNoScanAndSort(lambda: Post.get_paginated_posts(2, 10))
+        self.assertNoScanAndSort(lambda: Post.get_paginated_posts(2, 10, self.reader, "following"),
+                                 allow_sort=True)
+
+    def test_liked_posts(self):
+        # Sorting is bounded by the user's own likes, found through the (user, post) likes index
+        self.assertNoScanAndSort(lambda: list(Post.get_liked_posts(self.reader)[:10]), allow_sort=True)
+
+
+@override_settings(NETWORK_FEED_CACHE_ALIAS="default")
+class FeedCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="author", password="pass")
+        self.liker = User.objects.create_user(username="liker", password="pass")
+        self.post = Post.objects.create(body="Cached post", user=self.author)
+
+    def assertCached(self, url, data=None, queries=0):
+        self.client.get(url, data)
+        hits = feed_cache_stats()["hits"]
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, data)
+        self.assertEqual(feed_cache_stats()["hits"], hits + 1)
+        return response.json()
+
+    def test_anonymous_pages_are_cached(self):
+        self.assertCached("/api/posts/1")
+        self.assertCached("/api/posts", {"cursor": ""})
+        # Profile pages still look the user up by username
+        self.assertCached("/api/profile/author/1", queries=1)
+
+    def test_new_post_invalidates_global_and_profile_feeds(self):
+        self.assertCached("/api/posts/1")
+        self.assertCached("/api/profile/author/1", queries=1)
+        Post.objects.create(body="Another post", user=self.author)
+        self.assertEqual(len(self.client.get("/api/posts/1").json()["posts"]), 2)
+        self.assertEqual(len(self.client.get("/api/profile/author/1").json()["posts"]), 2)
+
+    def test_edit_and_like_invalidate(self):
+        self.assertCached("/api/posts/1")
+        self.client.login(username="author", password="pass")
+        self.client.post(f"/api/posts/{self.post.id}/edit", {"body": "Edited"}, content_type="application/json")
+        self.client.login(username="liker", password="pass")
+        self.client.post(f"/api/like/{self.post.id}")
+        self.client.logout()
+        post = self.client.get("/api/posts/1").json()["posts"][0]
+        self.assertEqual((post["body"], post["like_count"]), ("Edited", 1))
+
+    def test_other_profiles_stay_cached(self):
+        self.assertCached("/api/profile/author/1", queries=1)
+        Post.objects.create(body="Unrelated", user=self.liker)
+        misses = feed_cache_stats()["misses"]
+        self.client.get("/api/profile/author/1")
+        self.assertEqual(feed_cache_stats()["misses"], misses)
+
+    def test_page_rendered_across_an_invalidation_is_not_served(self):
+        response, version = get_cached_page("all", "page:1")
+        self.assertIsNone(response)
+        invalidate_feed("all")
+        cache_page("all", version, "page:1", HttpResponse(b"stale"))
+        self.assertIsNone(get_cached_page("all", "page:1")[0])
+
+    def test_versions_are_bumped_again_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            invalidate_feed("all")
+            during = feed_version("all")
+            # A concurrent request caches a page of the data before the commit
+            cache_page("all", during, "page:1", HttpResponse(b"before the commit"))
+        for callback in callbacks:
+            callback()
+        self.assertGreater(feed_version("all"), during)
+        self.assertIsNone(get_cached_page("all", "page:1")[0])
+
+    def test_pages_are_only_cached_in_a_shared_cache(self):
+        self.assertEqual([error.id for error in check_feed_cache(None)], ["network.E003"])
+        with override_settings(NETWORK_FEED_CACHE_ALIAS=None):
+            self.assertEqual(check_feed_cache(None), [])
+            stats = feed_cache_stats()
+            self.client.get("/api/posts/1")
+            response = self.client.get("/api/posts/1")
+            self.assertEqual(response.json()["posts"][0]["body"], "Cached post")
+            self.assertEqual(feed_cache_stats(), stats)
+
+    def test_authenticated_pages_are_not_cached(self):
+        self.client.login(username="liker", password="pass")
+        stats = feed_cache_stats()
+        self.client.get("/api/posts/1")
+        self.assertEqual(feed_cache_stats()["hits"] + feed_cache_stats()["misses"],
+                         stats["hits"] + stats["misses"])
+
+
+@override_settings(NETWORK_FEED_CACHE_ALIAS="default")
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username="reader", password="pass")
+        self.author = User.objects.create_user(username="author", password="pass")
+        self.post = Post.objects.create(body="Post", user=self.author)
+
+    def assertNotModified(self, url, data=None):
+        etag = self.client.get(url, data)["ETag"]
+        response = self.client.get(url, data, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        return etag
+
+    def test_unchanged_pages_are_not_modified(self):
+        self.assertNotModified("/api/posts/1")
+        self.assertNotModified("/api/posts", {"cursor": ""})
+        self.assertNotModified("/api/profile/author")
+        self.assertNotModified("/api/profile/author/1")
+
+    @override_settings(NETWORK_FEED_CACHE_ALIAS=None)
+    def test_no_validators_without_a_shared_cache(self):
+        # Versions in one process's cache would not see the changes made through the others
+        for url in ("/api/posts/1", "/api/profile/author"):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH="*", HTTP_IF_MODIFIED_SINCE=http_date())
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.has_header("ETag") or response.has_header("Last-Modified"))
+
+    @override_settings(**SHARED_CACHE_SETTINGS)
+    def test_not_modified_skips_serialization(self):
+        self.client.login(username="reader", password="pass")
+        etag = self.client.get("/api/posts/1")["ETag"]
+        # Session and user come from the cache, and no post is loaded
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/posts/1", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since(self):
+        last_modified = self.client.get("/api/posts/1")["Last-Modified"]
+        response = self.client.get("/api/posts/1", HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_produce_new_validators(self):
+        etag = self.assertNotModified("/api/posts/1")
+        self.post.add_like(self.reader)
+        response = self.client.get("/api/posts/1", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["posts"][0]["like_count"], 1)
+
+        etag = self.assertNotModified("/api/profile/author")
+        Follow.add(self.reader, self.author)
+        self.assertEqual(self.client.get("/api/profile/author", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_following_feed_validators(self):
+        self.client.login(username="reader", password="pass")
+        etag = self.assertNotModified("/api/following", {"cursor": ""})
+        self.client.post("/api/follow/author")
+        response = self.client.get("/api/following", {"cursor": ""}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response["ETag"]
+        Post.objects.create(body="New post", user=self.author)
+        response = self.client.get("/api/following", {"cursor": ""}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_validators_depend_on_the_viewer(self):
+        etag = self.client.get("/api/posts/1")["ETag"]
+        self.client.login(username="reader", password="pass")
+        self.assertEqual(self.client.get("/api/posts/1", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ProfileApiTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="prolific", password="pass")
+        self.other = User.objects.create_user(username="other", password="pass")
+        for i in range(15):
+            post = Post.objects.create(body=f"Own post {i}", user=self.user)
+            post.add_like(self.other)
+        for i in range(12):
+            Post.objects.create(body=f"Other post {i}", user=self.other).add_like(self.user)
+
+    def test_huge_page_numbers_are_the_last_page(self):
+        page = 10 ** 20
+        for url, last_page in ((f"/api/posts/{page}", 3), (f"/api/profile/prolific/{page}", 2)):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertEqual((data["pagination"]["current_page"], data["pagination"]["total_pages"]),
+                             (page, last_page))
+            self.assertEqual(len(data["posts"]), 7 if last_page == 3 else 5)
+
+    def test_header_is_constant_size(self):
+        data = self.client.get("/api/profile/prolific").json()
+        self.assertEqual(set(data), {"user", "is_following"})
+        self.assertEqual(data["user"]["username"], "prolific")
+
+    def test_include_embeds_first_pages(self):
+        data = self.client.get("/api/profile/prolific", {"include": "posts,likes"}).json()
+        self.assertEqual(len(data["posts"]["posts"]), 10)
+        self.assertEqual(data["posts"]["posts"][0]["body"], "Own post 14")
+        self.assertEqual(len(data["likes"]["posts"]), 10)
+        self.assertEqual(data["likes"]["posts"][0]["body"], "Other post 11")
+        self.assertTrue(data["likes"]["pagination"]["has_next"])
+
+        response = self.client.get("/api/profile/prolific", {"include": "followers"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_likes_sub_resource_is_paginated(self):
+        first = self.client.get("/api/profile/prolific/likes").json()
+        cursor = first["pagination"]["next_cursor"]
+        second = self.client.get("/api/profile/prolific/likes", {"cursor": cursor}).json()
+        self.assertEqual(len(first["posts"]) + len(second["posts"]), 12)
+        self.assertFalse(second["pagination"]["has_next"])
+
+    @override_settings(**SHARED_CACHE_SETTINGS)
+    def test_profile_query_count_does_not_grow(self):
+        self.client.login(username="other", password="pass")
+        # profile user, and the viewer and their followed ids until they are cached
+        with self.assertNumQueries(3):
+            self.client.get("/api/profile/prolific")
+        with self.assertNumQueries(1):
+            self.client.get("/api/profile/prolific")
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username="staff", password="pass", is_staff=True)
+        self.author = User.objects.create_user(username="author", password="pass")
+        self.posts = [Post.objects.create(body=f"Post {i}", user=self.author) for i in range(5)]
+        self.posts[1].add_like(self.staff)
+        self.posts[3].add_like(self.staff)
+
+    def export(self, *args):
+        out = StringIO()
+        call_command("export_posts", "--batch-size", "2", *args, stdout=out)
+        return [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_command_streams_every_post_across_batches(self):
+        rows = self.export()
+        self.assertEqual([row["id"] for row in rows], [post.id for post in self.posts])
+        self.assertEqual(rows[1]["user"], "author")
+        self.assertEqual(rows[1]["like_count"], 1)
+
+    def test_command_filters(self):
+        self.assertEqual(len(self.export("--liked-by", "staff")), 2)
+        self.assertEqual(self.export("--user", "staff"), [])
+        Post.objects.filter(pk=self.posts[0].pk).update(timestamp=timezone.now() - timezone.timedelta(days=2))
+        since = (timezone.now() - timezone.timedelta(days=1)).isoformat()
+        self.assertEqual(len(self.export("--since", since)), 4)
+        self.assertEqual(len(self.export("--until", since)), 1)
+        with self.assertRaisesMessage(CommandError, "--since must be an ISO 8601 datetime."):
+            self.export("--since", "2024-02-30T00:00:00")
+
+    def test_bounds_without_offset_are_utc(self):
+        self.assertEqual(parse_bound("2024-02-01T00:00"), datetime.datetime(2024, 2, 1, tzinfo=datetime.timezone.utc))
+        with warnings.catch_warnings():
+            # Django warns about naive datetimes in queries
+            warnings.simplefilter("error", RuntimeWarning)
+            self.assertEqual(len(self.export("--since", "2000-01-01T00:00")), 5)
+
+    def test_endpoint_is_staff_only(self):
+        self.assertEqual(self.client.get("/api/export").status_code, 401)
+        self.client.login(username="author", password="pass")
+        self.assertEqual(self.client.get("/api/export").status_code, 403)
+
+    def test_endpoint_streams_gzipped_ndjson(self):
+        self.client.login(username="staff", password="pass")
+        response = self.client.get("/api/export", {"gzip": "1", "liked_by": "staff"})
+        self.assertTrue(response.streaming)
+        lines = gzip.decompress(b"".join(response.streaming_content)).splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in lines], [self.posts[1].id, self.posts[3].id])
+
+        for since in ("yesterday", "2024-02-30T00:00:00"):
+            response = self.client.get("/api/export", {"since": since})
+            self.assertEqual(response.status_code, 400)
+
+
+@override_settings(NETWORK_LIKE_BATCHING=True, NETWORK_LIKE_BATCH_SIZE=100, NETWORK_LIKE_BATCH_INTERVAL=0,
+                   NETWORK_FEED_CACHE_ALIAS="default")
+class LikeBatchingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="author", password="pass")
+        self.liker = User.objects.create_user(username="liker", password="pass")
+        self.posts = [Post.objects.create(body=f"Post {i}", user=self.author) for i in range(3)]
+        self.client.login(username="liker", password="pass")
+
+    def tearDown(self):
+        flush_likes()
+
+    def feed_post(self, index=0):
+        return self.client.get("/api/posts", {"cursor": ""}).json()["posts"][-1 - index]
+
+    def test_toggles_coalesce_until_flushed(self):
+        post = self.posts[0]
+        for action in ("like", "unlike", "like"):
+            self.assertEqual(self.client.post(f"/api/{action}/{post.id}").status_code, 200)
+        self.assertEqual(pending_like_count(), 1)
+        self.assertFalse(post.likes.exists())
+
+        self.assertEqual(flush_likes(), 1)
+        post.refresh_from_db()
+        self.assertEqual(list(post.likes.all()), [self.liker])
+        self.assertEqual(post.like_count, 1)
+        self.assertEqual(pending_like_count(), 0)
+
+    def test_acting_user_reads_their_writes(self):
+        etag = self.client.get("/api/posts", {"cursor": ""}).headers["ETag"]
+        self.client.post(f"/api/like/{self.posts[0].id}")
+        self.assertEqual(self.client.get("/api/posts", {"cursor": ""}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        post = self.feed_post()
+        self.assertEqual((post["liked_by_me"], post["like_count"]), (True, 1))
+
+        self.client.login(username="author", password="pass")
+        post = self.feed_post()
+        self.assertEqual((post["liked_by_me"], post["like_count"]), (False, 0))
+
+    def test_unlike(self):
+        post = self.posts[0]
+        self.assertEqual(self.client.post(f"/api/unlike/{post.id}").status_code, 400)
+        post.add_like(self.liker)
+        self.assertEqual(self.client.post(f"/api/unlike/{post.id}").status_code, 200)
+        self.assertEqual(self.client.post(f"/api/unlike/{post.id}").status_code, 400)
+        post = self.feed_post()
+        self.assertEqual((post["liked_by_me"], post["like_count"]), (False, 0))
+
+        flush_likes()
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].like_count, 0)
+        self.assertFalse(self.posts[0].likes.exists())
+
+    def test_flush_is_set_based(self):
+        likers = [User.objects.create(username=f"liker{i}") for i in range(10)]
+        self.posts[2].add_like(likers[0])
+        for liker in likers:
+            for post in self.posts[:2]:
+                buffer_like(post.pk, liker.pk, True)
+        buffer_like(self.posts[2].pk, likers[0].pk, False)
+        version = feed_version("all")
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(flush_likes(), 21)
+        # Savepoint and release, three reads, one INSERT, one DELETE, one UPDATE recounting the likes of
+        # the three posts and one of the likers' last activity
+        self.assertEqual(len(queries), 9)
+        self.assertEqual([post.like_count for post in Post.objects.order_by("id")], [10, 10, 0])
+        self.assertNotEqual(feed_version("all"), version)
+
+    def test_concurrent_likes_do_not_make_counters_drift(self):
+        through = Post.likes.through
+        bulk_create = through.objects.bulk_create
+
+        def bulk_create_after_a_concurrent_like(rows, **kwargs):
+            # The same like, written by another process between the flush's reads and its insert
+            self.posts[0].add_like(self.liker)
+            return bulk_create(rows, **kwargs)
+
+        buffer_like(self.posts[0].pk, self.liker.pk, True)
+        with mock.patch.object(through.objects, "bulk_create", bulk_create_after_a_concurrent_like):
+            flush_likes()
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].like_count, 1)
+
+    @override_settings(NETWORK_LIKE_BATCH_SIZE=2)
+    def test_full_buffer_is_flushed(self):
+        self.client.post(f"/api/like/{self.posts[0].id}")
+        self.assertEqual(Post.likes.through.objects.count(), 0)
+        self.client.post(f"/api/like/{self.posts[1].id}")
+        self.assertEqual(Post.likes.through.objects.count(), 2)
+        self.assertEqual(pending_like_count(), 0)
+
+
+class BatchApiTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.author = User.objects.create_user(username="author", password="pass")
+        self.posts = [Post.objects.create(body=f"Post {i}", user=self.author) for i in range(10)]
+        self.client.login(username="user", password="pass")
+
+    def batch(self, *operations):
+        return self.client.post("/api/batch", {"operations": list(operations)}, content_type="application/json")
+
+    def test_operations_run_in_order_with_their_own_results(self):
+        response = self.batch(
+            {"op": "like", "post_id": self.posts[0].id},
+            {"op": "follow", "username": "author"},
+            {"op": "post", "body": "Batched post"},
+            {"op": "unlike", "post_id": self.posts[1].id},
+            {"op": "edit", "post_id": self.posts[2].id, "body": "Not mine"},
+            {"op": "like", "post_id": 0},
+            {"op": "like"},
+            {"op": "like", "post_id": "not a number"},
+            {"op": "retweet", "post_id": self.posts[0].id},
+            {"op": "like", "post_id": 10 ** 30},
+            {"op": "like", "post_id": True},
+            {"op": "follow", "username": ["author"]},
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([result["status"] for result in results],
+                         [200, 200, 200, 400, 403, 404, 400, 400, 400, 400, 400, 400])
+        self.assertEqual(results[0]["message"], "Post liked successfully.")
+        self.assertEqual(results[3]["error"], "You have not liked this post.")
+
+        new_post = Post.objects.get(pk=results[2]["id"])
+        self.assertEqual((new_post.body, new_post.user), ("Batched post", self.user))
+        self.assertEqual(self.edit_own_post(new_post)["status"], 200)
+        self.assertTrue(Follow.objects.filter(follower=self.user, following=self.author).exists())
+        self.posts[0].refresh_from_db()
+        self.assertEqual(self.posts[0].like_count, 1)
+
+    def edit_own_post(self, post):
+        return self.batch({"op": "edit", "post_id": post.id, "body": "Edited"}).json()["results"][0]
+
+    def test_session_and_user_are_loaded_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.batch(*[{"op": "like", "post_id": post.id} for post in self.posts])
+        self.assertEqual([result["status"] for result in response.json()["results"]], [200] * 10)
+        # At most once: both may come from the cache
+        self.assertLessEqual(len([q for q in queries if "django_session" in q["sql"]]), 1)
+        self.assertLessEqual(len([q for q in queries if 'FROM "network_user"' in q["sql"]]), 1)
+
+    def test_invalid_batches(self):
+        self.assertEqual(self.client.post("/api/batch", "[]", content_type="application/json").status_code, 400)
+        self.assertEqual(self.batch({"op": "like"}, "like").status_code, 400)
+        self.assertEqual(self.batch(*[{"op": "like", "post_id": self.posts[0].id}] * 101).status_code, 400)
+        self.assertEqual(self.client.post(f"/api/like/{10 ** 30}").status_code, 404)
+        self.client.logout()
+        self.assertEqual(self.batch({"op": "like", "post_id": self.posts[0].id}).status_code, 401)
+
+
+class EventStreamTest(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create_user(username="viewer", password="pass")
+        self.author = User.objects.create_user(username="author", password="pass")
+        self.other = User.objects.create_user(username="other", password="pass")
+        self.post = Post.objects.create(body="On screen", user=self.other)
+        Follow.add(self.viewer, self.author)
+
+    async def test_hub_delivers_across_threads(self):
+        hub = LocalEventHub()
+        subscription = hub.subscribe(["a", "b"], maxsize=2)
+        await sync_to_async(hub.publish, thread_sensitive=False)("a", 1)
+        hub.publish("b", 2)
+        hub.publish("c", 3)
+        await asyncio.sleep(0)
+        self.assertEqual(await subscription.get_many(1), [1, 2])
+        self.assertEqual(await subscription.get_many(0.01), [])
+
+        for event in range(3):
+            hub.publish("a", event)
+        await asyncio.sleep(0)
+        self.assertTrue(subscription.overflowed)
+        subscription.close()
+        self.assertEqual(hub._subscriptions, {})
+
+    def test_pages_open_streams_only_over_asgi(self):
+        self.assertContains(self.client.get("/home"), "const live_events = false;")
+
+    async def test_pages_open_streams_over_asgi(self):
+        response = await AsyncClient().get("/home")
+        self.assertContains(response, "const live_events = true;")
+
+    def test_encode_events(self):
+        events = [
+            {"type": "likes", "id": 1, "delta": 1, "actor": 5},
+            {"type": "post", "id": 9},
+            {"type": "likes", "id": 1, "delta": 1, "actor": 6},
+            {"type": "likes", "id": 2, "delta": 1, "actor": 6},
+            {"type": "likes", "id": 2, "delta": -1, "actor": 7},
+            {"type": "likes", "id": 3, "delta": 1, "actor": 8},
+        ]
+        self.assertEqual(encode_events(events, viewer_id=8), 'event: post\ndata: {"id": 9}\n\n'
+                                                             'event: likes\ndata: {"id": 1, "delta": 2}\n\n')
+
+    async def test_stream_pushes_followed_posts_and_like_deltas(self):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.viewer)
+        response = await client.get("/api/events", {"posts": f"{self.post.id}"})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = response.streaming_content
+        self.assertEqual(await stream.__anext__(), b"retry: 5000\n\n")
+
+        def write():
+            with self.captureOnCommitCallbacks(execute=True):
+                Post.objects.create(body="Unfollowed author", user=self.other)
+                self.post.add_like(self.viewer)
+                self.post.add_like(self.author)
+                return Post.objects.create(body="New", user=self.author)
+
+        new_post = await sync_to_async(write)()
+        received = b""
+        while b"event: likes" not in received:
+            received += await asyncio.wait_for(stream.__anext__(), 5)
+        self.assertEqual(received.decode(), f'event: post\ndata: {{"id": {new_post.id}}}\n\n'
+                                            f'event: likes\ndata: {{"id": {self.post.id}, "delta": 1}}\n\n')
+        await stream.aclose()
+
+    def test_stream_needs_asgi(self):
+        self.assertEqual(self.client.get("/api/events").status_code, 501)
+
+    def test_post_detail(self):
+        self.post.add_like(self.viewer)
+        self.client.login(username="viewer", password="pass")
+        post = self.client.get(f"/api/post/{self.post.id}").json()
+        self.assertEqual((post["body"], post["like_count"], post["liked_by_me"]), ("On screen", 1, True))
+        self.assertEqual(self.client.get("/api/post/0").status_code, 404)
+        self.assertEqual(self.client.get(f"/api/post/{10 ** 30}").status_code, 404)
+
+
+class BenchmarkTest(TestCase):
+    def generate(self, seed=1):
+        return generate_network(users=40, posts_per_user=2, likes_per_post=3, follows_per_user=5, seed=seed)
+
+    def follow_graph(self):
+        return sorted(Follow.objects.values_list("follower__username", "following__username"))
+
+    def test_generated_network_is_consistent_and_reproducible(self):
+        counts = self.generate()
+        self.assertEqual((counts["users"], counts["posts"]), (40, 80))
+        self.assertEqual(counts["follows"], Follow.objects.count())
+        self.assertEqual(counts["likes"], Post.likes.through.objects.count())
+        self.assertEqual(set(repair_counters(dry_run=True).values()), {0})
+        self.assertFalse(Follow.objects.filter(follower=F("following")).exists())
+        # Popular users gather most of the follows
+        followers = sorted(User.objects.values_list("follower_count", flat=True), reverse=True)
+        self.assertGreater(sum(followers[:4]), sum(followers[-20:]))
+
+        graph = self.follow_graph()
+        delete_network()
+        self.assertFalse(User.objects.exists())
+        self.generate()
+        self.assertEqual(self.follow_graph(), graph)
+
+    def test_runner_reports_every_endpoint(self):
+        self.generate()
+        results = run_benchmark(requests=2, warmup=1)
+        self.assertEqual(results["meta"]["posts"], 80)
+        self.assertEqual(set(results["endpoints"]), {
+            "posts_anonymous", "posts", "posts_page", "following", "profile", "profile_posts", "profile_likes",
+            "post", "post_likes", "ranked", "search", "like", "unlike",
+        })
+        for name, result in results["endpoints"].items():
+            self.assertEqual(result["statuses"], {200: 2}, name)
+            self.assertGreater(result["bytes_mean"], 0)
+            self.assertIsNotNone(result["p99_ms"])
+        self.assertEqual(set(repair_counters(dry_run=True).values()), {0})
+        json.dumps(results)
+
+
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        metrics.reset()
+        cache.clear()
+        self.staff = User.objects.create_user(username="staff", password="pass", is_staff=True)
+        self.author = User.objects.create_user(username="author", password="pass")
+        Post.objects.create(body="Post", user=self.author)
+
+    def test_server_timing_header(self):
+        self.client.login(username="author", password="pass")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/posts", {"cursor": ""})
+        self.assertRegex(response["Server-Timing"], rf'^db;dur=[0-9.]+;desc="{len(queries)} queries", '
+                                                    r'serialize;dur=[0-9.]+, total;dur=[0-9.]+$')
+
+    def test_requests_are_logged_as_json(self):
+        with self.assertLogs("network.performance", "INFO") as logs:
+            response = self.client.get("/api/profile/author/posts", {"cursor": ""})
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((line["url_name"], line["status"], line["bytes"]),
+                         ("api_profile_posts", 200, len(response.content)))
+        self.assertGreater(line["db_queries"], 0)
+
+    def test_metrics_endpoint(self):
+        self.client.get("/api/posts", {"cursor": ""})
+        self.client.get("/api/posts", {"cursor": ""})
+        self.client.get("/api/profile/nobody")
+        self.assertEqual(self.client.get("/api/_metrics").status_code, 401)
+        self.client.login(username="author", password="pass")
+        self.assertEqual(self.client.get("/api/_metrics").status_code, 403)
+
+        self.client.login(username="staff", password="pass")
+        response = self.client.get("/api/_metrics")
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        self.assertIn('network_request_duration_seconds_count{url_name="api_posts"} 2\n', body)
+        self.assertIn('network_request_duration_seconds_bucket{url_name="api_posts",le="+Inf"} 2\n', body)
+        self.assertIn('network_responses_total{url_name="api_profile",code="404"} 1\n', body)
+        self.assertIn('network_feed_cache_total{event="hits"}', body)
+
+    @override_settings(ROOT_URLCONF="network.async_urls")
+    async def test_async_requests_are_measured(self):
+        response = await AsyncClient().get("/api/posts", {"cursor": ""})
+        self.assertIn("total;dur=", response["Server-Timing"])
+        self.assertEqual(metrics.snapshot()["api_posts"]["statuses"], {200: 1})
+        # The queries run in worker threads, on connections of their own
+        self.assertEqual(response.json()["posts"][0]["body"], "Post")
+        self.assertNotIn('desc="0 queries"', response["Server-Timing"])
+        self.assertGreater(metrics.snapshot()["api_posts"]["queries"], 0)
+
+
+class EncodingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        post_fragments.clear()
+        self.author = User.objects.create_user(username="author", password="pass")
+        self.posts = [Post.objects.create(body=f"Post {i} \u2764 \"quoted\"", user=self.author) for i in range(3)]
+        self.posts[0].add_like(self.author)
+        self.client.login(username="author", password="pass")
+
+    def feed(self, encoder):
+        with override_settings(NETWORK_JSON_ENCODER=encoder):
+            return self.client.get("/api/posts", {"cursor": ""}).content
+
+    @unittest.skipIf(orjson is None, "orjson is not installed")
+    def test_backends_agree(self):
+        self.assertEqual(self.feed("stdlib"), self.feed("orjson"))
+
+    def test_stdlib_splices_cached_fragments(self):
+        content = self.feed("stdlib")
+        posts = json.loads(content)["posts"]
+        self.assertEqual(posts[-1], {
+            "id": self.posts[0].id, "body": self.posts[0].body, "user": "author",
+            "timestamp": self.posts[0].timestamp.isoformat(), "like_count": 1, "liked_by_me": True,
+        })
+        self.assertEqual(len(post_fragments._fragments), 3)
+        self.assertEqual(self.feed("stdlib"), content)
+
+        # Fragments are keyed on what they encode: an edited post is encoded afresh
+        self.posts[0].body = "Edited"
+        self.posts[0].save()
+        self.assertEqual(json.loads(self.feed("stdlib"))["posts"][-1]["body"], "Edited")
+
+    def test_fragment_cache_is_bounded(self):
+        fragments = FragmentCache(maxsize=10)
+        for i in range(25):
+            fragments.get(i, lambda: b"x")
+        self.assertLessEqual(len(fragments._fragments), 10)
+        self.assertIn(24, fragments._fragments)
+
+    def test_unknown_encoder(self):
+        with override_settings(NETWORK_JSON_ENCODER="pickle"), self.assertRaises(ValueError):
+            encoding_dumps({})
+
+
+@override_settings(NETWORK_READ_REPLICA="replica")
+class ReplicaRoutingTest(TestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.author = User.objects.create_user(username="author", password="pass")
+        # The replica lags behind: it has the users, but another post than the primary
+        User.objects.using("replica").bulk_create([User(pk=user.pk, username=user.username)
+                                                   for user in (self.user, self.author)])
+        self.post = Post.objects.create(body="Primary", user=self.author)
+        Post.objects.using("replica").bulk_create([Post(body="Replica", user_id=self.author.pk)])
+
+    def feed_bodies(self):
+        response = self.client.get("/api/posts", {"cursor": ""})
+        return [post["body"] for post in response.json()["posts"]]
+
+    def test_reads_go_to_the_replica(self):
+        self.assertEqual(self.feed_bodies(), ["Replica"])
+        response = self.client.get("/api/profile/author/posts", {"cursor": ""})
+        self.assertEqual([post["body"] for post in response.json()["posts"]], ["Replica"])
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        self.client.force_login(self.user)
+        response = self.client.post("/api/follow/author")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertTrue(Follow.objects.filter(follower=self.user).exists())
+        self.assertFalse(Follow.objects.using("replica").exists())
+        self.assertEqual(self.feed_bodies(), ["Primary"])
+
+    @override_settings(NETWORK_FEED_CACHE_ALIAS="default")
+    def test_cached_pages_are_read_from_the_primary(self):
+        # Rendered on a miss, then served from the cache
+        self.assertEqual(self.feed_bodies(), ["Primary"])
+        self.assertEqual(self.feed_bodies(), ["Primary"])
+
+    def test_reads_outside_of_read_views_go_to_the_primary(self):
+        self.assertEqual(list(Post.objects.values_list("body", flat=True)), ["Primary"])
+
+    @override_settings(NETWORK_READ_REPLICA=None)
+    def test_no_replica(self):
+        self.assertEqual(self.feed_bodies(), ["Primary"])
+        response = self.client.post("/api/follow/author")
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+
+class SqlitePragmaTest(TestCase):
+    @unittest.skipUnless(connection.vendor == "sqlite", "SQLite only")
+    def test_pragmas_on_new_connections(self):
+        with tempfile.TemporaryDirectory() as directory:
+            new_connection = connections["default"].__class__(
+                dict(connections["default"].settings_dict, NAME=os.path.join(directory, "db.sqlite3")), "pragmas")
+            try:
+                with new_connection.cursor() as cursor:
+                    cursor.execute("PRAGMA journal_mode")
+                    self.assertEqual(cursor.fetchone()[0], "wal")
+                    cursor.execute("PRAGMA synchronous")
+                    self.assertEqual(cursor.fetchone()[0], 1)
+            finally:
+                new_connection.close()
+
+
+@override_settings(NETWORK_FOLLOW_CACHE_ALIAS="default")
+class FollowGraphTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(username=f"user{i}", password="pass") for i in range(5)]
+        a, b, c, d, e = self.users
+        for follower, following in ((a, b), (a, c), (a, d), (b, a), (b, c), (c, a), (d, c)):
+            Follow.add(follower, following)
+
+    def ids(self, *indexes):
+        return [self.users[i].pk for i in indexes]
+
+    def test_following_ids_are_sorted_and_cached(self):
+        a = self.users[0]
+        self.assertEqual(list(following_ids(a.pk)), self.ids(1, 2, 3))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_following(a.pk, self.users[1].pk))
+            self.assertFalse(is_following(a.pk, self.users[4].pk))
+
+    def test_batch_reads_make_one_query(self):
+        with self.assertNumQueries(1):
+            graph = following_many(self.ids(0, 1, 4))
+        self.assertEqual({user_id: list(ids) for user_id, ids in graph.items()},
+                         dict(zip(self.ids(0, 1, 4), [self.ids(1, 2, 3), self.ids(0, 2), []])))
+        with self.assertNumQueries(0):
+            following_many(self.ids(0, 1, 4))
+
+    def test_relationship_queries(self):
+        a, b = self.users[:2]
+        self.assertEqual(followed_among(a.pk, self.ids(1, 4, 2)), set(self.ids(1, 2)))
+        self.assertEqual(mutual_follows(a.pk), self.ids(1, 2))
+        self.assertEqual(mutual_follows(a.pk, among=self.ids(2, 3, 4)), self.ids(2))
+        self.assertEqual(common_following(a.pk, b.pk), self.ids(2))
+
+    def test_follow_and_unfollow_invalidate(self):
+        a, e = self.users[0], self.users[4]
+        following_ids(a.pk)
+        Follow.add(a, e)
+        self.assertTrue(is_following(a.pk, e.pk))
+        Follow.remove(a, e)
+        self.assertFalse(is_following(a.pk, e.pk))
+
+    @override_settings(NETWORK_FOLLOW_CACHE_ALIAS=None)
+    def test_without_a_shared_cache_follows_are_read_from_the_database(self):
+        a, e = self.users[0], self.users[4]
+        with self.assertNumQueries(1):
+            self.assertFalse(is_following(a.pk, e.pk))
+        Follow.add(a, e)
+        with self.assertNumQueries(1):
+            self.assertTrue(is_following(a.pk, e.pk))
+        self.assertEqual(check_follow_cache(None), [])
+
+    def test_per_process_cache_is_rejected(self):
+        self.assertEqual([error.id for error in check_follow_cache(None)], ["network.E001"])
+
+    def test_following_feed_uses_the_cached_ids(self):
+        a = self.users[0]
+        Post.objects.create(body="Followed", user=self.users[1])
+        Post.objects.create(body="Not followed", user=self.users[4])
+        self.client.force_login(a)
+        response = self.client.get("/api/following/1")
+        self.assertEqual([post["body"] for post in response.json()["posts"]], ["Followed"])
+        response = self.client.post("/api/follow/user1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Follow.objects.filter(follower=a).count(), 3)
+
+
+@unittest.skipUnless(connection.vendor == "sqlite", "The search index is SQLite's FTS5")
+class SearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.author = User.objects.create_user(username="author", password="pass")
+        self.client.login(username="user", password="pass")
+
+    def search(self, query, cursor=""):
+        response = self.client.get("/api/search", {"q": query, "cursor": cursor})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def bodies(self, data):
+        return [post["body"] for post in data["posts"]]
+
+    def test_ranked_by_relevance_then_recency(self):
+        Post.objects.create(body="A cat", user=self.author)
+        Post.objects.create(body="Cat cat cat", user=self.author)
+        Post.objects.create(body="A dog", user=self.author)
+        Post.objects.create(body="Another cat", user=self.author)
+        self.assertEqual(self.bodies(self.search("CAT")), ["Cat cat cat", "Another cat", "A cat"])
+        self.assertEqual(self.bodies(self.search("cat dog")), [])
+        self.assertEqual(self.bodies(self.search('"dog" (*')), ["A dog"])
+
+    def test_index_follows_edits_and_deletes(self):
+        response = self.client.post("/api/post", json.dumps({"body": "Hello world"}),
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        post = Post.objects.get()
+        self.assertEqual(self.bodies(self.search("world")), ["Hello world"])
+
+        response = self.client.post(f"/api/posts/{post.pk}/edit", json.dumps({"body": "Hello there"}),
+                                    content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.bodies(self.search("world")), [])
+        self.assertEqual(self.bodies(self.search("there")), ["Hello there"])
+
+        post.delete()
+        self.assertEqual(self.bodies(self.search("hello")), [])
+
+    def test_cursor_pagination(self):
+        for i in range(25):
+            Post.objects.create(body=f"Post number {i}", user=self.author)
+        first = self.search("post")
+        self.assertEqual(len(first["posts"]), 10)
+        second = self.search("post", first["pagination"]["next_cursor"])
+        third = self.search("post", second["pagination"]["next_cursor"])
+        self.assertEqual(len(third["posts"]), 5)
+        self.assertFalse(third["pagination"]["has_next"])
+        seen = self.bodies(first) + self.bodies(second) + self.bodies(third)
+        self.assertEqual(sorted(seen), sorted(f"Post number {i}" for i in range(25)))
+        previous = self.search("post", second["pagination"]["prev_cursor"])
+        self.assertEqual(self.bodies(previous), self.bodies(first))
+
+    @override_settings(NETWORK_SEARCH_WINDOW=3)
+    def test_only_the_newest_matches_are_ranked(self):
+        for i in range(5):
+            Post.objects.create(body=f"Match {i}", user=self.author)
+        self.assertEqual(sorted(self.bodies(self.search("match"))), ["Match 2", "Match 3", "Match 4"])
+
+    def test_invalid_queries(self):
+        for params in ({"q": ""}, {"q": "?!"}, {"q": "cat", "cursor": "nope"},
+                       {"q": "cat", "cursor": encode_cursor("next", [1.5, 10 ** 30])}):
+            response = self.client.get("/api/search", params)
+            self.assertEqual(response.status_code, 400)
+
+    @override_settings(**SHARED_CACHE_SETTINGS)
+    def test_query_count_does_not_grow(self):
+        for i in range(10):
+            Post.objects.create(body=f"Post {i}", user=self.author).add_like(self.user)
+        self.client.login(username="user", password="pass")
+        # viewer, not cached yet, search, posts with their authors and viewer's likes; the session is cached
+        with self.assertNumQueries(4):
+            data = self.search("post")
+        self.assertTrue(all(post["liked_by_me"] for post in data["posts"]))
+
+    def test_rebuild(self):
+        Post.objects.bulk_create([Post(body=f"Bulk {i}", user=self.author) for i in range(3)])
+        self.assertEqual(self.bodies(self.search("bulk")), [])
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        self.assertEqual(rebuild_index(), 3)
+        self.assertEqual(len(self.search("bulk")["posts"]), 3)
+        out = StringIO()
+        call_command("rebuild_search_index", stdout=out)
+        self.assertIn("3 posts indexed", out.getvalue())
+
+
+class RankedFeedTest(TestCase):
+    def setUp(self):
+        self.viewer = User.objects.create_user(username="viewer", password="pass")
+        self.followed = User.objects.create_user(username="followed", password="pass")
+        self.other = User.objects.create_user(username="other", password="pass")
+        self.likers = [User.objects.create_user(username=f"liker{i}", password="pass") for i in range(6)]
+
+    def create(self, body, author, likes=0, hours_ago=0):
+        post = Post.objects.create(body=body, user=author)
+        Post.objects.filter(pk=post.pk).update(timestamp=timezone.now() - datetime.timedelta(hours=hours_ago))
+        for liker in self.likers[:likes]:
+            post.add_like(liker)
+        return post
+
+    def ranked(self, cursor=""):
+        response = self.client.get("/api/ranked", {"cursor": cursor})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def bodies(self, data):
+        return [post["body"] for post in data["posts"]]
+
+    def test_scores_order_like_decayed_likes(self):
+        # 12 hours decay: one more like for every e-fold of age
+        scores, followed_scores = compute_scores([0, 6, 6], [0, 0, 0], [100 * 3600, 100 * 3600, 76 * 3600])
+        self.assertEqual(sorted(range(3), key=lambda i: -scores[i]), [1, 0, 2])
+        self.assertEqual([round(b - a, 6) for a, b in zip(scores, followed_scores)], [2.0] * 3)
+
+    def test_scores_without_numpy_are_the_same(self):
+        arguments = [0, 1, 6, 1000], [0, 3, 0, 10 ** 6], [0, 100 * 3600, 76 * 3600, 1.7e9]
+        with_numpy = compute_scores(*arguments)
+        with mock.patch("network.ranking.numpy", None):
+            without_numpy = compute_scores(*arguments)
+        for expected, actual in zip(with_numpy, without_numpy):
+            for a, b in zip(expected, actual):
+                self.assertAlmostEqual(a, b, places=9)
+
+    def test_ranked_by_likes_recency_and_affinity(self):
+        self.create("Old popular", self.other, likes=6, hours_ago=72)
+        self.create("Recent popular", self.other, likes=6, hours_ago=1)
+        self.create("Recent", self.other, hours_ago=1)
+        self.create("Followed", self.followed, hours_ago=1.25)
+        self.assertEqual(PostScore.refresh(), 4)
+
+        self.assertEqual(self.bodies(self.ranked()), ["Recent popular", "Recent", "Followed", "Old popular"])
+        Follow.add(self.viewer, self.followed)
+        self.client.force_login(self.viewer)
+        self.assertEqual(self.bodies(self.ranked()), ["Followed", "Recent popular", "Recent", "Old popular"])
+
+    def test_refresh_is_incremental(self):
+        post = self.create("Post", self.other)
+        self.create("Other", self.other)
+        self.assertEqual(PostScore.refresh(), 2)
+        self.assertEqual(PostScore.refresh(), 0)
+        before = PostScore.objects.get(post=post).score
+        post.add_like(self.viewer)
+        Follow.add(self.viewer, self.followed)
+        self.assertEqual(PostScore.refresh(), 1)
+        self.assertGreater(PostScore.objects.get(post=post).score, before)
+        self.assertEqual(PostScore.refresh(full=True), 2)
+
+        out = StringIO()
+        call_command("refresh_scores", stdout=out)
+        self.assertIn("0 posts scored", out.getvalue())
+
+    @override_settings(**SHARED_CACHE_SETTINGS)
+    def test_cursor_pagination_and_query_count(self):
+        for i in range(25):
+            self.create(f"Post {i}", self.followed if i % 2 else self.other, likes=i % 4, hours_ago=i)
+        PostScore.refresh()
+        self.client.force_login(self.viewer)
+        Follow.add(self.viewer, self.followed)
+        self.ranked()
+        # a page from each source, its posts with their authors and the viewer's likes; session, viewer
+        # and followed ids are cached
+        with self.assertNumQueries(4):
+            first = self.ranked()
+        second = self.ranked(first["pagination"]["next_cursor"])
+        third = self.ranked(second["pagination"]["next_cursor"])
+        seen = self.bodies(first) + self.bodies(second) + self.bodies(third)
+        self.assertEqual(sorted(seen), sorted(f"Post {i}" for i in range(25)))
+        self.assertFalse(third["pagination"]["has_next"])
+        self.assertEqual(self.bodies(self.ranked(second["pagination"]["prev_cursor"])), self.bodies(first))
+
+
+class ProfileSummaryTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.author = User.objects.create_user(username="author", password="pass")
+
+    def summary(self, user):
+        return ProfileSummary.objects.get(user=user)
+
+    def latest(self, user):
+        summary = self.summary(user)
+        return summary.post_count, summary.latest_post_id
+
+    def test_kept_in_step_by_writes(self):
+        self.client.force_login(self.author)
+        for body in ("First", "Second"):
+            self.client.post("/api/post", json.dumps({"body": body}), content_type="application/json")
+        latest = Post.objects.get(body="Second")
+        summary = self.summary(self.author)
+        self.assertEqual((summary.post_count, summary.latest_post_id, summary.last_active),
+                         (2, latest.pk, latest.timestamp))
+
+        ProfileSummary.rebuild([self.user.pk])
+        self.client.force_login(self.user)
+        self.client.post(f"/api/like/{latest.pk}")
+        liked = self.summary(self.user).last_active
+        self.assertGreater(liked, latest.timestamp)
+        self.client.post("/api/follow/author")
+        self.assertGreater(self.summary(self.user).last_active, liked)
+
+    def test_kept_in_step_by_deletions(self):
+        first = Post.objects.create(body="First", user=self.author)
+        second = Post.objects.create(body="Second", user=self.author)
+        first.delete()
+        self.assertEqual(self.latest(self.author), (1, second.pk))
+        third = Post.objects.create(body="Third", user=self.author)
+        third.delete()
+        self.assertEqual(self.latest(self.author), (1, second.pk))
+        second.delete()
+        self.assertEqual(self.latest(self.author), (0, None))
+
+    def test_profile_is_one_lookup(self):
+        Post.objects.create(body="Post", user=self.author)
+        # The user and their summary
+        with self.assertNumQueries(1):
+            data = self.client.get("/api/profile/author").json()
+        self.assertEqual(data["user"]["post_count"], 1)
+        self.assertEqual(data["user"]["latest_post"], Post.objects.get().pk)
+
+    def test_missing_summaries_are_rebuilt(self):
+        Post.objects.bulk_create([Post(body=f"Bulk {i}", user=self.author) for i in range(3)])
+        ProfileSummary.objects.all().delete()
+        data = self.client.get("/api/profile/author").json()
+        self.assertEqual(data["user"]["post_count"], 3)
+        self.assertEqual(data["user"]["last_active"], Post.objects.order_by("-id")[0].timestamp.isoformat())
+
+        ProfileSummary.objects.all().delete()
+        out = StringIO()
+        call_command("rebuild_profiles", stdout=out)
+        self.assertIn("2 profile summaries written", out.getvalue())
+        self.assertEqual(self.summary(self.user).post_count, 0)
+        self.assertIsNone(self.summary(self.user).last_active)
+        self.assertEqual(self.summary(self.author).post_count, 3)
+
+    def test_rebuild_keeps_later_activity(self):
+        Post.objects.create(body="Post", user=self.author)
+        ProfileSummary.touch([self.author.pk])
+        touched = self.summary(self.author).last_active
+        ProfileSummary.rebuild()
+        self.assertEqual(self.summary(self.author).last_active, touched)
+
+
+@override_settings(**SHARED_CACHE_SETTINGS)
+class CachedAuthTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="user", password="pass")
+        Post.objects.create(body="Post", user=self.user)
+        self.client.login(username="user", password="pass")
+
+    def test_logged_in_reads_skip_session_and_user_queries(self):
+        self.client.get("/api/posts", {"cursor": ""})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/posts", {"cursor": ""})
+        self.assertEqual(response.json()["posts"][0]["body"], "Post")
+        self.assertFalse([query for query in queries
+                          if "django_session" in query["sql"] or 'FROM "network_user"' in query["sql"]])
+
+    def test_saving_the_user_drops_it_from_the_cache(self):
+        self.client.get("/api/posts", {"cursor": ""})
+        self.user.set_password("changed")
+        self.user.save()
+        # The session was authenticated with the old password
+        response = self.client.get("/api/following")
+        self.assertEqual(response.status_code, 302)
+
+    def test_per_process_cache_is_rejected(self):
+        self.assertEqual([error.id for error in check_user_cache(None)], ["network.E002"])
+        with override_settings(NETWORK_USER_CACHE_ALIAS=None):
+            self.assertEqual(check_user_cache(None), [])
+            self.client.get("/api/posts", {"cursor": ""})
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get("/api/posts", {"cursor": ""})
+            self.assertTrue([query for query in queries if 'FROM "network_user"' in query["sql"]])
+
+    def test_sessions_of_the_model_backend_stay_valid(self):
+        client = Client()
+        client.force_login(self.user, backend="django.contrib.auth.backends.ModelBackend")
+        self.assertEqual(client.get("/api/following").status_code, 200)
+
+    def test_benchmark(self):
+        results = compare_sessions(requests=3)
+        self.assertEqual(results["database"]["authenticated"]["session_and_user_queries_mean"], 2)
+        self.assertEqual(results["cached"]["authenticated"]["session_and_user_queries_mean"], 0)
+        self.assertEqual(results["cached"]["anonymous"]["session_and_user_queries_mean"], 0)
+        self.assertFalse(User.objects.filter(username="bench-reader").exists())
+
+
+@override_settings(NETWORK_RATE_LIMITS={"like": "2/m", "post": "1/h"}, NETWORK_WRITE_CONCURRENCY=1)
+class RateLimitTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        buckets.clear()
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.other = User.objects.create_user(username="other", password="pass")
+        self.posts = [Post.objects.create(body=f"Post {i}", user=self.other) for i in range(4)]
+        self.client.login(username="user", password="pass")
+
+    def like(self, post, client=None):
+        return (client or self.client).post(f"/api/like/{post.id}")
+
+    def test_writes_over_the_rate_are_refused(self):
+        self.assertEqual([self.like(post).status_code for post in self.posts[:2]], [200, 200])
+        response = self.like(self.posts[2])
+        self.assertEqual(response.status_code, 429)
+        # Two likes a minute: a token every 30 seconds
+        self.assertTrue(1 <= int(response["Retry-After"]) <= 30)
+        self.assertFalse(self.posts[2].likes.exists())
+
+        # Scopes and users have buckets of their own, and reads are not limited
+        responses = [self.client.post("/api/post", {"body": body}, content_type="application/json")
+                     for body in ("Mine", "Again")]
+        self.assertEqual([response.status_code for response in responses], [200, 429])
+        self.client.login(username="other", password="pass")
+        self.assertEqual(self.like(self.posts[2]).status_code, 200)
+        self.assertEqual(self.client.get("/api/posts", {"cursor": ""}).status_code, 200)
+
+    def test_anonymous_clients_are_limited_by_address(self):
+        self.client.logout()
+        first, second = Client(REMOTE_ADDR="10.0.0.1"), Client(REMOTE_ADDR="10.0.0.2")
+        self.assertEqual([self.like(self.posts[0], first).status_code for _ in range(3)], [401, 401, 429])
+        self.assertEqual(self.like(self.posts[0], second).status_code, 401)
+
+    def test_batch_operations_take_a_token_each(self):
+        batch = {"operations": [{"op": "like", "post_id": post.id} for post in self.posts[:3]]}
+        response = self.client.post("/api/batch", batch, content_type="application/json")
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(self.user.likes.exists())
+
+        batch["operations"].pop()
+        response = self.client.post("/api/batch", batch, content_type="application/json")
+        self.assertEqual([result["status"] for result in response.json()["results"]], [200, 200])
+
+    def test_refused_batches_charge_no_scope(self):
+        # The likes fit, the posts do not
+        batch = {"operations": [{"op": "like", "post_id": self.posts[0].id},
+                                {"op": "post", "body": "One"}, {"op": "post", "body": "Two"}]}
+        response = self.client.post("/api/batch", batch, content_type="application/json")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual([self.like(post).status_code for post in self.posts[:3]], [200, 200, 429])
+
+    def test_writes_over_the_concurrency_limit_are_shed(self):
+        self.assertTrue(write_gate.enter())
+        try:
+            response = self.like(self.posts[0])
+            self.assertEqual((response.status_code, response["Retry-After"]), (429, "1"))
+        finally:
+            write_gate.exit()
+        self.assertEqual(self.like(self.posts[0]).status_code, 200)
+        self.assertEqual(write_gate.in_flight, 0)
+
+    @override_settings(NETWORK_RATE_LIMIT_CACHE_ALIAS="missing")
+    def test_buckets_fall_back_to_memory(self):
+        fallbacks = rate_limit_stats().get(("cache", "fallback"), 0)
+        self.assertEqual([self.like(post).status_code for post in self.posts[:3]], [200, 200, 429])
+        self.assertGreater(rate_limit_stats()[("cache", "fallback")], fallbacks)
+
+    def test_metrics(self):
+        self.like(self.posts[0])
+        body = metrics.render()
+        self.assertIn('network_rate_limit_total{scope="like",result="allowed"}', body)
+        self.assertIn('network_write_gate_total{result="admitted"}', body)
+        self.assertIn("network_write_gate_in_flight 0\n", body)
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate("30/m"), (30, 0.5))
+        for rate in ("30", "0/m", "x/m", "30/w"):
+            with self.assertRaises(ValueError):
+                parse_rate(rate)
+
+    def test_buckets_do_not_wait_for_each_other(self):
+        loading, release = threading.Event(), threading.Event()
+
+        class SlowBuckets(TokenBuckets):
+            def _load(self, key):
+                if key == "slow":
+                    loading.set()
+                    release.wait(10)
+                return super()._load(key)
+
+        slow_buckets = SlowBuckets()
+        slow = threading.Thread(target=slow_buckets.take, args=("slow", 2, 1))
+        slow.start()
+        try:
+            loading.wait(10)
+            # Taken while the other bucket is in its cache round trip
+            fast = threading.Thread(target=slow_buckets.take, args=("fast", 2, 1))
+            fast.start()
+            fast.join(5)
+            self.assertFalse(fast.is_alive())
+        finally:
+            release.set()
+            slow.join()
+
+
+class ImportTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        User.objects.create_user(username="existing", password="pass")
+
+    def write(self, name, lines):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w") as file:
+            file.writelines(f"{line}\n" for line in lines)
+        return path
+
+    def sources(self):
+        users = [{"username": "alice", "email": "alice@example.com", "password": make_password("secret")},
+                 {"username": "bob", "password": "not a hash", "date_joined": "2020-01-01T00:00:00"},
+                 {"username": "existing", "email": "replaced@example.com"}, {"username": ""}]
+        posts = [{"id": 100, "user": "alice", "body": "Imported hello", "timestamp": "2021-05-01T10:00:00Z"},
+                 {"id": 101, "user": "bob", "body": "Second hello", "timestamp": "2021-05-02T10:00:00Z"},
+                 {"id": 102, "user": "nobody", "body": "Unknown author"},
+                 {"id": 103, "user": "bob", "body": "x" * 141}]
+        return {
+            "users": self.write("users.ndjson", map(json.dumps, users)),
+            "follows": self.write("follows.csv", ["follower,following", "bob,alice", "bob,alice", "alice,alice",
+                                                  "alice,nobody", "existing,bob"]),
+            "posts": self.write("posts.jsonl", map(json.dumps, posts)),
+            "likes": self.write("likes.ndjson", map(json.dumps, [{"user": "bob", "post": 100},
+                                                                 {"user": "alice", "post": 999}])),
+        }
+
+    def test_import(self):
+        out = StringIO()
+        sources = self.sources()
+        call_command("import_network", *[f"--{kind}={path}" for kind, path in sources.items()],
+                     "--batch-size=2", stdout=out)
+        self.assertIn("follows: 5 records read, 2 imported", out.getvalue())
+
+        alice, bob = User.objects.get(username="alice"), User.objects.get(username="bob")
+        self.assertTrue(alice.check_password("secret"))
+        self.assertFalse(bob.has_usable_password())
+        self.assertEqual(bob.date_joined, datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc))
+        self.assertEqual(User.objects.get(username="existing").email, "")
+        self.assertEqual(set(Follow.objects.values_list("follower__username", "following__username")),
+                         {("bob", "alice"), ("existing", "bob")})
+        self.assertEqual((alice.follower_count, bob.follower_count, bob.following_count), (1, 1, 1))
+
+        self.assertEqual(sorted(Post.objects.values_list("id", flat=True)), [100, 101])
+        post = Post.objects.get(pk=100)
+        self.assertEqual((post.timestamp.year, post.like_count), (2021, 1))
+        self.assertEqual(Post.objects.create(user=alice, body="New").pk, 102)
+        self.assertEqual([entry.post_id for entry in TimelineEntry.objects.filter(owner=bob)], [100])
+        self.assertEqual(self.client.get("/api/search", {"q": "hello"}).json()["posts"][0]["id"], 101)
+        self.assertEqual(ProfileSummary.objects.get(user=bob).post_count, 1)
+        self.assertTrue(PostScore.objects.filter(post_id=101).exists())
+
+    def test_batches_are_resolved_in_bulk(self):
+        sources = self.sources()
+        import_network({"users": sources["users"]}, rebuild=False)
+        follows = self.write("many.csv", ["follower,following"] + [f"alice,user{i}" for i in range(50)]
+                             + ["alice,bob", "bob,alice"])
+        import_network({"users": self.write("more.ndjson", [json.dumps({"username": f"user{i}"})
+                                                             for i in range(50)])}, rebuild=False)
+        with CaptureQueriesContext(connection) as queries:
+            stats = import_network({"follows": follows}, rebuild=False)
+        self.assertEqual(stats, {"follows": {"read": 52, "imported": 52}})
+        # User lookup and insert, no query per row
+        self.assertLessEqual(len(queries), 6)
+
+    def test_resume_from_checkpoint(self):
+        sources = self.sources()
+        checkpoint = os.path.join(self.directory.name, "checkpoint.json")
+        first = import_network(sources, checkpoint, batch_size=2, rebuild=False)
+        self.assertEqual(first["users"], {"read": 4, "imported": 2})
+        # Nothing left to read, and nothing written twice
+        again = import_network(sources, checkpoint, batch_size=2, rebuild=False)
+        self.assertEqual(again, {kind: {"read": 0, "imported": 0} for kind in sources})
+
+        with open(checkpoint) as file:
+            state = json.load(file)
+        state["likes"]["records"] = 0
+        with open(checkpoint, "w") as file:
+            json.dump(state, file)
+        Post.likes.through.objects.all().delete()
+        self.assertEqual(import_network({"likes": sources["likes"]}, checkpoint)["likes"], {"read": 2, "imported": 1})
+        self.assertEqual(Post.objects.get(pk=100).like_count, 1)
+
+    def test_invalid_sources(self):
+        with self.assertRaisesMessage(CommandError, "expected a .csv, .ndjson or .jsonl file"):
+            call_command("import_network", f"--users={self.write('users.txt', ['alice'])}")
+        with self.assertRaisesMessage(CommandError, "line 2: expected an object"):
+            call_command("import_network", f"--users={self.write('users.ndjson', ['{}', '[]'])}", "--no-rebuild")
+        with self.assertRaises(CommandError):
+            call_command("import_network")
+
+# The async API views must behave exactly like the sync ones: rerun the API tests against them
+@override_settings(ROOT_URLCONF="network.async_urls")
+class AsyncCursorPaginationTest(CursorPaginationTest):
+    pass
+
+
+@override_settings(ROOT_URLCONF="network.async_urls")
+class AsyncCounterTest(CounterTest):
+    pass
+
+
+@override_settings(ROOT_URLCONF="network.async_urls")
+class AsyncLikePayloadTest(LikePayloadTest):
+    pass
+
+
+@override_settings(ROOT_URLCONF="network.async_urls")
+class AsyncTimelineTest(TimelineTest):
+    pass
+
+
+@override_settings(ROOT_URLCONF="network.async_urls")
+class AsyncFeedCacheTest(FeedCacheTest):
+    pass
+
+
+@override_settings(ROOT_URLCONF="network.async_urls")
+class AsyncConditionalGetTest(ConditionalGetTest):
+    pass
+
+
+@override_settings(ROOT_URLCONF="network.async_urls")
+class AsyncProfileApiTest(ProfileApiTest):
+    pass
+
+
+@override_settings(ROOT_URLCONF="network.async_urls")
+class AsyncLikeBatchingTest(LikeBatchingTest):
+    pass
+
+
+@override_settings(ROOT_URLCONF="network.async_urls")
+class AsyncReplicaRoutingTest(ReplicaRoutingTest):
+    pass
+
+
+@override_settings(ROOT_URLCONF="network.async_urls")
+class AsyncRateLimitTest(RateLimitTest):
+    pass
+
+
+@override_settings(ROOT_URLCONF="network.async_urls")
+class AsyncClientTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="user", password="pass")
+        self.author = User.objects.create_user(username="author", password="pass")
+        self.post = Post.objects.create(body="Post", user=self.author)
+
+    async def test_reads_through_the_asgi_handler(self):
+        client = AsyncClient()
+        response = await client.get("/api/posts", {"cursor": ""})
+        self.assertEqual((await sync_to_async(response.json)())["posts"][0]["body"], "Post")
+        response = await client.get("/api/profile/author/1")
+        self.assertEqual(response.status_code, 200)
+        response = await client.get("/api/following")
+        self.assertEqual(response.status_code, 302)
+        response = await client.get("/api/profile/nobody")
+        self.assertEqual(response.status_code, 404)
+
+    async def test_writes_through_the_asgi_handler(self):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.user)
+        response = await client.post(f"/api/like/{self.post.id}")
+        self.assertEqual(response.status_code, 200)
+        response = await client.post("/api/follow/author")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await Follow.objects.filter(follower=self.user).acount(), 1)
+        self.assertEqual((await Post.objects.aget(pk=self.post.pk)).like_count, 1)
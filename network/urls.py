@@ -1,28 +1,44 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import async_views, views
 
-urlpatterns = [
-    path("", views.index, name="index"),
-    path('home', views.index, name='home'),
-    path('profile/<str:username>', views.index, name='profile'),
-    path('following', views.index, name='following'),
-    path("login", views.login_view, name="login"),
-    path("logout", views.logout_view, name="logout"),
-    path("register", views.register, name="register"),
 
-    # API
-    path("api/post", views.post, name="api_post"),
-    path("api/posts", views.posts, name="api_posts"),
-    path("api/posts/<int:page>", views.posts, name="api_posts_page"),
-    path("api/following", views.following, name="api_following"),
-    path("api/following/<int:page>", views.following, name="api_following_page"),
-    path("api/profile/<str:username>", views.profile, name="api_profile"),
-    path("api/profile/<str:username>/<int:page>", views.profile_posts, name="api_profile_posts_page"),
-    path("api/follow/<str:username>", views.follow, name="api_follow"),
-    path("api/posts/<int:post_id>/edit", views.edit_post, name="api_edit_post"),
-    path("api/like/<int:post_id>", views.like, name="api_like"),
-    path("api/unlike/<int:post_id>", views.unlike, name="api_unlike"),
-    path("api/unfollow/<str:username>", views.unfollow, name="api_unfollow"),
+def build_urlpatterns(api):
+    # ``api`` is the module providing the API views that have both a sync and an async version
+    return [
+        path("", views.index, name="index"),
+        path('home', views.index, name='home'),
+        path('profile/<str:username>', views.index, name='profile'),
+        path('following', views.index, name='following'),
+        path("login", views.login_view, name="login"),
+        path("logout", views.logout_view, name="logout"),
+        path("register", views.register, name="register"),
 
-]
+        # API
+        path("api/post", views.post, name="api_post"),
+        path("api/post/<int:post_id>", views.post_detail, name="api_post_detail"),
+        path("api/posts", api.posts, name="api_posts"),
+        path("api/posts/<int:page>", api.posts, name="api_posts_page"),
+        path("api/following", api.following, name="api_following"),
+        path("api/following/<int:page>", api.following, name="api_following_page"),
+        path("api/profile/<str:username>", api.profile, name="api_profile"),
+        path("api/profile/<str:username>/posts", api.profile_posts, name="api_profile_posts"),
+        path("api/profile/<str:username>/likes", views.profile_likes, name="api_profile_likes"),
+        path("api/profile/<str:username>/<int:page>", api.profile_posts, name="api_profile_posts_page"),
+        path("api/follow/<str:username>", api.follow, name="api_follow"),
+        path("api/posts/<int:post_id>/edit", views.edit_post, name="api_edit_post"),
+        path("api/posts/<int:post_id>/likes", views.post_likes, name="api_post_likes"),
+        path("api/like/<int:post_id>", api.like, name="api_like"),
+        path("api/unlike/<int:post_id>", api.unlike, name="api_unlike"),
+        path("api/unfollow/<str:username>", api.unfollow, name="api_unfollow"),
+        path("api/ranked", views.ranked, name="api_ranked"),
+        path("api/search", views.search, name="api_search"),
+        path("api/batch", views.batch, name="api_batch"),
+        path("api/events", async_views.events, name="api_events"),
+        path("api/export", views.export_posts, name="api_export"),
+        path("api/_metrics", views.metrics_view, name="api_metrics"),
+    ]
+
+
+urlpatterns = build_urlpatterns(async_views if getattr(settings, "NETWORK_ASYNC_API", False) else views)
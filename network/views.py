@@ -1,30 +1,41 @@
 import json
+from collections import Counter
 
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.core.exceptions import ValidationError
-from django.db import IntegrityError
-from django.http import HttpResponseRedirect
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, transaction
+from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
 from django.urls import reverse
 
-from .models import User, Post, Follow
+from .cache import cache_page, get_cached_page, page_key
+from .conditional import (conditional_feed, following_feeds, get_profile_user, global_feeds, profile_feeds,
+                          profile_likes_feeds, profile_posts_feeds)
+from .db import primary_reads, replica_reads
+from .encoding import json_response
+from .export import export_queryset, iter_gzip, iter_ndjson, parse_bound
+from . import follows
+from .instrumentation import metrics
+from . import operations
+from .models import User, Post
+from .pagination import InvalidCursor
+from .ratelimit import OPERATION_SCOPES, admit_write, check_rates, too_many_requests
+from .search import InvalidQuery, search_posts
 
 
 def index(request, username=None):
-    context = {
-        'user': request.user.username
-    }
-    return render(request, "network/index.html")
+    return render(request, "network/index.html", index_context(request))
 
 
 def index_resource(request, resource):
-    context = {
-        'user': request.user.username,
-        'url': resource
-    }
-    return render(request, "network/index.html")
+    return render(request, "network/index.html", index_context(request))
+
+
+def index_context(request):
+    # The page only opens event streams where /api/events serves them, i.e. over ASGI
+    return {'live_events': isinstance(request, ASGIRequest)}
 
 
 def login_view(request):
@@ -79,8 +90,51 @@ def register(request):
         return render(request, "network/index.html")
 
 
-def posts(request, page=1):
-    serialized_posts, total_pages, has_next, has_previous = Post.get_paginated_posts(page, 10, request.user, 'all')
+def cached_feed_response(request, page, user, source):
+    # Anonymous pages of the global and profile feeds are the same for every viewer, so their rendered
+    # JSON is cached until a post in the feed changes (see signals.py). A page to be cached is read from
+    # the primary: read from a lagging replica, it could miss the change that started its version.
+    if request.user.is_authenticated or source == 'following':
+        return paginated_feed_response(request, page, user, source)
+    feed = "all" if source == 'all' else f"profile:{user.pk}"
+    key = page_key(request, page)
+    response, version = get_cached_page(feed, key)
+    if response is None and version is None:
+        response = paginated_feed_response(request, page, user, source)
+    elif response is None:
+        with primary_reads():
+            response = cache_page(feed, version, key, paginated_feed_response(request, page, user, source))
+    return response
+
+
+def cursor_pagination(next_cursor, prev_cursor, total_pages=None):
+    return {
+        'total_pages': total_pages,
+        'has_next': next_cursor is not None,
+        'has_previous': prev_cursor is not None,
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor,
+    }
+
+
+def paginated_feed_response(request, page, user, source):
+    # Passing ?cursor= (empty for the first page) switches to keyset pagination, which skips the
+    # COUNT(*) and OFFSET of page-number pagination. ?count=1 adds total_pages back if needed.
+    if "cursor" in request.GET:
+        try:
+            serialized_posts, total_pages, next_cursor, prev_cursor = Post.get_cursor_posts(
+                request.GET["cursor"], 10, user, source, with_count=request.GET.get("count") == "1",
+                viewer=request.user)
+        except InvalidCursor as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        response_data = {
+            'posts': serialized_posts,
+            'pagination': cursor_pagination(next_cursor, prev_cursor, total_pages),
+        }
+        return json_response(response_data)
+
+    serialized_posts, total_pages, has_next, has_previous = Post.get_paginated_posts(page, 10, user, source,
+                                                                                     viewer=request.user)
     response_data = {
         'posts': serialized_posts,
         'pagination': {
@@ -90,92 +144,154 @@ def posts(request, page=1):
             'has_previous': has_previous,
         }
     }
-    return JsonResponse(response_data, safe=False)
+    return json_response(response_data)
+
 
+@replica_reads
+@conditional_feed(global_feeds)
+def posts(request, page=1):
+    return cached_feed_response(request, page, request.user, 'all')
 
+
+@replica_reads
 @login_required(login_url='login')
+@conditional_feed(following_feeds)
 def following(request, page=1):
-    serialized_posts, total_pages, has_next, has_previous = Post.get_paginated_posts(page, 10, request.user,
-                                                                                     'following')
-    response_data = {
-        'posts': serialized_posts,
-        'pagination': {
-            'current_page': page,
-            'total_pages': total_pages,
-            'has_next': has_next,
-            'has_previous': has_previous,
-        }
-    }
-    return JsonResponse(response_data, safe=False)
+    return paginated_feed_response(request, page, request.user, 'following')
 
 
+@replica_reads
+@conditional_feed(profile_feeds)
 def profile(request, username):
-    profile_user = get_object_or_404(User, username=username)
+    # The profile header has a constant size; ?include=posts,likes embeds the first page of the
+    # profile's posts and liked posts, which are otherwise read from their own paginated endpoints
+    include = set(filter(None, request.GET.get("include", "").split(",")))
+    if include - {"posts", "likes"}:
+        return JsonResponse({"error": "include accepts 'posts' and 'likes'."}, status=400)
+
+    profile_user = get_profile_user(request, username)
     requesting_user = request.user if request.user.is_authenticated else None
     is_following = False
 
     if requesting_user:
-        is_following = Follow.objects.filter(follower=requesting_user, following=profile_user).exists()
+        is_following = follows.is_following(requesting_user.pk, profile_user.pk)
 
     response_data = {
-        'user': profile_user.serialize(),
+        'user': dict(profile_user.serialize(), **profile_user.summary.serialize()),
         'is_following': is_following,
     }
-    return JsonResponse(response_data, safe=False)
+    for section, source in (("posts", "profile"), ("likes", "liked")):
+        if section in include:
+            serialized_posts, _, next_cursor, prev_cursor = Post.get_cursor_posts(
+                "", 10, profile_user, source, viewer=request.user)
+            response_data[section] = {
+                'posts': serialized_posts,
+                'pagination': cursor_pagination(next_cursor, prev_cursor),
+            }
+    return json_response(response_data)
+
+
+@replica_reads
+@conditional_feed(profile_likes_feeds)
+def profile_likes(request, username):
+    profile_user = get_profile_user(request, username)
+    try:
+        serialized_posts, _, next_cursor, prev_cursor = Post.get_cursor_posts(
+            request.GET.get("cursor", ""), 10, profile_user, 'liked', viewer=request.user)
+    except InvalidCursor as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    response_data = {
+        'posts': serialized_posts,
+        'pagination': cursor_pagination(next_cursor, prev_cursor),
+    }
+    return json_response(response_data)
+
 
+@replica_reads
+@conditional_feed(profile_posts_feeds)
+def profile_posts(request, username, page=1):
+    profile_user = get_profile_user(request, username)
+    return cached_feed_response(request, page, profile_user, 'profile')
 
-def profile_posts(request, username, page):
-    profile_user = get_object_or_404(User, username=username)
-    serialized_posts, total_pages, has_next, has_previous = Post.get_paginated_posts(page, 10, profile_user,
-                                                                                     'profile')
+
+@replica_reads
+def post_likes(request, post_id):
+    if not operations.valid_post_id(post_id):
+        raise Http404("No Post matches the given query.")
+    post = get_object_or_404(Post, pk=post_id)
+    try:
+        likers, next_cursor, prev_cursor = post.get_likers(request.GET.get("cursor", ""), 50)
+    except InvalidCursor as e:
+        return JsonResponse({"error": str(e)}, status=400)
     response_data = {
-        'posts': serialized_posts,
-        'pagination': {
-            'current_page': page,
-            'total_pages': total_pages,
-            'has_next': has_next,
-            'has_previous': has_previous,
-        }
+        'likes': likers,
+        'like_count': post.like_count,
+        'pagination': cursor_pagination(next_cursor, prev_cursor),
     }
+    return json_response(response_data)
 
-    return JsonResponse(response_data, safe=False)
 
+@replica_reads
+def post_detail(request, post_id):
+    if not operations.valid_post_id(post_id):
+        raise Http404("No Post matches the given query.")
+    post = get_object_or_404(Post.objects.select_related("user"), pk=post_id)
+    return json_response(Post.serialize_many([post], viewer=request.user)[0])
 
-@login_required(login_url='login')
-def follow(request, username):
-    if request.method == "POST":
-        user_to_follow = User.objects.get(username=username)
 
-        if request.user == user_to_follow:
-            return JsonResponse({"message": "You cannot follow yourself."})
+@replica_reads
+def ranked(request):
+    # Posts by precomputed score (see PostScore), with a boost for the authors the viewer follows
+    user = request.user if request.user.is_authenticated else None
+    try:
+        serialized_posts, _, next_cursor, prev_cursor = Post.get_cursor_posts(
+            request.GET.get("cursor", ""), 10, user, 'ranked', viewer=request.user)
+    except InvalidCursor as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    response_data = {
+        'posts': serialized_posts,
+        'pagination': cursor_pagination(next_cursor, prev_cursor),
+    }
+    return json_response(response_data)
+
+
+@replica_reads
+def search(request):
+    try:
+        serialized_posts, next_cursor, prev_cursor = search_posts(
+            request.GET.get("q", ""), request.GET.get("cursor", ""), 10, viewer=request.user)
+    except (InvalidQuery, InvalidCursor) as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    response_data = {
+        'posts': serialized_posts,
+        'pagination': cursor_pagination(next_cursor, prev_cursor),
+    }
+    return json_response(response_data)
+
 
-        # Check if the user is already being followed
-        is_following = user_to_follow.followers.filter(follower=request.user, following=user_to_follow).exists()
+def operation_response(payload, status):
+    return JsonResponse(payload, status=status)
 
-        if not is_following:
-            # Create a new Follow instance to establish the relationship
-            follow = Follow(follower=request.user, following=user_to_follow)
-            follow.save()
 
-        return JsonResponse({"message": "Successfully followed."})
+@login_required(login_url='login')
+@admit_write('follow')
+def follow(request, username):
+    if request.method == "POST":
+        return operation_response(*operations.follow(request.user, username))
 
     return JsonResponse({"message": "Invalid request method."})
 
 
+@admit_write('follow')
 def unfollow(request, username):
     if request.method == "POST":
-        user_to_unfollow = User.objects.get(username=username)
-
-        follow_to_delete = user_to_unfollow.followers.filter(follower=request.user, following=user_to_unfollow)
-        if follow_to_delete:
-            follow_to_delete.delete()
-
-        return JsonResponse({"message": "Successfully unfollowed."})
+        return operation_response(*operations.unfollow(request.user, username))
 
     return JsonResponse({"message": "Invalid request method."})
 
 
 @login_required(login_url='login')
+@admit_write('post')
 def post(request):
     if request.method != "POST":
         return JsonResponse({"error": "POST request required."}, status=400)
@@ -185,91 +301,127 @@ def post(request):
     except json.JSONDecodeError:
         return JsonResponse({"error": "Invalid JSON data."}, status=400)
 
-    body = data.get("body")
-
-    if not body:
-        return JsonResponse({"error": "Message missing a 'body' parameter."}, status=400)
-
-    max_body_length = Post._meta.get_field("body").max_length
-
-    if len(body) > max_body_length:
-        return JsonResponse({"error": f"Post body exceeds the maximum length of {max_body_length} characters."},
-                            status=400)
-
-    new_post = Post(
-        user=request.user,
-        body=body
-    )
-
-    try:
-        new_post.full_clean()  # Run model validation before saving
-    except ValidationError as e:
-        return JsonResponse({"error": e.message_dict}, status=400)
-
-    new_post.save()
-
-    return JsonResponse({"message": "Post created successfully."})
+    return operation_response(*operations.create_post(request.user, data.get("body")))
 
 
+@admit_write('edit')
 def edit_post(request, post_id):
     if request.method != 'POST':
         return JsonResponse({"error": "POST request required."}, status=400)
 
-    post = get_object_or_404(Post, pk=post_id)
-
     try:
         data = json.loads(request.body)
     except json.JSONDecodeError:
         return JsonResponse({"error": "Invalid JSON data."}, status=400)
 
-    body = data.get("body")
+    return operation_response(*operations.edit_post(request.user, post_id, data.get("body")))
 
-    if not body:
-        return JsonResponse({"error": "Message missing a 'body' parameter."}, status=400)
 
-    max_body_length = Post._meta.get_field("body").max_length
+@admit_write('like')
+def like(request, post_id):
+    if request.method != 'POST':
+        return JsonResponse({"error": "POST request required."}, status=400)
 
-    if len(body) > max_body_length:
-        return JsonResponse({"error": f"Post body exceeds the maximum length of {max_body_length} characters."},
-                            status=400)
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Authentication required."}, status=401)
 
-    if body == post.body:
-        return JsonResponse({"message": "No changes were made to the post."}, status=400)
+    return operation_response(*operations.like(request.user, post_id))
 
-    if post.user != request.user:
-        return JsonResponse({"error": "You are not authorized to edit this post."}, status=403)
 
-    post.body = body
+@admit_write('like')
+def unlike(request, post_id):
+    if request.method != 'POST':
+        return JsonResponse({"error": "POST request required."}, status=400)
 
-    post.save()
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Authentication required."}, status=401)
 
-    return JsonResponse({"message": "Post updated successfully."})
+    return operation_response(*operations.unlike(request.user, post_id))
 
 
-def like(request, post_id):
+@admit_write()
+def batch(request):
     if request.method != 'POST':
         return JsonResponse({"error": "POST request required."}, status=400)
 
     if not request.user.is_authenticated:
         return JsonResponse({"error": "Authentication required."}, status=401)
 
-    post = get_object_or_404(Post, pk=post_id)  # Use get_object_or_404 to retrieve the post or return 404 if not found
+    try:
+        ops = json.loads(request.body).get("operations")
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({"error": "Invalid JSON data."}, status=400)
 
-    post.likes.add(request.user)
-    return JsonResponse({"message": "Post liked successfully."})
+    if not isinstance(ops, list) or not all(isinstance(op, dict) for op in ops):
+        return JsonResponse({"error": "'operations' must be a list of objects."}, status=400)
 
+    if len(ops) > operations.BATCH_MAX_OPERATIONS:
+        return JsonResponse({"error": f"A batch holds at most {operations.BATCH_MAX_OPERATIONS} operations."},
+                            status=400)
 
-def unlike(request, post_id):
-    if request.method != 'POST':
-        return JsonResponse({"error": "POST request required."}, status=400)
+    # Each operation takes a token of its own scope, and the whole batch is refused if any scope runs short
+    retry_after = check_rates(request, Counter(OPERATION_SCOPES.get(op.get("op")) for op in ops))
+    if retry_after is not None:
+        return too_many_requests(retry_after)
+
+    # One transaction for the whole batch, and a savepoint per operation so that a failed operation
+    # leaves the others in place
+    results = []
+    with transaction.atomic():
+        for op in ops:
+            payload, status = run_batch_operation(request.user, op)
+            results.append({"status": status, **payload})
+    return JsonResponse({"results": results})
 
+
+def run_batch_operation(user, op):
+    if op.get("op") not in operations.BATCH_OPERATIONS:
+        return {"error": f"Unknown operation {op.get('op')!r}."}, 400
+    operation, params = operations.BATCH_OPERATIONS[op["op"]]
+    missing = [param for param in params if param not in op]
+    if missing:
+        return {"error": f"Operation {op['op']!r} missing a {missing[0]!r} parameter."}, 400
+
+    if not all(operations.BATCH_PARAMETERS[param](op[param]) for param in params):
+        return {"error": f"Invalid parameters for operation {op['op']!r}."}, 400
+
+    with transaction.atomic():
+        return operation(user, *[op[param] for param in params])
+
+
+def metrics_view(request):
     if not request.user.is_authenticated:
         return JsonResponse({"error": "Authentication required."}, status=401)
 
-    post = get_object_or_404(Post, pk=post_id)
+    if not request.user.is_staff:
+        return JsonResponse({"error": "Staff access required."}, status=403)
 
-    if post.likes.filter(pk=request.user.id).exists():
-        post.likes.remove(request.user)
-        return JsonResponse({"message": "Post unliked successfully."})
-    else:
-        return JsonResponse({"error": "You have not liked this post."}, status=400)
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def export_posts(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Authentication required."}, status=401)
+
+    if not request.user.is_staff:
+        return JsonResponse({"error": "Staff access required."}, status=403)
+
+    dates = {}
+    for param in ("since", "until"):
+        if request.GET.get(param):
+            dates[param] = parse_bound(request.GET[param])
+            if dates[param] is None:
+                return JsonResponse({"error": f"'{param}' must be an ISO 8601 datetime."}, status=400)
+
+    queryset = export_queryset(request.GET.get("user"), liked_by=request.GET.get("liked_by"), **dates)
+    chunks = iter_ndjson(queryset)
+    filename = "posts.ndjson"
+    content_type = "application/x-ndjson"
+    if request.GET.get("gzip") == "1":
+        chunks = iter_gzip(chunks)
+        filename += ".gz"
+        content_type = "application/gzip"
+
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
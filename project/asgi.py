@@ -2,6 +2,7 @@
 ASGI config for project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it (e.g. ``uvicorn project.asgi:application``) for the /api/events stream and the async API.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -39,6 +39,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'network.instrumentation.performance_middleware',
+    'network.db.replica_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -71,15 +73,173 @@ WSGI_APPLICATION = 'project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
+# Configured from the environment: DB_ENGINE, DB_NAME, DB_USER, DB_PASSWORD, DB_HOST and DB_PORT.
+# Connections are kept for DB_CONN_MAX_AGE seconds and checked before reuse; set DB_CONN_MAX_AGE=0
+# under ASGI, where async requests do not share persistent connections.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'ENGINE': os.environ.get('DB_ENGINE', 'django.db.backends.sqlite3'),
+        'NAME': os.environ.get('DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+        'USER': os.environ.get('DB_USER', ''),
+        'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+        'HOST': os.environ.get('DB_HOST', ''),
+        'PORT': os.environ.get('DB_PORT', ''),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1',
     }
 }
 
+# A read replica of the primary, at DB_REPLICA_HOST or, for SQLite, in the DB_REPLICA_NAME file. The
+# feed and profile views read from it once either is set (see network.db); until then the alias is the
+# primary database itself and is not used.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': os.environ.get('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+    'HOST': os.environ.get('DB_REPLICA_HOST', DATABASES['default']['HOST']),
+}
+NETWORK_READ_REPLICA = 'replica' if 'DB_REPLICA_NAME' in os.environ or 'DB_REPLICA_HOST' in os.environ else None
+
+# How long, in seconds, a client that has written reads from the primary, covering the replica lag
+NETWORK_REPLICA_PIN_SECONDS = 5
+
+DATABASE_ROUTERS = ['network.db.PrimaryReplicaRouter']
+
+# Pragmas set on every new SQLite connection (see network.db.sqlite_pragmas)
+NETWORK_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+}
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# Each process has a cache of its own, unless CACHE_URL names a Redis server shared by every process
+# (which needs the redis package), e.g. redis://localhost:6379/0. Caches whose entries must be dropped
+# in every process when the data changes are only used with a shared cache (SHARED_CACHE).
+CACHE_URL = os.environ.get('CACHE_URL')
+SHARED_CACHE = bool(CACHE_URL)
+if SHARED_CACHE:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Rendered anonymous feed pages (see network.cache) live in this cache for at most this many seconds. Like
+# the follow graph cache, it must be shared by every process; without one (None), pages are not cached.
+NETWORK_FEED_CACHE_ALIAS = 'default' if SHARED_CACHE else None
+NETWORK_FEED_CACHE_TIMEOUT = 300
+
+# The follow graph cache (see network.follows) and how long, in seconds, it keeps a user's followed ids.
+# It must be shared by every process, since a follow only drops the entry from the cache it is made
+# through; without one (None), followed ids are read from the database.
+NETWORK_FOLLOW_CACHE_ALIAS = 'default' if SHARED_CACHE else None
+NETWORK_FOLLOW_CACHE_TIMEOUT = 3600
+
+# Post search (see network.search) ranks only this many of the newest matches of a query
+NETWORK_SEARCH_WINDOW = 10000
+
+# Serve the JSON API from the async views in network/async_views.py (for ASGI deployments)
+NETWORK_ASYNC_API = False
+
+# Buffer likes and unlikes per process and write them in batches (see network.likes): a batch is
+# flushed once it holds this many entries, or this many seconds after its first one. Users only read
+# their own pending likes from the process that buffered them, so this needs a single process, or
+# clients kept on one. It writes likes about 20 times faster, but serves the like view only about twice
+# as fast, where the rest of the request then dominates (see the bench_likes command).
+NETWORK_LIKE_BATCHING = False
+NETWORK_LIKE_BATCH_SIZE = 500
+NETWORK_LIKE_BATCH_INTERVAL = 1.0
+
+# Event streams (see network.events): the pub/sub hub delivering events to the streams, and how often
+# (in seconds) an idle stream sends a keepalive and how long a stream lasts before the browser reopens it
+NETWORK_EVENT_HUB = 'network.events.LocalEventHub'
+NETWORK_EVENTS_KEEPALIVE = 15
+NETWORK_EVENTS_MAX_AGE = 300
+
+# API response encoding (see network.encoding): 'orjson', 'stdlib' or 'auto' (orjson if installed), and
+# how many pre-encoded posts are kept for splicing into responses by the stdlib encoder
+NETWORK_JSON_ENCODER = 'auto'
+NETWORK_JSON_FRAGMENT_CACHE_SIZE = 10000
+
+# Request instrumentation (see network.instrumentation): whether responses carry a Server-Timing header,
+# and the duration above which a request is logged as a warning on the "network.performance" logger
+NETWORK_SERVER_TIMING = True
+NETWORK_SLOW_REQUEST_MS = 500
+
+# Logging
+# https://docs.djangoproject.com/en/4.2/topics/logging/
+
+# Every request is logged at INFO, slow ones at WARNING: set NETWORK_PERFORMANCE_LOG_LEVEL=INFO to see all
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'network.performance': {
+            'handlers': ['console'],
+            'level': os.environ.get('NETWORK_PERFORMANCE_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
 AUTH_USER_MODEL = "network.User"
 
+# With a shared cache, sessions are read from the cache, falling back to the database, and users are
+# cached by the authentication backend in NETWORK_USER_CACHE_ALIAS for NETWORK_USER_CACHE_TIMEOUT seconds
+# (see network.auth), so that logged-in reads make no session or user query. Both stay in the database
+# with a cache per process, where a logout or password change would only drop them from one process's
+# cache. ModelBackend stays listed for the sessions authenticated with it.
+# 'django.contrib.sessions.backends.signed_cookies' needs no storage at all, but its sessions cannot be
+# revoked server-side.
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.cached_db' if SHARED_CACHE
+                                else 'django.contrib.sessions.backends.db')
+AUTHENTICATION_BACKENDS = ['network.auth.CachedModelBackend', 'django.contrib.auth.backends.ModelBackend']
+NETWORK_USER_CACHE_ALIAS = 'default' if SHARED_CACHE else None
+NETWORK_USER_CACHE_TIMEOUT = 60
+
+# Write admission control (see network.ratelimit). Each user, or IP address when logged out, may make
+# this many writes of each scope per second (s), minute (m), hour (h) or day (d), batch operations
+# included; a scope left out is not limited. Buckets live in the NETWORK_RATE_LIMIT_CACHE_ALIAS cache,
+# which should be shared by all the processes. At most NETWORK_WRITE_CONCURRENCY writes run at once in
+# each process (None for no limit), and the next ones are refused with a Retry-After of
+# NETWORK_WRITE_GATE_RETRY_AFTER seconds.
+NETWORK_RATE_LIMITS = {
+    'post': '10/m',
+    'edit': '30/m',
+    'like': '300/m',
+    'follow': '60/m',
+}
+NETWORK_RATE_LIMIT_CACHE_ALIAS = 'default'
+NETWORK_WRITE_CONCURRENCY = 4
+NETWORK_WRITE_GATE_RETRY_AFTER = 1
+
+# Home timelines (see network.models.TimelineEntry): how many posts each materialized timeline keeps,
+# and the follower count above which an author's posts are merged in at read time instead of fanned out
+NETWORK_TIMELINE_LENGTH = 800
+NETWORK_TIMELINE_FANOUT_LIMIT = 10000
+
+# Ranked feed (see network.ranking): likes lose a factor e of weight every NETWORK_RANKED_DECAY_HOURS,
+# the author's audience counts as log(1 + followers) times NETWORK_RANKED_AUTHOR_WEIGHT, and readers
+# who follow the author see the post NETWORK_RANKED_FOLLOW_BONUS higher. Scores are refreshed by the
+# refresh_scores command, e.g. `manage.py refresh_scores --interval 60`.
+NETWORK_RANKED_DECAY_HOURS = 12
+NETWORK_RANKED_AUTHOR_WEIGHT = 0.5
+NETWORK_RANKED_FOLLOW_BONUS = 2.0
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 